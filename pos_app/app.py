@@ -1,5 +1,6 @@
 # main.py
 import os
+import threading
 from kivymd.app import MDApp
 from kivy.lang import Builder
 from kivy.core.window import Window
@@ -9,6 +10,9 @@ from components.customsnackbar import CustomSnackbar
 from core.api_client import ApiClient
 from core.auth_manager import AuthManager
 from core.database.database_manager import DatabaseManager
+from core.database.db_executor import DbExecutor
+from core.database.maintenance import MaintenanceScheduler
+from core.database.backup import BackupService
 from screens.scan_invoice_screen import ScanInvoiceScreen
 import screens
 from screens.invoice_edit_screen import InvoiceEditScreen
@@ -38,13 +42,44 @@ class POSApp(MDApp):
     temp_name = ""
     scan_for_invoice = True
     temp_product_id = None
+    # Путь к базе; None - база по умолчанию рядом с приложением
+    db_path = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.db = DatabaseManager()
+        # База открывается в фоновом потоке, пока загружаются KV-файлы и первый экран
+        self._db = None
+        self._db_error = None
+        self._db_ready = threading.Event()
+        threading.Thread(target=self._open_database, daemon=True).start()
+        # Запросы экранов выполняются в рабочих потоках, результат приходит через Clock
+        self.db_executor = DbExecutor(lambda: self.db)
+        # Обслуживание базы (сироты, статистика, vacuum) в периоды простоя
+        self.maintenance = MaintenanceScheduler(self.db_executor)
+        # Ежедневная резервная копия базы в фоновом потоке
+        self.backup = BackupService(lambda: self.db)
         self.api = ApiClient("https://leema.kz")  # Укажите ваш URL API
         self.auth = AuthManager("https://leema.kz")
 
+    def _open_database(self):
+        """Открытие базы данных и проверка схемы вне главного потока"""
+        try:
+            # Пул соединений в режиме WAL: чтение из фоновых потоков не блокирует запись
+            self._db = DatabaseManager(self.db_path, pooled=True)
+        except Exception as e:
+            print(f"Ошибка при открытии базы данных: {e}")
+            self._db_error = e
+        finally:
+            self._db_ready.set()
+
+    @property
+    def db(self):
+        """Менеджер базы данных; первое обращение дожидается окончания открытия"""
+        self._db_ready.wait()
+        if self._db_error is not None:
+            raise self._db_error
+        return self._db
+
     def build(self):
         self.theme_cls.primary_palette = "Blue"
         self.theme_cls.primary_hue = "500"
@@ -114,6 +149,8 @@ class POSApp(MDApp):
         self.root.add_widget(InvoiceHistoryScreen(name='invoice_history'))
         self.root.add_widget(InvoiceEditScreen(name='invoice_edit'))
         self.root.add_widget(ProductSearchScreen(name='product_search'))
+        # Скрытый экран диагностики базы (открывается с главного экрана)
+        self.root.add_widget(screens.DiagnosticsScreen(name='diagnostics'))
 
         # Добавьте в класс POSApp новые атрибуты:
         # editing_invoice_id - ID редактируемой накладной
@@ -122,6 +159,9 @@ class POSApp(MDApp):
         self.editing_invoice_id = 0
         self.scan_return_screen = 'main'
 
+        self.maintenance.start()
+        self.backup.start(only_if_due=True)
+
         if self.auth.is_authenticated():
             self.api.set_auth_token(self.auth.token)
             self.root.current = 'main'  # Автоматический вход, если авторизован
@@ -225,22 +265,7 @@ class POSApp(MDApp):
         if total == 0:
             payment_status = "В долг"
 
-        invoice_id = self.db.create_invoice(total, payment_status)
-
-        for item in self.current_invoice:
-            self.db.add_invoice_item(
-                invoice_id,
-                item['product_id'],
-                item['quantity'],
-                item['price'],
-                item['total']
-            )
-
-            product = self.db.find_product_by_id(item['product_id'])
-            new_quantity = product['quantity'] - item['quantity']
-            if new_quantity < 0:
-                new_quantity = 0
-            self.db.update_product_quantity(item['product_id'], new_quantity)
+        invoice_id = self.db.commit_sale(self.current_invoice, payment_status, total=total)
 
         self.current_invoice = []
         self.show_snackbar(f"Накладная #{invoice_id} сохранена", 2)
@@ -274,7 +299,13 @@ class POSApp(MDApp):
 
     def on_stop(self):
         """При остановке приложения"""
-        self.db.close()
+        self.maintenance.stop()
+        # Ждущие запросы отменяются, выполняющиеся и копирование доводятся до конца:
+        # закрывать базу под ними нельзя
+        self.db_executor.shutdown(wait=True)
+        self.backup.stop()
+        if self._db is not None:
+            self._db.close()
 
     def show_snackbar(self, text, duration=1.5):
         """Удобный метод для показа уведомлений"""
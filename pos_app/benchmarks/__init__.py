@@ -0,0 +1,9 @@
+# benchmarks/__init__.py
+"""Генерация синтетических баз, замеры производительности и проверка планов запросов.
+
+Запуск из каталога pos_app:
+    python -m benchmarks.query_plan_audit
+    python -m benchmarks.data_layer --sizes 1000,10000 --output results.json
+    python -m benchmarks.row_benchmark 50000
+    xvfb-run -a python -m benchmarks.ui_lists --sizes 100,1000,10000 --output ui_lists.json
+"""
@@ -0,0 +1,338 @@
+# data_layer.py
+"""Замеры методов DatabaseManager на синтетических базах разного размера.
+
+Для каждого размера каталога генерируется (или берется из кэша) база
+с историей продаж, каждый метод вызывается многократно со случайными
+реалистичными аргументами, и в JSON попадают p50/p95/p99, пиковая память
+Python на вызов и пиковый RSS процесса. Методы, у которых p95 превышает
+бюджет (интерактивный или фоновый), отмечаются для каждого размера.
+
+Запуск из каталога pos_app:
+    python -m benchmarks.data_layer --sizes 1000,10000,50000 --years 2 --output data_layer.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.datagen import cached_database, working_copy
+from core.database.database_manager import DatabaseManager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (1000, 10000, 50000, 200000)
+# Задержка, после которой касса заметно "подвисает", мс
+INTERACTIVE_BUDGET_MS = 100
+# Импорт, выгрузки и обслуживание идут в фоне - для них бюджет мягче
+BACKGROUND_BUDGET_MS = 1000
+BACKGROUND_METHODS = ('upsert_products_1000', 'iter_invoices_month', 'iter_invoice_items_month',
+                      'checkpoint_stock', 'rebuild_analytics_rollups', 'archive_old_invoices')
+SEARCH_WORDS = ('молоко', 'хлеб', 'сыр', 'кофе', 'шоколад', 'колбаса', 'вода', 'порошок', 'яблоки', 'чай')
+
+
+def peak_rss_kb():
+    """Пиковый RSS процесса в КБ (None, если платформа не сообщает)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux - килобайты
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Workload:
+    """Случайные аргументы методов, похожие на работу кассы"""
+
+    def __init__(self, db, seed=7):
+        """Чтение опорных значений из базы"""
+        self.db = db
+        self.rng = random.Random(seed)
+        cursor = db.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("SELECT id, barcode, name, price FROM products ORDER BY id")
+        self.products = cursor.fetchall()
+        cursor.execute("SELECT MIN(id), MAX(id) FROM invoices")
+        self.min_invoice, self.max_invoice = cursor.fetchone()
+        cursor.close()
+
+        self.today = datetime.date.today()
+        self.barcodes_seen = 0
+
+    def product(self):
+        """Случайный товар: (id, штрих-код, название, цена)"""
+        return self.rng.choice(self.products)
+
+    def invoice_id(self):
+        """Случайная существующая накладная (ID идут подряд)"""
+        return self.rng.randint(self.min_invoice, self.max_invoice)
+
+    def period(self, days):
+        """Период из целых дней, заканчивающийся сегодня"""
+        start = self.today - datetime.timedelta(days=days - 1)
+        return f"{start:%Y-%m-%d} 00:00:00", f"{self.today:%Y-%m-%d} 23:59:59"
+
+    def partial_period(self, days):
+        """Период, начинающийся не с полуночи (мимо дневных агрегатов)"""
+        start, end = self.period(days)
+        return start[:11] + "10:30:00", end
+
+    def lines(self, count):
+        """Позиции продажи из случайных товаров"""
+        lines = []
+        for product_id, _, _, price in self.rng.sample(self.products, count):
+            quantity = self.rng.randint(1, 3)
+            lines.append({'product_id': product_id, 'quantity': quantity, 'price': price,
+                          'total': quantity * price})
+        return lines
+
+    def new_barcode(self):
+        """Штрих-код, которого еще нет в базе"""
+        self.barcodes_seen += 1
+        return f"29{os.getpid() % 1000:03d}{self.barcodes_seen:08d}"
+
+
+def benchmark_cases(db, work):
+    """Список (имя, вызов, число повторов) для всех методов DatabaseManager
+
+    Вызов получает Workload и сам выбирает аргументы. Тяжелые методы
+    повторяются меньше раз.
+    """
+    def find_cold(w):
+        db.product_cache.clear()
+        return db.find_product_by_barcode(w.product()[1])
+
+    def history(search):
+        # То же, что InvoiceHistoryScreen.load_invoices: первая страница за последние 30 дней
+        return lambda w: db.search_invoices_page(*w.period(30), search)
+
+    def history_next_page(w):
+        invoices, token = db.get_invoices_page(*w.period(30), limit=50)
+        return db.get_invoices_page(*w.period(30), after=token, limit=50) if token else invoices
+
+    def edit_invoice(w):
+        invoice_id = w.invoice_id()
+        items = db.get_invoice_items(invoice_id)
+        lines = [{'product_id': item['product_id'], 'quantity': item['quantity'], 'price': item['price'],
+                  'total': item['total']} for item in items]
+        if lines:
+            lines[0] = dict(lines[0], quantity=lines[0]['quantity'] + 1,
+                            total=(lines[0]['quantity'] + 1) * lines[0]['price'])
+        return db.apply_invoice_diff(invoice_id, lines + w.lines(1))
+
+    def upsert_chunk(w):
+        chunk = []
+        for product_id, barcode, name, price in w.rng.sample(w.products, min(1000, len(w.products))):
+            chunk.append({'barcode': barcode, 'name': name, 'price': price, 'quantity': w.rng.randint(0, 100)})
+        return db.upsert_products(chunk)
+
+    return [
+        # Касса: сканирование и продажа
+        ('find_product_by_barcode', lambda w: db.find_product_by_barcode(w.product()[1]), 200),
+        ('find_product_by_barcode_cold', find_cold, 200),
+        ('find_product_by_id', lambda w: db.find_product_by_id(w.product()[0]), 200),
+        ('commit_sale', lambda w: db.commit_sale(w.lines(w.rng.randint(1, 6))), 100),
+        ('commit_sale_wholesale', lambda w: db.commit_sale(w.lines(min(60, len(w.products)))), 20),
+        # Каталог и поиск
+        ('search_products', lambda w: db.search_products(w.rng.choice(SEARCH_WORDS)), 50),
+        ('search_products_short', lambda w: db.search_products(w.rng.choice(SEARCH_WORDS)[:2]), 20),
+        ('search_products_page', lambda w: db.search_products_page(w.rng.choice(SEARCH_WORDS)), 50),
+        ('get_products_page', lambda w: db.get_products_page('name', None, 50), 50),
+        ('get_products_page_deep', lambda w: db.get_products_page('name', (w.product()[2], 0), 50), 50),
+        ('get_all_products', lambda w: db.get_all_products('name'), 5),
+        ('add_product', lambda w: db.add_product(w.new_barcode(), "Новый товар", 100, 60, 5), 50),
+        ('update_product', lambda w: db.update_product(w.product()[0], "Товар", 120, 70, 10), 50),
+        ('update_product_quantity', lambda w: db.update_product_quantity(w.product()[0], 25), 50),
+        ('upsert_products_1000', upsert_chunk, 5),
+        ('record_stock_movement', lambda w: db.record_stock_movement(w.product()[0], 'receipt', 10), 50),
+        ('get_stock_movements', lambda w: db.get_stock_movements(w.product()[0]), 50),
+        ('get_stock_at', lambda w: db.get_stock_at(w.product()[0], w.period(90)[0]), 50),
+        # История накладных
+        ('get_invoice', lambda w: db.get_invoice(w.invoice_id()), 100),
+        ('get_invoice_items', lambda w: db.get_invoice_items(w.invoice_id()), 100),
+        ('screen:invoice_history.search_invoices_page', history(''), 50),
+        ('screen:invoice_history.search_invoices_page_paid', history('оплачено'), 50),
+        ('screen:invoice_history.search_invoices_page_unpaid', history('не оплачено'), 50),
+        ('screen:invoice_history.search_invoices_page_number', history('12'), 50),
+        ('filter_invoices_month', lambda w: db.filter_invoices(*w.period(30)), 20),
+        ('get_invoices_page', lambda w: db.get_invoices_page(*w.period(30), limit=50), 50),
+        ('get_invoices_page_next', history_next_page, 50),
+        ('get_invoices_by_period_day', lambda w: db.get_invoices_by_period(*w.period(1)), 50),
+        ('get_invoices_by_period_month', lambda w: db.get_invoices_by_period(*w.period(30)), 10),
+        ('apply_invoice_diff', edit_invoice, 50),
+        ('delete_invoice', lambda w: db.delete_invoice(w.invoice_id()), 20),
+        # Аналитика
+        ('get_sales_analytics_month', lambda w: db.get_sales_analytics(*w.period(30)), 30),
+        ('get_sales_analytics_year', lambda w: db.get_sales_analytics(*w.period(365)), 20),
+        ('get_sales_analytics_partial_month', lambda w: db.get_sales_analytics(*w.partial_period(30)), 10),
+        ('get_profit_analytics_month', lambda w: db.get_profit_analytics(*w.period(30)), 30),
+        ('get_profit_analytics_partial_month', lambda w: db.get_profit_analytics(*w.partial_period(30)), 10),
+        ('get_top_products_month', lambda w: db.get_top_products(*w.period(30), 10), 30),
+        ('get_top_products_partial_month', lambda w: db.get_top_products(*w.partial_period(30), 10), 10),
+        # Выгрузки и обслуживание
+        ('iter_invoices_month', lambda w: sum(1 for _ in db.iter_invoices(*w.period(30))), 5),
+        ('iter_invoice_items_month', lambda w: sum(1 for _ in db.iter_invoice_items(*w.period(30))), 5),
+        ('get_setting', lambda w: db.get_setting('benchmark_dataset'), 100),
+        ('set_setting', lambda w: db.set_setting('benchmark_probe', str(w.rng.random())), 50),
+        ('checkpoint_stock', lambda w: db.checkpoint_stock(), 3),
+        ('rebuild_analytics_rollups', lambda w: db.rebuild_analytics_rollups(), 2),
+        ('archive_old_invoices', lambda w: db.archive_old_invoices(horizon_days=300, batch_size=500), 1),
+    ]
+
+
+def measure(call, work, repeats, time_budget):
+    """Времена вызовов (мс) и пиковая память Python одного вызова (КБ)"""
+    # Прогрев: кэш страниц SQLite и подготовленные операторы
+    call(work)
+
+    timings = []
+    deadline = time.perf_counter() + time_budget
+    for _ in range(repeats):
+        started = time.perf_counter()
+        call(work)
+        timings.append((time.perf_counter() - started) * 1000)
+        if time.perf_counter() > deadline:
+            break
+
+    tracemalloc.start()
+    call(work)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak / 1024
+
+
+def run_size(products, years, invoices_per_day, cache_dir, work_dir, time_budget, only=None, log=None):
+    """Замеры всех методов на базе одного размера"""
+    source = cached_database(cache_dir, products, years, invoices_per_day, progress=log)
+    path = working_copy(source, work_dir)
+    db = DatabaseManager(path, pooled=True)
+    work = Workload(db)
+    results = {}
+
+    try:
+        cursor = db.conn.cursor()
+        cursor.row_factory = None
+        counts = {}
+        for table in ('products', 'invoices', 'invoice_items', 'stock_movements'):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+        cursor.close()
+
+        for name, call, repeats in benchmark_cases(db, work):
+            if only and not any(part in name for part in only):
+                continue
+            if log is not None:
+                log(f"  {products}: {name}")
+            try:
+                timings, python_peak_kb = measure(call, work, repeats, time_budget)
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+                continue
+
+            timings.sort()
+            p95 = percentile(timings, 0.95)
+            budget = BACKGROUND_BUDGET_MS if name in BACKGROUND_METHODS else INTERACTIVE_BUDGET_MS
+            results[name] = {
+                'n': len(timings),
+                'min_ms': round(timings[0], 3),
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(p95, 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'max_ms': round(timings[-1], 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'python_peak_kb': round(python_peak_kb, 1),
+                'budget_ms': budget,
+                'over_budget': p95 > budget,
+            }
+    finally:
+        db.close()
+
+    return {
+        'products': products,
+        'years': years,
+        'invoices_per_day': invoices_per_day,
+        'rows': counts,
+        'database_bytes': os.path.getsize(source),
+        'peak_rss_kb': peak_rss_kb(),
+        'methods': results,
+    }
+
+
+def breaking_points(sizes):
+    """Для каждого метода - наименьший каталог, на котором p95 вышел за бюджет"""
+    points = {}
+    for size in sizes:
+        for name, result in size['methods'].items():
+            if result.get('over_budget') and name not in points:
+                points[name] = size['products']
+    return points
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    parser = argparse.ArgumentParser(description="Замеры методов DatabaseManager на синтетических базах")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="размеры каталога через запятую")
+    parser.add_argument('--years', type=float, default=2, help="лет истории продаж")
+    parser.add_argument('--invoices-per-day', type=int, default=120)
+    parser.add_argument('--time-budget', type=float, default=3.0, help="секунд на метод")
+    parser.add_argument('--only', default='', help="подстроки имен методов через запятую")
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'pos_benchmark_cache'))
+    parser.add_argument('--output', help="файл JSON (по умолчанию - стандартный вывод)")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    only = [part for part in args.only.split(',') if part]
+    report = {
+        'benchmark': 'data_layer',
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'interactive_budget_ms': INTERACTIVE_BUDGET_MS,
+        'background_budget_ms': BACKGROUND_BUDGET_MS,
+        'sizes': [],
+    }
+
+    # Сообщения миграций не должны попадать в JSON на стандартном выводе
+    with tempfile.TemporaryDirectory(prefix="pos_bench_") as work_dir, contextlib.redirect_stdout(sys.stderr):
+        for products in sizes:
+            log(f"Каталог {products} товаров, {args.years} г. истории")
+            report['sizes'].append(run_size(
+                products, args.years, args.invoices_per_day, args.cache_dir,
+                os.path.join(work_dir, str(products)), args.time_budget, only, log
+            ))
+
+    report['breaking_points'] = breaking_points(report['sizes'])
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        log(f"Результаты записаны в {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# datagen.py
+"""Генератор реалистичных баз POS в текущей схеме.
+
+Каталог из групп и подгрупп с валидными EAN-13, продажи по закону Ципфа
+(немногие ходовые товары дают большую часть строк), накладные за заданное
+число лет с суточным и недельным ритмом, редкие оптовые накладные на
+десятки позиций, долги. Остатки проходят через журнал движений: начальное
+поступление, продажи и ежемесячное пополнение проданного.
+
+Запуск из каталога pos_app:
+    python -m benchmarks.datagen путь.db [товаров] [лет]
+"""
+import datetime
+import os
+import random
+import shutil
+import sys
+import time
+
+from core.database.database_manager import DatabaseManager
+from core.database.maintenance import DatabaseMaintenance
+
+# Группа -> (подгруппы, единица, диапазон цены)
+CATALOG = {
+    'Молочные продукты': (('Молоко', 'Кефир', 'Сметана', 'Творог', 'Йогурт', 'Сыр'), 'шт', (250, 2500)),
+    'Хлеб и выпечка': (('Хлеб', 'Батон', 'Лепешка', 'Булочка', 'Печенье'), 'шт', (100, 1200)),
+    'Бакалея': (('Крупа', 'Макароны', 'Мука', 'Сахар', 'Соль', 'Масло'), 'шт', (200, 3500)),
+    'Напитки': (('Вода', 'Сок', 'Лимонад', 'Чай', 'Кофе'), 'шт', (150, 6000)),
+    'Мясо и колбасы': (('Колбаса', 'Сосиски', 'Фарш', 'Курица', 'Говядина'), 'кг', (900, 6500)),
+    'Овощи и фрукты': (('Картофель', 'Лук', 'Морковь', 'Яблоки', 'Бананы', 'Помидоры'), 'кг', (150, 1800)),
+    'Бытовая химия': (('Мыло', 'Шампунь', 'Порошок', 'Средство для посуды'), 'шт', (300, 4500)),
+    'Кондитерские изделия': (('Шоколад', 'Конфеты', 'Вафли', 'Торт'), 'шт', (150, 7000)),
+}
+BRANDS = ('Родные просторы', 'Лазурь', 'Алтын', 'Север', 'Солнечный', 'Домашний', 'Эко', 'Премиум',
+          'Степной', 'Горный', 'Фермерский', 'Семейный')
+SIZES = ('0,2', '0,5', '0,9', '1', '1,5', '2', '250 г', '400 г', '800 г', '1 кг')
+
+# Начальный остаток в месяцах продаж и средние строки и штуки на накладную
+OPENING_STOCK_MONTHS = 2
+LINES_PER_INVOICE = 3.5
+UNITS_PER_LINE = 2.5
+
+
+def ean13(number):
+    """Штрих-код EAN-13 с префиксом 46 и контрольной цифрой"""
+    body = f"46{number:010d}"
+    checksum = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(body))
+    return body + str((10 - checksum % 10) % 10)
+
+
+def zipf_cum_weights(count, exponent):
+    """Накопленные веса рангов 1..count по закону Ципфа"""
+    cumulative = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def generate_products(db, count, rng, created_at):
+    """Вставка каталога; возвращает список (id, цена, себестоимость)"""
+    groups = list(CATALOG.items())
+    created_ts = db.to_timestamp(created_at)
+    rows = []
+    for number in range(1, count + 1):
+        group, (subgroups, unit, (low, high)) = groups[number % len(groups)]
+        subgroup = subgroups[(number // len(groups)) % len(subgroups)]
+        brand = BRANDS[rng.randrange(len(BRANDS))]
+        price = round(rng.uniform(low, high) / 10) * 10
+        cost_price = round(price * rng.uniform(0.6, 0.85), 2)
+        name = f"{subgroup} {brand} {SIZES[number % len(SIZES)]} №{number}"
+        rows.append((ean13(number), name, price, cost_price, 0, unit, group, subgroup,
+                     created_at, created_at, created_ts))
+
+    db.conn.executemany('''
+    INSERT INTO products (barcode, name, price, cost_price, quantity, unit, group_name, subgroup,
+                          created_at, updated_at, updated_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    db.conn.commit()
+
+    cursor = db.conn.cursor()
+    cursor.row_factory = None
+    cursor.execute("SELECT id, price, cost_price FROM products ORDER BY id")
+    return cursor.fetchall()
+
+
+def generate_database(path, products=1000, years=1, invoices_per_day=120, zipf_exponent=1.1,
+                      wholesale_share=0.02, debt_share=0.1, seed=42, end_date=None, progress=None):
+    """Создание базы по параметрам; возвращает сводку (строк в таблицах, секунд)"""
+    started = time.monotonic()
+    rng = random.Random(seed)
+    end_day = end_date or datetime.date.today()
+    start_day = end_day - datetime.timedelta(days=int(365 * years) - 1)
+    start_text = f"{start_day:%Y-%m-%d} 08:00:00"
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    archive_path = os.path.splitext(path)[0] + '_archive.db'
+    if os.path.exists(archive_path):
+        os.remove(archive_path)
+
+    db = DatabaseManager(path)
+    try:
+        catalog = generate_products(db, products, rng, start_text)
+        product_ids = [row[0] for row in catalog]
+        prices = {row[0]: (row[1], row[2]) for row in catalog}
+
+        # Ходовые товары разбросаны по каталогу, а не собраны в его начале
+        ranked = product_ids[:]
+        rng.shuffle(ranked)
+        cum_weights = zipf_cum_weights(len(ranked), zipf_exponent)
+
+        # Начальный остаток - примерно два месяца продаж товара
+        units_per_month = invoices_per_day * 30 * LINES_PER_INVOICE * UNITS_PER_LINE
+        start_ts = db.to_timestamp(start_text)
+        # Журнал остатков ведется с начала истории - все накладные списаны по нему
+        db.set_setting('stock_ledger_since_ts', str(start_ts))
+        db.stock_ledger_since_ts = start_ts
+        db.conn.executemany('''
+        INSERT INTO stock_movements (product_id, kind, quantity, created_ts, note)
+        VALUES (?, 'receipt', ?, ?, 'Начальный остаток')
+        ''', [(product_id,
+               int(units_per_month * OPENING_STOCK_MONTHS * (1.0 / (rank + 1) ** zipf_exponent) / cum_weights[-1])
+               + rng.randint(5, 40),
+               start_ts)
+              for rank, product_id in enumerate(ranked)])
+
+        invoice_id = 0
+        items_count = 0
+        sold_this_month = {}
+        day = start_day
+        while day <= end_day:
+            if day.day == 1 and sold_this_month:
+                # Пополнение проданного за прошлый месяц
+                restock_ts = db.to_timestamp(f"{day:%Y-%m-%d} 07:30:00")
+                db.conn.executemany('''
+                INSERT INTO stock_movements (product_id, kind, quantity, created_ts, note)
+                VALUES (?, 'receipt', ?, ?, 'Пополнение')
+                ''', [(product_id, quantity, restock_ts) for product_id, quantity in sold_this_month.items()])
+                sold_this_month = {}
+
+            # Выходные на четверть оживленнее будней
+            volume = invoices_per_day * (1.25 if day.weekday() >= 5 else 1.0)
+            count = max(1, int(rng.gauss(volume, volume * 0.15)))
+            seconds = sorted(rng.randrange(9 * 3600, 21 * 3600) for _ in range(count))
+
+            invoices = []
+            items = []
+            movements = []
+            for second in seconds:
+                invoice_id += 1
+                date = f"{day:%Y-%m-%d} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"
+                date_ts = db.to_timestamp(date)
+
+                wholesale = rng.random() < wholesale_share
+                line_count = rng.randint(20, 60) if wholesale else min(15, 1 + int(rng.expovariate(1 / 2.5)))
+                lines = {}
+                for product_id in rng.choices(ranked, cum_weights=cum_weights, k=line_count):
+                    quantity = rng.randint(5, 50) if wholesale else (1 if rng.random() < 0.7 else rng.randint(2, 5))
+                    lines[product_id] = lines.get(product_id, 0) + quantity
+
+                total = 0
+                for product_id, quantity in lines.items():
+                    price, cost_price = prices[product_id]
+                    items.append((invoice_id, product_id, quantity, price, quantity * price, cost_price))
+                    movements.append((product_id, -quantity, invoice_id, date_ts))
+                    sold_this_month[product_id] = sold_this_month.get(product_id, 0) + quantity
+                    total += quantity * price
+
+                status = "В долг" if rng.random() < debt_share else "Оплачено"
+                invoices.append((invoice_id, date, total, status, '', date, date_ts, date_ts))
+
+            db.conn.executemany('''
+            INSERT INTO invoices (id, date, total, payment_status, additional_info, created_at, date_ts, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', invoices)
+            db.conn.executemany('''
+            INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', items)
+            db.conn.executemany('''
+            INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts)
+            VALUES (?, 'sale', ?, ?, ?)
+            ''', movements)
+            items_count += len(items)
+
+            if day.day == 1:
+                db.conn.commit()
+                if progress is not None:
+                    progress(f"{path}: {day:%Y-%m}, накладных {invoice_id}")
+            day += datetime.timedelta(days=1)
+
+        db.conn.commit()
+        db.rebuild_analytics_rollups()
+        # Статистика планировщика, как после обслуживания на устройстве
+        DatabaseMaintenance(db).optimize()
+        db.set_setting('benchmark_dataset', f"{products}x{years}")
+    finally:
+        db.close()
+
+    return {
+        'path': path,
+        'products': products,
+        'years': years,
+        'invoices': invoice_id,
+        'invoice_items': items_count,
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.monotonic() - started, 1),
+    }
+
+
+def cached_database(cache_dir, products, years=1, invoices_per_day=120, seed=42, progress=None):
+    """Путь к базе с такими параметрами; создается при первом обращении
+
+    Базы зависят от текущей даты (история заканчивается сегодня), поэтому
+    в имя файла входит дата генерации.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    name = f"pos_{products}p_{years}y_{invoices_per_day}d_s{seed}_{datetime.date.today():%Y%m%d}.db"
+    path = os.path.join(cache_dir, name)
+    if not os.path.exists(path):
+        temp_path = os.path.join(cache_dir, 'generating-' + name)
+        generate_database(temp_path, products, years, invoices_per_day, seed=seed, progress=progress)
+        os.replace(temp_path, path)
+        temp_archive = os.path.splitext(temp_path)[0] + '_archive.db'
+        if os.path.exists(temp_archive):
+            os.replace(temp_archive, os.path.splitext(path)[0] + '_archive.db')
+    return path
+
+
+def working_copy(path, work_dir):
+    """Копия базы для замеров, меняющих данные"""
+    os.makedirs(work_dir, exist_ok=True)
+    target = os.path.join(work_dir, os.path.basename(path))
+    shutil.copyfile(path, target)
+    archive = os.path.splitext(path)[0] + '_archive.db'
+    if os.path.exists(archive):
+        shutil.copyfile(archive, os.path.splitext(target)[0] + '_archive.db')
+    return target
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Использование: python -m benchmarks.datagen путь.db [товаров] [лет]")
+        return 2
+
+    summary = generate_database(
+        argv[0],
+        products=int(argv[1]) if len(argv) > 1 else 1000,
+        years=float(argv[2]) if len(argv) > 2 else 1,
+        progress=print
+    )
+    print(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# query_plan_audit.py
+"""Проверка планов запросов DatabaseManager.
+
+Создает временную базу с тестовыми данными, вызывает каждый метод
+DatabaseManager (в том числе запросы, которые раньше выполнялись прямо
+из экранов), перехватывает весь выполненный SQL и прогоняет его через
+EXPLAIN QUERY PLAN. Полный просмотр (SCAN) большой таблицы считается
+ошибкой, если метод не внесен в список допустимых.
+
+Запуск из каталога pos_app:
+    python -m benchmarks.query_plan_audit
+Код возврата 1, если найдены нарушения.
+"""
+import datetime
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from core.database.database_manager import DatabaseManager
+
+# Таблицы, полный просмотр которых растет вместе с магазином
+LARGE_TABLES = {'products', 'invoices', 'invoice_items', 'daily_sales', 'daily_product_sales',
+                'stock_movements', 'stock_checkpoints'}
+
+# Методы, которым полный просмотр разрешен по смыслу
+ALLOWED_SCANS = {
+    'get_all_products': "выгрузка всего каталога",
+    'search_products_short': "запрос короче трех символов, trigram не применим",
+    'rebuild_analytics_rollups': "полный пересчет агрегатов",
+}
+
+START = "2024-01-01 00:00:00"
+END = "2024-12-31 23:59:59"
+PARTIAL_START = "2024-03-01 10:00:00"
+# Накладные раньше этой даты аудит переносит в архив
+ARCHIVE_BEFORE = "2024-07-01 00:00:00"
+
+
+def seed_database(db, products=2000, invoices=2000, items_per_invoice=3):
+    """Заполнение базы тестовыми товарами и накладными"""
+    cursor = db.conn.cursor()
+    cursor.executemany('''
+    INSERT INTO products (barcode, name, price, cost_price, quantity, unit, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, 'шт', ?, ?)
+    ''', [(f"46{n:011d}", f"Товар {n} молочный", 10 + n % 90, 5 + n % 40, 0, START, START)
+          for n in range(1, products + 1)])
+    # Остатки приходят через журнал, как в приложении
+    cursor.execute('''
+    INSERT INTO stock_movements (product_id, kind, quantity, created_ts)
+    SELECT id, 'receipt', id % 50, ? FROM products WHERE id % 50 != 0
+    ''', (db.to_timestamp(START),))
+
+    for n in range(1, invoices + 1):
+        day = 1 + n % 28
+        month = 1 + n % 12
+        date = f"2024-{month:02d}-{day:02d} {n % 24:02d}:{n % 60:02d}:00"
+        cursor.execute('''
+        INSERT INTO invoices (date, total, payment_status, additional_info, created_at)
+        VALUES (?, 0, ?, '', ?)
+        ''', (date, n % 2, date))
+        invoice_id = cursor.lastrowid
+        cursor.executemany('''
+        INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+        VALUES (?, ?, ?, 10, ?, 5)
+        ''', [(invoice_id, 1 + (n * 7 + k) % products, 1 + k, 10 * (1 + k))
+              for k in range(items_per_invoice)])
+
+    cursor.execute('''
+    UPDATE invoices SET total = (SELECT SUM(total) FROM invoice_items WHERE invoice_id = invoices.id)
+    ''')
+    db.conn.commit()
+    db.rebuild_analytics_rollups()
+
+
+def audited_calls(db):
+    """Список (имя, вызов) для всех публичных методов чтения и записи"""
+    line = {'product_id': 1, 'quantity': 1, 'price': 10, 'total': 10}
+    calls = [
+        ('find_product_by_barcode', lambda: db.find_product_by_barcode("4600000000001")),
+        ('find_product_by_id', lambda: db.find_product_by_id(2)),
+        ('add_product', lambda: db.add_product("4699999999999", "Новый товар", 10)),
+        ('update_product', lambda: db.update_product(3, "Товар", 10, 5, 7)),
+        ('update_product_quantity', lambda: db.update_product_quantity(3, 8)),
+        ('get_setting', lambda: db.get_setting("audit")),
+        ('set_setting', lambda: db.set_setting("audit", "1")),
+        ('get_all_products', lambda: db.get_all_products('name')),
+        ('get_products_page', lambda: db.get_products_page('name', ("Товар 1", 1), 50)),
+        ('get_products_page_price', lambda: db.get_products_page('price', (10, 1), 50)),
+        ('get_products_page_quantity', lambda: db.get_products_page('quantity', (1, 1), 50)),
+        ('search_products', lambda: db.search_products("молоч")),
+        ('search_products_short', lambda: db.search_products("мо")),
+        ('search_products_page', lambda: db.search_products_page("молоч", ("Товар 1", 1))),
+        ('create_invoice', lambda: db.create_invoice(10)),
+        ('add_invoice_item', lambda: db.add_invoice_item(1, 1, 1, 10, 10)),
+        ('commit_sale', lambda: db.commit_sale([line, dict(line, product_id=2)])),
+        ('apply_invoice_diff', lambda: db.apply_invoice_diff(8, [dict(line, quantity=3), dict(line, product_id=9)])),
+        ('delete_invoice', lambda: db.delete_invoice(6)),
+        ('delete_invoice_sold', lambda: db.delete_invoice(db.commit_sale([line]))),
+        ('upsert_products', lambda: db.upsert_products([
+            {'barcode': "4600000000004", 'name': "Товар 4", 'price': 10, 'quantity': 30},
+            {'barcode': "4698888888888", 'name': "Импорт", 'price': 10, 'quantity': 5},
+        ])),
+        ('record_stock_movement', lambda: db.record_stock_movement(4, 'receipt', 12)),
+        ('get_stock_movements', lambda: db.get_stock_movements(4)),
+        ('checkpoint_stock', db.checkpoint_stock),
+        ('get_stock_at', lambda: db.get_stock_at(4, END)),
+        ('get_invoice', lambda: db.get_invoice(7)),
+        ('get_invoice_items', lambda: db.get_invoice_items(7)),
+        ('get_invoices_by_period', lambda: db.get_invoices_by_period(START, END)),
+        ('iter_invoices', lambda: list(db.iter_invoices(START, END))),
+        ('iter_invoice_items', lambda: list(db.iter_invoice_items(START, END))),
+        ('iter_invoice_items_since', lambda: list(db.iter_invoice_items(after_id=1500))),
+        ('get_invoices_page', lambda: db.get_invoices_page(START, END, (db.to_timestamp(END), 10 ** 6), 50)),
+        ('filter_invoices', lambda: db.filter_invoices(START, END)),
+        ('filter_invoices_status', lambda: db.filter_invoices(START, END, "оплачено")),
+        ('filter_invoices_number', lambda: db.filter_invoices(START, END, "12")),
+        ('search_invoices_page', lambda: db.search_invoices_page(START, END, "не оплачено")),
+        ('get_sales_analytics', lambda: db.get_sales_analytics(START, END)),
+        ('get_sales_analytics_partial', lambda: db.get_sales_analytics(PARTIAL_START, END)),
+        ('get_profit_analytics', lambda: db.get_profit_analytics(START, END)),
+        ('get_profit_analytics_partial', lambda: db.get_profit_analytics(PARTIAL_START, END)),
+        ('get_top_products', lambda: db.get_top_products(START, END, 5)),
+        ('get_top_products_partial', lambda: db.get_top_products(PARTIAL_START, END, 5)),
+        ('rebuild_analytics_rollups', db.rebuild_analytics_rollups),
+        ('archive_old_invoices', lambda: db.archive_old_invoices(horizon_days=archive_horizon())),
+        # Запросы, задевающие архив, выполняются по обеим базам
+        ('get_invoice_archived', lambda: db.get_invoice(12)),
+        ('get_invoice_items_archived', lambda: db.get_invoice_items(12)),
+        ('get_invoices_by_period_archive', lambda: db.get_invoices_by_period(START, END)),
+        ('get_invoices_page_archive', lambda: db.get_invoices_page(START, END, (db.to_timestamp(END), 10 ** 6), 50)),
+        ('filter_invoices_archive', lambda: db.filter_invoices(START, END, "оплачено")),
+        ('iter_invoice_items_archive', lambda: list(db.iter_invoice_items(START, END))),
+        ('get_sales_analytics_archive', lambda: db.get_sales_analytics(PARTIAL_START, END)),
+        ('get_profit_analytics_archive', lambda: db.get_profit_analytics(PARTIAL_START, END)),
+        ('get_top_products_archive', lambda: db.get_top_products(PARTIAL_START, END, 5)),
+    ]
+    return calls
+
+
+def archive_horizon():
+    """Горизонт архивации в днях, при котором в архив уходят накладные до ARCHIVE_BEFORE"""
+    boundary = datetime.datetime.strptime(ARCHIVE_BEFORE, "%Y-%m-%d %H:%M:%S")
+    return (datetime.datetime.now() - boundary).days
+
+
+def capture_statements(db, call):
+    """SQL, выполненный вызовом (с подставленными параметрами)"""
+    statements = []
+    db.product_cache.clear()
+    db.conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        db.conn.set_trace_callback(None)
+
+    return [sql for sql in statements
+            if re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', sql, re.IGNORECASE)]
+
+
+def table_aliases(sql):
+    """Соответствие псевдоним -> таблица для FROM/JOIN в запросе"""
+    aliases = {}
+    # Таблица может быть указана с именем базы: archive.invoices
+    for table, alias in re.findall(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.IGNORECASE):
+        aliases[table] = table
+        if alias and alias.upper() not in ('WHERE', 'JOIN', 'ON', 'SET', 'LEFT', 'INNER', 'GROUP',
+                                           'ORDER', 'LIMIT', 'VALUES', 'SELECT'):
+            aliases[alias] = table
+    return aliases
+
+
+def explain(db, sql):
+    """Строки плана выполнения запроса"""
+    cursor = db.conn.cursor()
+    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+    return [row['detail'] for row in cursor.fetchall()]
+
+
+def full_scans(sql, plan):
+    """Большие таблицы, которые план просматривает целиком"""
+    aliases = table_aliases(sql)
+    scanned = []
+    for detail in plan:
+        match = re.match(r'SCAN (\w+)', detail)
+        if match and aliases.get(match.group(1), match.group(1)) in LARGE_TABLES:
+            scanned.append(detail)
+    return scanned
+
+
+def run_audit(verbose=False):
+    """Проверка всех методов; возвращает список нарушений (метод, SQL, план)"""
+    work_dir = tempfile.mkdtemp(prefix="pos_plan_audit_")
+    db = DatabaseManager(os.path.join(work_dir, 'audit.db'))
+    violations = []
+
+    try:
+        seed_database(db)
+
+        for name, call in audited_calls(db):
+            for sql in capture_statements(db, call):
+                plan = explain(db, sql)
+                scans = full_scans(sql, plan)
+
+                if verbose:
+                    print(f"[{name}] {' '.join(sql.split())[:120]}")
+                    for detail in plan:
+                        print(f"    {detail}")
+
+                if scans and name not in ALLOWED_SCANS:
+                    violations.append((name, sql, plan))
+    finally:
+        db.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return violations
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    argv = sys.argv[1:] if argv is None else argv
+    violations = run_audit(verbose='-v' in argv)
+
+    if not violations:
+        print("Планы запросов в порядке: полных просмотров больших таблиц нет")
+        return 0
+
+    print(f"Найдено запросов с полным просмотром: {len(violations)}")
+    for name, sql, plan in violations:
+        print(f"\n[{name}]\n{' '.join(sql.split())}")
+        for detail in plan:
+            print(f"    {detail}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# row_benchmark.py
+"""Сравнение фабрик строк на выгрузке каталога.
+
+Заполняет временную базу товарами и замеряет get_all_products-подобный
+запрос с прежней фабрикой словарей, с компактным Row и с кортежами
+(режим raw=True), а также память, занятую результатом.
+
+Запуск из каталога pos_app:
+    python -m benchmarks.row_benchmark [количество_товаров]
+"""
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.datagen import generate_products
+from core.database.database_manager import DatabaseManager
+from core.database.rows import row_factory
+
+QUERY = "SELECT * FROM products ORDER BY name"
+REPEATS = 5
+
+
+def dict_factory(cursor, row):
+    """Прежняя фабрика DatabaseManager: новый словарь на каждую строку"""
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+FACTORIES = [
+    ('dict', dict_factory),
+    ('Row', row_factory),
+    ('tuple', None),
+]
+
+
+def measure(conn, factory):
+    """Лучшее время запроса (мс) и память под результат (КБ)"""
+    cursor = conn.cursor()
+    cursor.row_factory = factory
+
+    best = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        cursor.execute(QUERY)
+        rows = cursor.fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+        # Обращение к полю, как это делают экраны
+        sum(row[3] if factory is None else row['price'] for row in rows)
+    del rows
+
+    tracemalloc.start()
+    cursor.execute(QUERY)
+    rows = cursor.fetchall()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cursor.close()
+
+    return best, memory / 1024, len(rows)
+
+
+def run_benchmark(products=50000):
+    """Замер всех фабрик; возвращает список (имя, мс, КБ, строк)"""
+    work_dir = tempfile.mkdtemp(prefix="pos_row_bench_")
+    db = DatabaseManager(os.path.join(work_dir, 'bench.db'))
+    results = []
+
+    try:
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        generate_products(db, products, random.Random(42), now)
+        conn = sqlite3.connect(db.db_path)
+        try:
+            for name, factory in FACTORIES:
+                results.append((name, *measure(conn, factory)))
+        finally:
+            conn.close()
+    finally:
+        db.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    argv = sys.argv[1:] if argv is None else argv
+    products = int(argv[0]) if argv else 50000
+
+    results = run_benchmark(products)
+    baseline = results[0][1]
+    print(f"Товаров: {results[0][3]}, лучшее из {REPEATS} запусков")
+    for name, elapsed, memory, _ in results:
+        print(f"{name:>6}: {elapsed:8.1f} мс ({baseline / elapsed:4.1f}x)  {memory:10.0f} КБ")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
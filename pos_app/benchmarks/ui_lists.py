@@ -0,0 +1,300 @@
+# ui_lists.py
+"""Замеры заполнения списков на экранах с большим числом строк.
+
+Для каждого размера (100, 1000, 10000 строк) готовится синтетическая база,
+в которой столько же товаров и примерно столько же накладных за последние
+30 дней, и в отдельном процессе запускается POSApp со скрытым окном.
+Сценарий открывает экраны склада, поиска товаров, истории накладных
+и сканирования (с корзиной из N позиций) и для каждого замеряет:
+- время от перехода на экран до отрисованного списка (включая фоновый запрос),
+- число виджетов экрана и показанных строк,
+- прирост RSS процесса.
+Для экрана сканирования отдельно замеряется добавление одного товара
+в корзину из N позиций (новая позиция и увеличение количества).
+
+Без дисплея запуск через Xvfb:
+    xvfb-run -a python -m benchmarks.ui_lists --sizes 100,1000,10000 --output ui_lists.json
+Переменные KIVY_WINDOW и KIVY_GL_BACKEND передаются дочернему процессу как есть.
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.datagen import cached_database, working_copy
+
+DEFAULT_SIZES = (100, 1000, 10000)
+# История на 45 дней покрывает 30-дневное окно экрана истории
+HISTORY_YEARS = 0.125
+RESULT_MARKER = "BENCHMARK_RESULT "
+
+# Экран -> id списка в kv
+LIST_IDS = {
+    'inventory': 'inventory_list',
+    'product_search': 'product_list',
+    'invoice_history': 'invoice_list',
+    'scan_invoice': 'invoice_items',
+}
+
+
+def current_rss_kb():
+    """Текущий RSS процесса в КБ (на не-Linux - пиковый)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def shown_rows(widget):
+    """Число строк списка: элементы data для RecycleView, иначе дочерние виджеты"""
+    data = getattr(widget, 'data', None)
+    if data is not None:
+        return len(data)
+    return len(widget.children)
+
+
+def count_widgets(widget):
+    """Число виджетов в дереве"""
+    return sum(1 for _ in widget.walk(restrict=True))
+
+
+class Scenario:
+    """Сценарий замеров внутри запущенного приложения"""
+
+    def __init__(self, app, rows, repeats):
+        self.app = app
+        self.rows = rows
+        self.repeats = repeats
+        self.results = {}
+
+    async def next_frames(self, count=2):
+        """Ожидание нескольких кадров (раскладка и отрисовка)"""
+        from kivy.clock import Clock
+        target = Clock.frames + count
+        while Clock.frames < target:
+            await asyncio.sleep(0)
+
+    async def settle(self, timeout=120):
+        """Ожидание доставки всех фоновых запросов и отрисовки"""
+        deadline = time.monotonic() + timeout
+        await self.next_frames(1)
+        while not self.app.db_executor.is_idle():
+            if time.monotonic() > deadline:
+                raise TimeoutError("Фоновые запросы не завершились")
+            await asyncio.sleep(0)
+        await self.next_frames(2)
+
+    async def open_screen(self, name):
+        """Переход на экран с замером; возвращает отчет одного открытия"""
+        manager = self.app.root
+        screen = manager.get_screen(name)
+        if manager.current == name:
+            manager.current = 'main'
+            await self.settle()
+
+        gc.collect()
+        rss_before = current_rss_kb()
+        started = time.perf_counter()
+        manager.current = name
+        await self.settle()
+        elapsed = (time.perf_counter() - started) * 1000
+
+        rss_after = current_rss_kb()
+        return {
+            'ms': round(elapsed, 1),
+            'rows_shown': shown_rows(screen.ids[LIST_IDS[name]]),
+            'widgets': count_widgets(screen),
+            'rss_delta_kb': None if rss_before is None else rss_after - rss_before,
+            'rss_kb': rss_after,
+        }
+
+    async def measure_screen(self, name):
+        """Несколько открытий экрана: первое и повторные"""
+        runs = []
+        for _ in range(self.repeats):
+            runs.append(await self.open_screen(name))
+        timings = sorted(run['ms'] for run in runs)
+        self.results[name] = {
+            'first_ms': runs[0]['ms'],
+            'median_ms': timings[len(timings) // 2],
+            'max_ms': timings[-1],
+            'rows_shown': runs[-1]['rows_shown'],
+            'widgets': runs[-1]['widgets'],
+            'rss_delta_kb_first': runs[0]['rss_delta_kb'],
+            'rss_kb': runs[-1]['rss_kb'],
+            'runs': runs,
+        }
+
+    async def measure_scan(self, products):
+        """Корзина из rows позиций и добавление в нее одного товара"""
+        # Несколько товаров остаются вне корзины для замера добавления новой позиции
+        cart_size = min(self.rows, max(len(products) - self.repeats, 0))
+        cart = [{'product_id': product['id'], 'barcode': product['barcode'], 'name': product['name'],
+                 'price': product['price'], 'quantity': 1, 'total': product['price']}
+                for product in products[:cart_size]]
+        self.app.current_invoice = cart
+        await self.measure_screen('scan_invoice')
+
+        screen = self.app.root.get_screen('scan_invoice')
+        timings = {'append': [], 'increment': []}
+        extra = products[cart_size:cart_size + self.repeats]
+        for kind, chosen in (('append', extra), ('increment', products[:self.repeats])):
+            for product in chosen:
+                started = time.perf_counter()
+                screen.add_to_invoice(product)
+                await self.next_frames(2)
+                timings[kind].append(round((time.perf_counter() - started) * 1000, 1))
+        self.results['scan_invoice']['cart_size'] = cart_size
+        self.results['scan_invoice']['add_item_ms'] = timings
+        self.results['scan_invoice']['widgets_after_add'] = count_widgets(screen)
+        self.app.current_invoice = []
+
+    async def run(self):
+        """Все замеры по очереди; по окончании приложение закрывается"""
+        try:
+            # Экраны добавляются в on_start
+            while self.app.root is None or not self.app.root.has_screen('diagnostics'):
+                await asyncio.sleep(0)
+            await self.settle()
+            # Товары с ценой - чтобы добавление не открывало диалог цены
+            products = [dict(product) for product in self.app.db.get_all_products('name') if product['price'] > 0]
+
+            for name in ('inventory', 'product_search', 'invoice_history'):
+                await self.measure_screen(name)
+            await self.measure_scan(products)
+
+            self.app.root.current = 'main'
+            await self.settle()
+        except Exception as e:
+            self.results['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            self.app.stop()
+
+
+def run_child(db_path, rows, repeats):
+    """Запуск приложения со скрытым окном и сценарием замеров (дочерний процесс)"""
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    os.environ.setdefault('KIVY_NO_FILELOG', '1')
+    from kivy.config import Config
+    Config.set('graphics', 'window_state', 'hidden')
+
+    from kivy.uix.screenmanager import NoTransition
+    from app import POSApp
+
+    class BenchmarkApp(POSApp):
+        """Приложение на синтетической базе без фонового обслуживания"""
+
+        def on_start(self):
+            super().on_start()
+            self.maintenance.stop()
+            self.root.transition = NoTransition()
+
+    BenchmarkApp.db_path = db_path
+    app = BenchmarkApp()
+    scenario = Scenario(app, rows, repeats)
+
+    async def main():
+        await asyncio.gather(app.async_run(async_lib='asyncio'), scenario.run())
+
+    asyncio.run(main())
+    scenario.results['peak_rss_kb'] = current_rss_kb()
+    print(RESULT_MARKER + json.dumps(scenario.results, ensure_ascii=False), flush=True)
+
+
+def prepare_database(rows, cache_dir, work_dir, log):
+    """База с rows товаров и ~rows накладных за последние 30 дней; возвращает (путь, сводку)"""
+    # С поправкой на оживленные выходные (+25% два дня в неделю)
+    invoices_per_day = max(1, math.ceil(rows / 31 / 1.07))
+    source = cached_database(cache_dir, rows, HISTORY_YEARS, invoices_per_day, progress=log)
+    path = working_copy(source, os.path.join(work_dir, str(rows)))
+
+    conn = sqlite3.connect(path)
+    try:
+        # Снимок "только что сделан" - иначе при старте запустится резервное копирование
+        now = datetime.datetime.now()
+        conn.execute("DELETE FROM app_settings WHERE key = 'last_backup'")
+        conn.execute(
+            "INSERT INTO app_settings (key, value, created_at, updated_at) VALUES ('last_backup', ?, ?, ?)",
+            (now.strftime("%Y%m%d-%H%M%S"), now.strftime("%Y-%m-%d %H:%M:%S"), now.strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        conn.commit()
+        start = (datetime.date.today() - datetime.timedelta(days=30)).strftime("%Y-%m-%d 00:00:00")
+        invoices = conn.execute("SELECT COUNT(*) FROM invoices WHERE date >= ?", (start,)).fetchone()[0]
+    finally:
+        conn.close()
+    return path, {'products': rows, 'invoices_30_days': invoices}
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    parser = argparse.ArgumentParser(description="Замеры заполнения списков на экранах")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="числа строк через запятую")
+    parser.add_argument('--repeats', type=int, default=3, help="открытий каждого экрана")
+    parser.add_argument('--timeout', type=float, default=900, help="секунд на один размер")
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'pos_benchmark_cache'))
+    parser.add_argument('--output', help="файл JSON (по умолчанию - стандартный вывод)")
+    parser.add_argument('--child', nargs=2, metavar=('DB', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.repeats)
+        return 0
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report = {
+        'benchmark': 'ui_lists',
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sizes': [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pos_ui_bench_") as work_dir:
+        env = dict(os.environ, KIVY_HOME=os.path.join(work_dir, 'kivy'), KIVY_NO_ARGS='1')
+        for rows in (int(size) for size in args.sizes.split(',') if size):
+            log(f"Экраны на {rows} строк")
+            path, dataset = prepare_database(rows, args.cache_dir, work_dir, log)
+            entry = {'rows': rows, 'dataset': dataset}
+            try:
+                completed = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.ui_lists', '--repeats', str(args.repeats),
+                     '--child', path, str(rows)],
+                    cwd=app_dir, env=env, capture_output=True, text=True, timeout=args.timeout
+                )
+                lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+                if lines:
+                    entry['screens'] = json.loads(lines[-1][len(RESULT_MARKER):])
+                else:
+                    entry['error'] = (completed.stderr or completed.stdout)[-2000:]
+            except subprocess.TimeoutExpired:
+                entry['error'] = f"Превышено время ожидания ({args.timeout} с)"
+            report['sizes'].append(entry)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        log(f"Результаты записаны в {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ package.domain = com.yourcompany
 # Исходный файл, содержащий класс App
 source.dir = .
 source.include_exts = py,png,jpg,kv,atlas,db,json,ttf
+# Инструменты разработки в пакет не входят
+source.exclude_dirs = benchmarks, tests
 
 # Версия приложения
 version = 0.1
@@ -0,0 +1,124 @@
+# components/paged_list.py
+from kivy.clock import Clock
+from kivy.properties import StringProperty, ObjectProperty
+from kivymd.uix.list import TwoLineIconListItem, IconLeftWidget
+
+# Строка-заглушка ("Загрузка...", "Ничего не найдено") без иконки и нажатия
+PLACEHOLDER_VIEWCLASS = 'OneLineListItem'
+
+
+class PagedListItem(TwoLineIconListItem):
+    """Строка RecycleView с иконкой слева; нажатие вызывает callback(item)"""
+    icon = StringProperty("package-variant")
+    item = ObjectProperty(None, allownone=True)
+    callback = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super(PagedListItem, self).__init__(**kwargs)
+        # Иконка создается один раз; при переиспользовании строки меняется только ее имя
+        self._icon = IconLeftWidget(icon=self.icon)
+        self.add_widget(self._icon)
+        self.bind(icon=self._icon.setter('icon'))
+
+    def on_release(self):
+        if self.callback is not None:
+            self.callback(self.item)
+
+
+class PagedListLoader:
+    """Подгрузка страниц в RecycleView через DbExecutor по мере прокрутки
+
+    fetch_page(db, after) выполняется в рабочем потоке и возвращает
+    (строки для RecycleView.data, токен следующей страницы или None).
+    Строки готовятся там же, поэтому поток интерфейса только добавляет их
+    в data - RecycleView создает виджеты лишь для видимых строк.
+    """
+
+    def __init__(self, executor, tag, recycle_view, on_error=None, threshold=0.2):
+        """Инициализация подгрузки; threshold - доля высоты до конца списка, с которой грузится следующая страница"""
+        self.executor = executor
+        self.tag = tag
+        self.view = recycle_view
+        self.on_error = on_error
+        self.threshold = threshold
+
+        self.fetch_page = None
+        self.empty_text = ""
+        self.token = None
+        self.loaded = False
+        self.loading = False
+        self.done = True
+        recycle_view.bind(scroll_y=self._on_scroll)
+
+    def start(self, fetch_page, empty_text="", loading_text="Загрузка..."):
+        """Сброс списка и загрузка первой страницы из нового источника"""
+        self.fetch_page = fetch_page
+        self.empty_text = empty_text
+        self.token = None
+        self.loaded = False
+        self.loading = False
+        self.done = False
+
+        self.view.data = [{'viewclass': PLACEHOLDER_VIEWCLASS, 'text': loading_text}]
+        self.view.scroll_y = 1
+        self._request()
+
+    def load_more(self):
+        """Загрузка следующей страницы, если она есть и еще не запрошена"""
+        if self.loading or self.done or self.fetch_page is None:
+            return
+        self._request()
+
+    def cancel(self):
+        """Отмена незавершенной загрузки (при уходе с экрана)"""
+        self.executor.cancel(self.tag)
+        self.loading = False
+
+    def _request(self):
+        """Запрос страницы после текущего токена в рабочем потоке"""
+        self.loading = True
+        fetch_page = self.fetch_page
+        token = self.token
+        # Новый запрос с тем же тегом (например, другой поиск) делает этот устаревшим
+        self.executor.submit(
+            self.tag,
+            lambda db: fetch_page(db, token),
+            on_result=self._on_page,
+            on_error=self._on_failed
+        )
+
+    def _on_page(self, result):
+        """Добавление полученной страницы в список (поток интерфейса)"""
+        rows, self.token = result
+        self.loading = False
+        self.done = self.token is None
+
+        if not self.loaded:
+            self.loaded = True
+            self.view.data = rows or [{'viewclass': PLACEHOLDER_VIEWCLASS, 'text': self.empty_text}]
+        else:
+            self.view.data.extend(rows)
+
+        # Если страница не заполнила экран, прокрутки не будет - догружаем сразу
+        Clock.schedule_once(self._fill_viewport)
+
+    def _fill_viewport(self, *args):
+        """Подгрузка следующей страницы, пока список короче видимой области"""
+        layout = self.view.layout_manager
+        if layout is not None and layout.height <= self.view.height:
+            self.load_more()
+
+    def _on_failed(self, error):
+        """Ошибка загрузки страницы"""
+        self.loading = False
+        # Без повторов при каждой прокрутке; список перезагрузится при следующем start()
+        self.done = True
+        if not self.loaded:
+            self.view.data = []
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def _on_scroll(self, view, scroll_y):
+        """Подгрузка при приближении к концу списка"""
+        if scroll_y <= self.threshold:
+            self.load_more()
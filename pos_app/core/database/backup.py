@@ -0,0 +1,212 @@
+# backup.py
+"""Резервное копирование базы без остановки продаж.
+
+Копия снимается через SQLite backup API порциями по pages страниц с паузой
+sleep между ними. Источник - отдельное соединение с открытой транзакцией
+чтения: в режиме WAL она фиксирует снимок базы, поэтому запись накладных
+идет параллельно и не ждет копирования, а копирование не начинается заново
+после каждой продажи. Пока снимок открыт, контрольная точка не может
+урезать WAL-файл - он подрастает на время копирования.
+
+Каждый снимок - каталог backups/ГГГГММДД-ЧЧММСС с основной базой и архивом.
+Каталог пишется под именем *.part, файлы проверяются PRAGMA integrity_check
+и только потом каталог переименовывается; хранится keep последних снимков.
+"""
+import datetime
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+PART_SUFFIX = '.part'
+
+
+class BackupError(Exception):
+    """Резервная копия не создана или не прошла проверку"""
+
+
+class DatabaseBackup:
+    """Снимок основной и архивной баз с проверкой и ротацией"""
+
+    def __init__(self, db, backup_dir=None, keep=7, pages=256, sleep=0.005, stop_event=None):
+        """Инициализация копирования для указанного DatabaseManager
+
+        pages - страниц за шаг (при 4 КБ на страницу 256 страниц - 1 МБ),
+        sleep - пауза между шагами в секундах. stop_event - threading.Event,
+        по которому копирование прерывается между шагами.
+        """
+        self.db = db
+        if backup_dir is None:
+            backup_dir = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), 'backups')
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.stop_event = stop_event
+
+    def list_backups(self):
+        """Готовые снимки от старых к новым (полные пути каталогов)"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = sorted(name for name in os.listdir(self.backup_dir)
+                       if not name.endswith(PART_SUFFIX)
+                       and os.path.isdir(os.path.join(self.backup_dir, name)))
+        return [os.path.join(self.backup_dir, name) for name in names]
+
+    def copy_database(self, source_path, target_path):
+        """Постраничное копирование одного файла базы; возвращает число страниц"""
+        source = sqlite3.connect(source_path, isolation_level=None)
+        target = sqlite3.connect(target_path)
+        try:
+            wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal'
+            if wal:
+                # Транзакция чтения держит снимок на все время копирования
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+            progress = {'total': 0}
+
+            def on_progress(status, remaining, total):
+                progress['total'] = total
+                # Исключение из обработчика прерывает backup API
+                if self.stop_event is not None and self.stop_event.is_set():
+                    raise BackupError("Резервное копирование прервано")
+
+            source.backup(target, pages=self.pages, sleep=self.sleep, progress=on_progress)
+            if wal:
+                source.execute("COMMIT")
+
+            # Снимок - один самостоятельный файл без WAL
+            target.execute("PRAGMA journal_mode = DELETE")
+            result = [row[0] for row in target.execute("PRAGMA integrity_check").fetchall()]
+            if result != ['ok']:
+                raise BackupError(f"Копия {os.path.basename(target_path)} повреждена: {'; '.join(result[:5])}")
+            return progress['total']
+        finally:
+            target.close()
+            source.close()
+
+    def remove_stale(self):
+        """Удаление недописанных снимков (после сбоя) и снимков сверх keep"""
+        if not os.path.isdir(self.backup_dir):
+            return
+        for name in os.listdir(self.backup_dir):
+            if name.endswith(PART_SUFFIX):
+                shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+
+        backups = self.list_backups()
+        for path in backups[:max(len(backups) - self.keep, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def run(self):
+        """Создание снимка; возвращает отчет (каталог, страниц, байт, секунд)"""
+        started = time.monotonic()
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        final_dir = os.path.join(self.backup_dir, stamp)
+        part_dir = final_dir + PART_SUFFIX
+        os.makedirs(part_dir, exist_ok=True)
+
+        # Основная база копируется первой: накладная, перенесенная в архив
+        # между копиями, окажется в обеих, а не потеряется
+        sources = [self.db.db_path]
+        if os.path.exists(self.db.archive_path):
+            sources.append(self.db.archive_path)
+
+        report = {'path': final_dir, 'pages': 0, 'bytes': 0}
+        try:
+            for source_path in sources:
+                target_path = os.path.join(part_dir, os.path.basename(source_path))
+                report['pages'] += self.copy_database(source_path, target_path)
+                report['bytes'] += os.path.getsize(target_path)
+            os.replace(part_dir, final_dir)
+        except Exception:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            raise
+
+        self.db.set_setting('last_backup', stamp)
+        self.remove_stale()
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+
+class BackupService:
+    """Резервное копирование в отдельном фоновом потоке"""
+
+    def __init__(self, get_db, interval_hours=24, **backup_options):
+        """Инициализация службы
+
+        get_db - функция, возвращающая DatabaseManager (вызывается в фоновом
+        потоке). backup_options передаются в DatabaseBackup.
+        """
+        self.get_db = get_db
+        self.interval_hours = interval_hours
+        self.backup_options = backup_options
+        self.last_report = None
+        self.last_error = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def is_running(self):
+        """Выполняется ли копирование сейчас"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, on_finished=None, only_if_due=False):
+        """Запуск копирования в фоне; False, если оно уже идет
+
+        on_finished(report, error) вызывается в фоновом потоке.
+        only_if_due - копировать, только если с прошлого снимка прошло
+        больше interval_hours.
+        """
+        with self._lock:
+            if self.is_running():
+                return False
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(on_finished, only_if_due),
+                name="db-backup", daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def is_due(self, db):
+        """Прошло ли interval_hours с последнего снимка"""
+        last = db.get_setting('last_backup')
+        if not last:
+            return True
+        try:
+            last_time = datetime.datetime.strptime(last, "%Y%m%d-%H%M%S")
+        except ValueError:
+            return True
+        return datetime.datetime.now() - last_time >= datetime.timedelta(hours=self.interval_hours)
+
+    def _run(self, on_finished, only_if_due):
+        """Тело фонового потока"""
+        report = None
+        error = None
+        try:
+            db = self.get_db()
+            if only_if_due and not self.is_due(db):
+                return
+            report = DatabaseBackup(db, stop_event=self._stop_event, **self.backup_options).run()
+            self.last_report = report
+            print(f"Резервная копия базы данных создана: {report}")
+        except Exception as e:
+            error = e
+            self.last_error = e
+            print(f"Ошибка резервного копирования базы данных: {e}")
+
+        if on_finished is not None:
+            on_finished(report, error)
+
+    def join(self, timeout=None):
+        """Ожидание завершения текущего копирования"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stop(self, timeout=None):
+        """Прерывание текущего копирования и ожидание его потока (перед закрытием базы)"""
+        self._stop_event.set()
+        self.join(timeout)
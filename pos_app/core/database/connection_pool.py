@@ -0,0 +1,111 @@
+# connection_pool.py
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """Пул соединений SQLite в режиме WAL: одно соединение-писатель и N читателей"""
+
+    SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+    def __init__(self, db_path, readers=4, synchronous="NORMAL", busy_timeout=5000, row_factory=None,
+                 attachments=None, factory=sqlite3.Connection):
+        """Открытие соединения-писателя и настройка журнала WAL
+
+        attachments - словарь "схема -> путь" баз, подключаемых через ATTACH
+        к каждому соединению пула. factory - класс соединения для sqlite3.connect.
+        """
+        synchronous = str(synchronous).upper()
+        if synchronous not in self.SYNCHRONOUS_MODES:
+            raise ValueError(f"Недопустимый режим synchronous: {synchronous}")
+        if readers < 1:
+            raise ValueError("Пулу нужен хотя бы один читатель")
+
+        self.db_path = db_path
+        self.max_readers = readers
+        self.synchronous = synchronous
+        self.busy_timeout = int(busy_timeout)
+        self.row_factory = row_factory
+        self.attachments = dict(attachments or {})
+        self.factory = factory
+
+        self._idle = queue.LifoQueue()
+        self._all_readers = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.writer = self._connect()
+        self.writer.execute("PRAGMA journal_mode = WAL")
+        for schema in self.attachments:
+            self.writer.execute(f"PRAGMA {schema}.journal_mode = WAL")
+
+    def _connect(self, query_only=False):
+        """Открытие соединения с общими настройками пула"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            factory=self.factory
+        )
+        conn.row_factory = self.row_factory
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        # Без этого ON DELETE CASCADE в схеме не срабатывает
+        conn.execute("PRAGMA foreign_keys = ON")
+        for schema, path in self.attachments.items():
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        if query_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _acquire_reader(self, timeout):
+        """Получение свободного читателя или открытие нового в пределах лимита"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all_readers) < self.max_readers:
+                conn = self._connect(query_only=True)
+                self._all_readers.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободных соединений для чтения") from None
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """Соединение для чтения, закрепленное за текущим потоком на время блока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Вложенный вызов в том же потоке использует то же соединение
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire_reader(timeout)
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._idle.put(conn)
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+        self._idle = queue.LifoQueue()
+        self.writer.close()
@@ -1,12 +1,36 @@
 # database_manager.py
 import sqlite3
+import calendar
 import datetime
 import os
+import time
+import threading
+from contextlib import contextmanager
+
+from core.database.connection_pool import ConnectionPool
+from core.database.instrumentation import QueryStats, instrumented_connection_class
+from core.database.migrations import migrate, migrate_archive
+from core.database.product_cache import ProductCache
+from core.database.rows import row_factory
+
+# Столбцы, общие для основной базы и архива (в одинаковом порядке)
+INVOICE_COLUMNS = "id, date, total, payment_status, additional_info, created_at, user_id, date_ts, created_ts"
+INVOICE_ITEM_COLUMNS = "id, invoice_id, product_id, quantity, price, total, cost_price"
+INVOICE_SELECT = ", ".join(f"i.{column}" for column in INVOICE_COLUMNS.split(", "))
+# Виды движений остатка: продажа, возврат, поступление, корректировка
+STOCK_MOVEMENT_KINDS = ('sale', 'return', 'receipt', 'adjustment')
 
 
 class DatabaseManager:
-    def __init__(self, db_path=None):
-        """Инициализация менеджера базы данных"""
+    def __init__(self, db_path=None, pooled=False, readers=4, synchronous="NORMAL", busy_timeout=5000,
+                 product_cache_size=500, archive_path=None, instrument=None, slow_query_ms=50):
+        """Инициализация менеджера базы данных
+
+        В режиме pooled база переводится в WAL, запись идет через одно соединение,
+        а чтение - через пул соединений, выдаваемых потокам по запросу.
+        archive_path - файл архива старых накладных (по умолчанию рядом с базой).
+        instrument - вести ли замер запросов; None - по настройке db_instrumentation.
+        """
         if db_path is None:
             # Определяем путь к базе данных относительно исполняемого файла
             base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -14,300 +38,1392 @@ class DatabaseManager:
 
         self.db_path = db_path
         db_exists = os.path.exists(db_path)
+        if archive_path is None:
+            archive_path = os.path.splitext(db_path)[0] + '_archive.db'
+        self.archive_path = archive_path
 
         # Убедимся, что директория существует
         db_dir = os.path.dirname(db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
 
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = self.dict_factory
+        # Блокировка для соединения-писателя и общего курсора
+        self._write_lock = threading.RLock()
+        # Кэш часто сканируемых товаров
+        self.product_cache = ProductCache(product_cache_size)
+        # Замер запросов: курсоры установлены всегда, запись включается флагом
+        self.query_stats = QueryStats(enabled=bool(instrument), slow_ms=slow_query_ms)
+        connection_class = instrumented_connection_class(self.query_stats)
+
+        if pooled:
+            self.pool = ConnectionPool(
+                db_path,
+                readers=readers,
+                synchronous=synchronous,
+                busy_timeout=busy_timeout,
+                row_factory=row_factory,
+                attachments={'archive': archive_path},
+                factory=connection_class
+            )
+            self.conn = self.pool.writer
+        else:
+            self.pool = None
+            self.conn = sqlite3.connect(db_path, factory=connection_class)
+            self.conn.row_factory = row_factory
+            # Без этого ON DELETE CASCADE в схеме не срабатывает
+            self.conn.execute("PRAGMA foreign_keys = ON")
+            self.conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
         self.cursor = self.conn.cursor()
-        self.create_tables()
+        # Перенесенные в архив накладные должны пережить сбой питания до того,
+        # как их удалят из основной базы (см. archive_old_invoices)
+        self.conn.execute("PRAGMA archive.synchronous = FULL")
+        # Применяем только недостающие миграции схемы
+        with self._write_lock:
+            migrate_archive(self)
+            migrate(self)
+        self.fts_enabled = self._has_table('products_fts')
+        self._load_archive_bounds()
+        self._finish_archiving()
+        # Накладные, созданные раньше, списывали остаток без журнала
+        self.stock_ledger_since_ts = int(self.get_setting('stock_ledger_since_ts', 0))
+        if instrument is None:
+            self.query_stats.enabled = self.get_setting('db_instrumentation') == '1'
 
         if not db_exists:
             self.initialize_database()
-    def dict_factory(self, cursor, row):
-        """Преобразование результатов запроса в словарь"""
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
+
+    @contextmanager
+    def _reader(self, raw=False):
+        """Курсор для чтения: в режиме пула - на соединении-читателе текущего потока
+
+        raw=True - строки возвращаются простыми кортежами, без объектов Row
+        (для внутренних агрегаций по большому числу строк).
+        """
+        if self.pool is None and not raw:
+            yield self.cursor
+            return
+
+        with self._reader_connection() as conn:
+            cursor = conn.cursor()
+            if raw:
+                cursor.row_factory = None
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def _reader_connection(self):
+        """Соединение для чтения: из пула или единственное соединение"""
+        if self.pool is None:
+            yield self.conn
+            return
+
+        with self.pool.reader() as conn:
+            yield conn
 
     def initialize_database(self):
         """Инициализация базы данных при первом создании"""
         pass
 
-    def create_tables(self):
-        """Создание необходимых таблиц в базе данных"""
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS app_settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key TEXT UNIQUE NOT NULL,
-            value TEXT,
-            created_at TEXT,
-            updated_at TEXT
-        )
-        ''')
+    def _has_table(self, name):
+        """Проверка наличия таблицы в схеме"""
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,))
+        return self.cursor.fetchone() is not None
 
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            barcode TEXT UNIQUE,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            cost_price REAL DEFAULT 0,
-            quantity INTEGER DEFAULT 0,
-            unit TEXT DEFAULT "шт",
-            group_name TEXT,
-            subgroup TEXT,
-            created_at TEXT,
-            updated_at TEXT
-        )
-        ''')
+    @staticmethod
+    def to_timestamp(date_str):
+        """Секунды эпохи для даты вида 'YYYY-MM-DD HH:MM:SS'
 
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            total REAL NOT NULL,
-            payment_status INTEGER DEFAULT 1,
-            additional_info TEXT,
-            created_at TEXT,
-            user_id INTEGER
-        )
-        ''')
+        Время читается как UTC, так же как strftime('%s') в SQLite,
+        поэтому метки из кода и из миграции совпадают.
+        """
+        return calendar.timegm(time.strptime(date_str, "%Y-%m-%d %H:%M:%S"))
 
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS invoice_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_id INTEGER,
-            product_id INTEGER,
-            quantity INTEGER NOT NULL,
-            price REAL NOT NULL,
-            total REAL NOT NULL,
-            FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT
-        )
-        ''')
+    def _load_archive_bounds(self):
+        """Наибольшие дата и ID накладных в архиве (None, если архив пуст)"""
+        self.cursor.execute("SELECT MAX(date_ts) AS max_ts, MAX(id) AS max_id FROM archive.invoices")
+        row = self.cursor.fetchone()
+        self.archive_max_ts = row['max_ts']
+        self.archive_max_id = row['max_id']
 
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            description TEXT,
-            created_at TEXT
+    def _needs_archive(self, start_ts=None, after_id=None):
+        """Нужен ли архив запросу, начинающемуся с start_ts (None - с начала)"""
+        if self.archive_max_ts is None:
+            return False
+        if start_ts is not None and start_ts > self.archive_max_ts:
+            return False
+        return after_id is None or after_id < self.archive_max_id
+
+    @staticmethod
+    def _union_archive(query, params, use_archive):
+        """Подстановка схемы в query ({db}); с архивом - UNION ALL двух копий запроса"""
+        if not use_archive:
+            return query.format(db='main'), list(params)
+        return f"{query.format(db='main')} UNION ALL {query.format(db='archive')}", list(params) * 2
+
+    def _fill_rollups(self):
+        """Расчет агрегатов по всем накладным, включая архив (внутри текущей транзакции)"""
+        invoices, _ = self._union_archive(
+            "SELECT id, date, total, payment_status FROM {db}.invoices", (), True
         )
+        items, _ = self._union_archive('''
+        SELECT i.date, ii.product_id, ii.quantity, ii.total, ii.cost_price
+        FROM {db}.invoice_items ii
+        JOIN {db}.invoices i ON ii.invoice_id = i.id
+        ''', (), True)
+
+        self.cursor.execute(f'''
+        INSERT INTO daily_sales (day, total_sales, invoice_count, paid_amount, debt_amount)
+        SELECT
+            substr(date, 1, 10),
+            SUM(total),
+            COUNT(id),
+            SUM(CASE WHEN payment_status = 'Оплачено' THEN total ELSE 0 END),
+            SUM(CASE WHEN payment_status = 'В долг' THEN total ELSE 0 END)
+        FROM ({invoices})
+        GROUP BY substr(date, 1, 10)
         ''')
 
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS product_categories (
-            product_id INTEGER,
-            category_id INTEGER,
-            PRIMARY KEY (product_id, category_id),
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
-            FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
-        )
+        self.cursor.execute(f'''
+        INSERT INTO daily_product_sales (day, product_id, quantity, total, cost)
+        SELECT
+            substr(date, 1, 10), product_id,
+            SUM(quantity), SUM(total), SUM(quantity * cost_price)
+        FROM ({items})
+        GROUP BY substr(date, 1, 10), product_id
         ''')
 
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items(invoice_id)')
+    def archive_old_invoices(self, horizon_days=None, batch_size=500, deadline=None):
+        """Перенос накладных старше horizon_days дней в архив пачками
+
+        horizon_days по умолчанию берется из настройки archive_horizon_days
+        (365). deadline - момент time.monotonic(), после которого новые пачки
+        не начинаются. Агрегаты по дням не меняются: архивные накладные
+        в них уже учтены. Возвращает число перенесенных накладных.
+        """
+        if horizon_days is None:
+            horizon_days = int(self.get_setting('archive_horizon_days', 365))
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cutoff_ts = self.to_timestamp(now) - int(horizon_days) * 86400
+
+        moved = 0
+        while deadline is None or time.monotonic() < deadline:
+            with self._write_lock:
+                try:
+                    self.cursor.execute('''
+                    SELECT id FROM main.invoices
+                    WHERE date_ts < ?
+                    ORDER BY date_ts, id
+                    LIMIT ?
+                    ''', (cutoff_ts, batch_size))
+                    ids = [row['id'] for row in self.cursor.fetchall()]
+                    if not ids:
+                        break
+
+                    self._move_to_archive(ids)
+                except Exception:
+                    self.conn.rollback()
+                    raise
 
+            moved += len(ids)
+            if len(ids) < batch_size:
+                break
+
+        if moved:
+            with self._write_lock:
+                self._load_archive_bounds()
+        return moved
+
+    def _move_to_archive(self, ids):
+        """Перенос накладных ids из основной базы в архив (под блокировкой записи)
+
+        Архив - отдельный файл, и в режиме WAL транзакция по двум базам
+        не атомарна. Поэтому накладные сначала фиксируются в архиве
+        (с synchronous=FULL - запись уже на диске), и только второй
+        транзакцией удаляются из основной базы. После сбоя между ними
+        накладная остается в обеих базах, пока _finish_archiving не
+        завершит перенос; копия из основной базы при этом заменяет архивную,
+        так как ее могли изменить.
+        """
+        placeholders = ", ".join("?" * len(ids))
+        self.cursor.execute(f"DELETE FROM archive.invoice_items WHERE invoice_id IN ({placeholders})", ids)
+        self.cursor.execute(f'''
+        INSERT OR REPLACE INTO archive.invoices ({INVOICE_COLUMNS})
+        SELECT {INVOICE_COLUMNS} FROM main.invoices WHERE id IN ({placeholders})
+        ''', ids)
+        self.cursor.execute(f'''
+        INSERT OR REPLACE INTO archive.invoice_items ({INVOICE_ITEM_COLUMNS})
+        SELECT {INVOICE_ITEM_COLUMNS} FROM main.invoice_items WHERE invoice_id IN ({placeholders})
+        ''', ids)
+        # Сначала копия в архиве; блокировка записи держится до удаления,
+        # чтобы накладную не изменили между двумя транзакциями
         self.conn.commit()
 
+        self.cursor.execute(f"DELETE FROM main.invoice_items WHERE invoice_id IN ({placeholders})", ids)
+        self.cursor.execute(f"DELETE FROM main.invoices WHERE id IN ({placeholders})", ids)
+        self.conn.commit()
+
+    def _finish_archiving(self):
+        """Завершение переноса в архив, прерванного сбоем (накладные в обеих базах)
+
+        Вызывается при открытии базы, до первых запросов: иначе такие
+        накладные попали бы в UNION ALL обеих баз дважды.
+        """
+        if self.archive_max_ts is None:
+            return
+
+        with self._write_lock:
+            # Недоперенесенные накладные не новее архива, поэтому хватает диапазона по date_ts
+            self.cursor.execute('''
+            SELECT m.id FROM main.invoices m
+            WHERE m.date_ts <= ?
+              AND EXISTS (SELECT 1 FROM archive.invoices a WHERE a.id = m.id)
+            ''', (self.archive_max_ts,))
+            ids = [row['id'] for row in self.cursor.fetchall()]
+            if not ids:
+                return
+            try:
+                self._move_to_archive(ids)
+            except Exception as e:
+                self.conn.rollback()
+                print(f"Ошибка при завершении переноса в архив: {e}")
+                return
+            print(f"Завершен перенос в архив {len(ids)} накладных")
+
+    def rebuild_analytics_rollups(self):
+        """Полный пересчет агрегатов продаж по дням"""
+        with self._write_lock:
+            try:
+                self.cursor.execute("DELETE FROM daily_sales")
+                self.cursor.execute("DELETE FROM daily_product_sales")
+                self._fill_rollups()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _rollup_invoice(self, invoice_id, sign):
+        """Учет накладной в агрегатах: sign=1 добавляет ее, sign=-1 вычитает
+
+        Вызывается внутри транзакции записи: перед изменением накладной
+        с sign=-1 и после изменения с sign=1.
+        """
+        self.cursor.execute('''
+        INSERT INTO daily_sales (day, total_sales, invoice_count, paid_amount, debt_amount)
+        SELECT
+            substr(date, 1, 10),
+            ? * total,
+            ?,
+            ? * (CASE WHEN payment_status = 'Оплачено' THEN total ELSE 0 END),
+            ? * (CASE WHEN payment_status = 'В долг' THEN total ELSE 0 END)
+        FROM invoices
+        WHERE id = ?
+        ON CONFLICT(day) DO UPDATE SET
+            total_sales = total_sales + excluded.total_sales,
+            invoice_count = invoice_count + excluded.invoice_count,
+            paid_amount = paid_amount + excluded.paid_amount,
+            debt_amount = debt_amount + excluded.debt_amount
+        ''', (sign, sign, sign, sign, invoice_id))
+
+        self.cursor.execute('''
+        INSERT INTO daily_product_sales (day, product_id, quantity, total, cost)
+        SELECT
+            substr(i.date, 1, 10), ii.product_id,
+            ? * SUM(ii.quantity), ? * SUM(ii.total), ? * SUM(ii.quantity * ii.cost_price)
+        FROM invoice_items ii
+        JOIN invoices i ON ii.invoice_id = i.id
+        WHERE ii.invoice_id = ?
+        GROUP BY ii.product_id
+        ON CONFLICT(day, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            total = total + excluded.total,
+            cost = cost + excluded.cost
+        ''', (sign, sign, sign, invoice_id))
+
+        if sign < 0:
+            # Убираем опустевшие строки, чтобы не копить остатки округления
+            self.cursor.execute('''
+            DELETE FROM daily_sales
+            WHERE invoice_count <= 0 AND day = (SELECT substr(date, 1, 10) FROM invoices WHERE id = ?)
+            ''', (invoice_id,))
+            self.cursor.execute('''
+            DELETE FROM daily_product_sales
+            WHERE quantity = 0 AND day = (SELECT substr(date, 1, 10) FROM invoices WHERE id = ?)
+            ''', (invoice_id,))
+
     def find_product_by_barcode(self, barcode):
         """Поиск товара по штрих-коду"""
-        self.cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
-        return self.cursor.fetchone()
+        product = self.product_cache.get_by_barcode(barcode)
+        if product is not None:
+            return product
+
+        generation = self.product_cache.generation
+        with self._reader() as cursor:
+            cursor.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
+            product = cursor.fetchone()
+
+        self.product_cache.put(product, generation)
+        return product
 
     def find_product_by_id(self, product_id):
         """Поиск товара по ID"""
-        self.cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-        return self.cursor.fetchone()
+        product = self.product_cache.get_by_id(product_id)
+        if product is not None:
+            return product
+
+        generation = self.product_cache.generation
+        with self._reader() as cursor:
+            cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+            product = cursor.fetchone()
+
+        self.product_cache.put(product, generation)
+        return product
 
     def add_product(self, barcode, name, price, cost_price=0, quantity=0, unit="шт", group="", subgroup=""):
-        """Добавление нового товара"""
+        """Добавление нового товара; начальный остаток записывается поступлением"""
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
 
-        self.cursor.execute('''
-        INSERT INTO products (barcode, name, price, cost_price, quantity, unit, group_name, subgroup, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (barcode, name, price, cost_price, quantity, unit, group, subgroup, now, now))
+        with self._write_lock:
+            try:
+                self.cursor.execute('''
+                INSERT INTO products (barcode, name, price, cost_price, quantity, unit, group_name, subgroup,
+                                      created_at, updated_at, updated_ts)
+                VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)
+                ''', (barcode, name, price, cost_price, unit, group, subgroup, now, now, now_ts))
+                product_id = self.cursor.lastrowid
 
-        self.conn.commit()
-        return self.cursor.lastrowid
+                if quantity:
+                    self._insert_movement(product_id, 'receipt', quantity, now_ts, note="Начальный остаток")
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.invalidate(barcode=barcode)
+
+        return product_id
+
+    def update_product(self, product_id, name, price, cost_price, quantity, unit="шт", group="", subgroup="",
+                       previous_quantity=None):
+        """Обновление информации о товаре
 
-    def update_product(self, product_id, name, price, cost_price, quantity, unit="шт", group="", subgroup=""):
-        """Обновление информации о товаре"""
+        Остаток не перезаписывается, а корректируется движением журнала.
+        previous_quantity - остаток, который видел пользователь при открытии
+        формы: тогда применяется только его изменение, и продажи, прошедшие
+        за время редактирования, не теряются.
+        """
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
 
-        self.cursor.execute('''
-        UPDATE products
-        SET name = ?, price = ?, cost_price = ?, quantity = ?, unit = ?, group_name = ?, subgroup = ?, updated_at = ?
-        WHERE id = ?
-        ''', (name, price, cost_price, quantity, unit, group, subgroup, now, product_id))
+        with self._write_lock:
+            try:
+                self.cursor.execute('''
+                UPDATE products
+                SET name = ?, price = ?, cost_price = ?, unit = ?, group_name = ?, subgroup = ?,
+                    updated_at = ?, updated_ts = ?
+                WHERE id = ?
+                ''', (name, price, cost_price, unit, group, subgroup, now, now_ts, product_id))
+                updated = self.cursor.rowcount > 0
 
-        self.conn.commit()
-        return self.cursor.rowcount > 0
+                if updated:
+                    self._adjust_stock(product_id, quantity, previous_quantity, now_ts)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.invalidate(product_id)
+
+        return updated
+
+    def upsert_products(self, products):
+        """Вставка или обновление пачки товаров по штрих-коду одной транзакцией
+
+        products - словари с ключами barcode, name, price и необязательными
+        cost_price, quantity, unit, group, subgroup. Необязательное поле со
+        значением None не затирает то, что уже записано у товара.
+        """
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
+        params = []
+        for product in products:
+            cost_price = product.get('cost_price')
+            unit = product.get('unit')
+            group = product.get('group')
+            subgroup = product.get('subgroup')
+            params.append((
+                product['barcode'], product['name'], product['price'],
+                cost_price, unit, group or '', subgroup or '', now, now, now_ts,
+                cost_price, unit, group, subgroup
+            ))
+
+        with self._write_lock:
+            try:
+                self.cursor.executemany('''
+                INSERT INTO products (barcode, name, price, cost_price, quantity, unit, group_name, subgroup,
+                                      created_at, updated_at, updated_ts)
+                VALUES (?, ?, ?, COALESCE(?, 0), 0, COALESCE(?, 'шт'), ?, ?, ?, ?, ?)
+                ON CONFLICT(barcode) DO UPDATE SET
+                    name = excluded.name,
+                    price = excluded.price,
+                    cost_price = COALESCE(?, cost_price),
+                    unit = COALESCE(?, unit),
+                    group_name = COALESCE(?, group_name),
+                    subgroup = COALESCE(?, subgroup),
+                    updated_at = excluded.updated_at,
+                    updated_ts = excluded.updated_ts
+                ''', params)
+
+                # Остатки из файла доводятся до указанных корректировками журнала
+                self.cursor.executemany('''
+                INSERT INTO stock_movements (product_id, kind, quantity, created_ts, note)
+                SELECT id, 'adjustment', ? - quantity, ?, 'Импорт'
+                FROM products
+                WHERE barcode = ? AND quantity != ?
+                ''', [(product['quantity'], now_ts, product['barcode'], product['quantity'])
+                      for product in products if product.get('quantity') is not None])
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.clear()
+
+        return len(params)
 
     def get_setting(self, key, default=None):
         """Получение настройки приложения"""
-        self.cursor.execute("SELECT value FROM app_settings WHERE key = ?", (key,))
-        result = self.cursor.fetchone()
-        return result['value'] if result else default
+        with self._reader() as cursor:
+            cursor.execute("SELECT value FROM app_settings WHERE key = ?", (key,))
+            result = cursor.fetchone()
+            return result['value'] if result else default
 
     def set_setting(self, key, value):
         """Установка настройки приложения"""
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        try:
-            self.cursor.execute(
-                "UPDATE app_settings SET value = ?, updated_at = ? WHERE key = ?",
-                (value, now, key)
-            )
+        with self._write_lock:
+            try:
+                self.cursor.execute(
+                    "UPDATE app_settings SET value = ?, updated_at = ? WHERE key = ?",
+                    (value, now, key)
+                )
 
-            if self.cursor.rowcount == 0:
+                if self.cursor.rowcount == 0:
+                    self.cursor.execute(
+                        "INSERT INTO app_settings (key, value, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                        (key, value, now, now)
+                    )
+
+                self.conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка при установке настройки: {e}")
+                return False
+
+    def set_instrumentation(self, enabled):
+        """Включение или выключение замера запросов (сохраняется в настройках)"""
+        self.query_stats.enabled = bool(enabled)
+        return self.set_setting('db_instrumentation', '1' if enabled else '0')
+
+    def get_query_stats(self, limit=None):
+        """Снимок статистики запросов: операторы, гистограммы и медленные запросы"""
+        snapshot = self.query_stats.snapshot(limit)
+        snapshot['product_cache'] = self.product_cache.stats()
+        return snapshot
+
+    def update_product_quantity(self, product_id, quantity, previous_quantity=None, note=None):
+        """Установка остатка товара корректировкой журнала (инвентаризация)"""
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
+
+        with self._write_lock:
+            try:
                 self.cursor.execute(
-                    "INSERT INTO app_settings (key, value, created_at, updated_at) VALUES (?, ?, ?, ?)",
-                    (key, value, now, now)
+                    "UPDATE products SET updated_at = ?, updated_ts = ? WHERE id = ?",
+                    (now, now_ts, product_id)
                 )
+                updated = self.cursor.rowcount > 0
+                if updated:
+                    self._adjust_stock(product_id, quantity, previous_quantity, now_ts, note)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.invalidate(product_id)
 
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка при установке настройки: {e}")
-            return False
+        return updated
+
+    def _insert_movement(self, product_id, kind, quantity, created_ts, invoice_id=None, note=None):
+        """Запись движения остатка (без фиксации); products.quantity меняет триггер"""
+        self.cursor.execute('''
+        INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts, note)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (product_id, kind, quantity, invoice_id, created_ts, note))
+
+    def _adjust_stock(self, product_id, quantity, previous_quantity, created_ts, note=None):
+        """Корректировка остатка до quantity или на quantity - previous_quantity (без фиксации)"""
+        if previous_quantity is not None:
+            if quantity != previous_quantity:
+                self._insert_movement(product_id, 'adjustment', quantity - previous_quantity, created_ts, note=note)
+            return
+
+        # Разница считается в том же запросе, поэтому учитывает последние продажи
+        self.cursor.execute('''
+        INSERT INTO stock_movements (product_id, kind, quantity, created_ts, note)
+        SELECT id, 'adjustment', ? - quantity, ?, ?
+        FROM products
+        WHERE id = ? AND quantity != ?
+        ''', (quantity, created_ts, note, product_id, quantity))
+
+    def record_stock_movement(self, product_id, kind, quantity, note=None):
+        """Поступление, возврат или корректировка остатка на quantity (со знаком)"""
+        if kind not in STOCK_MOVEMENT_KINDS:
+            raise ValueError(f"Неизвестный вид движения остатка: {kind}")
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        with self._write_lock:
+            try:
+                self._insert_movement(product_id, kind, quantity, self.to_timestamp(now), note=note)
+                movement_id = self.cursor.lastrowid
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.invalidate(product_id)
+
+        return movement_id
+
+    def get_stock_movements(self, product_id, limit=50):
+        """Последние движения остатка товара, от новых к старым"""
+        with self._reader() as cursor:
+            cursor.execute('''
+            SELECT id, kind, quantity, invoice_id, created_ts, note
+            FROM stock_movements
+            WHERE product_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+            ''', (product_id, limit))
+            return cursor.fetchall()
+
+    def get_stock_at(self, product_id, date):
+        """Остаток товара на момент date ("ГГГГ-ММ-ДД ЧЧ:ММ:СС")
+
+        Берется ближайшая контрольная точка не позже даты и к ней
+        прибавляются движения после нее, поэтому объем работы не зависит
+        от длины истории товара.
+        """
+        until_ts = self.to_timestamp(date)
+        with self._reader(raw=True) as cursor:
+            cursor.execute('''
+            SELECT movement_id, created_ts, quantity
+            FROM stock_checkpoints
+            WHERE product_id = ? AND created_ts <= ?
+            ORDER BY movement_id DESC
+            LIMIT 1
+            ''', (product_id, until_ts))
+            checkpoint = cursor.fetchone() or (0, 0, 0)
+
+            cursor.execute('''
+            SELECT COALESCE(SUM(quantity), 0)
+            FROM stock_movements
+            WHERE product_id = ? AND created_ts BETWEEN ? AND ? AND id > ?
+            ''', (product_id, checkpoint[1], until_ts, checkpoint[0]))
+            return checkpoint[2] + cursor.fetchone()[0]
 
-    def update_product_quantity(self, product_id, quantity):
-        """Обновление только количества товара"""
+    def checkpoint_stock(self, batch_size=500, deadline=None):
+        """Контрольная точка остатков: сверка products.quantity с журналом
+
+        Проверяются только товары с движениями после прошлой точки: остаток
+        по журналу (их последняя точка плюс более поздние движения) сравнивается
+        с products.quantity, расхождение исправляется по журналу, и для товара
+        записывается новая точка. Возвращает (проверено товаров, расхождений).
+        """
+        since_id = int(self.get_setting('stock_checkpoint_movement_id', 0) or 0)
+        with self._reader(raw=True) as cursor:
+            cursor.execute("SELECT MAX(id) FROM stock_movements")
+            last_id = cursor.fetchone()[0] or 0
+            cursor.execute(
+                "SELECT DISTINCT product_id FROM stock_movements WHERE id > ? AND id <= ?",
+                (since_id, last_id)
+            )
+            product_ids = [row[0] for row in cursor.fetchall()]
+
+        checked = 0
+        mismatches = 0
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
+        for start in range(0, len(product_ids), batch_size):
+            if deadline is not None and time.monotonic() >= deadline:
+                # Отметка не сдвигается - оставшиеся товары проверит следующий запуск
+                return checked, mismatches
+
+            with self._write_lock:
+                try:
+                    for product_id in product_ids[start:start + batch_size]:
+                        mismatches += self._checkpoint_product(product_id, now_ts)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+            checked += len(product_ids[start:start + batch_size])
 
+        if mismatches:
+            self.product_cache.clear()
+        self.set_setting('stock_checkpoint_movement_id', str(last_id))
+        return checked, mismatches
+
+    def _checkpoint_product(self, product_id, now_ts):
+        """Сверка и новая контрольная точка одного товара (без фиксации); 1 при расхождении"""
         self.cursor.execute('''
-        UPDATE products
-        SET quantity = ?, updated_at = ?
-        WHERE id = ?
-        ''', (quantity, now, product_id))
+        SELECT movement_id, quantity FROM stock_checkpoints
+        WHERE product_id = ?
+        ORDER BY movement_id DESC
+        LIMIT 1
+        ''', (product_id,))
+        checkpoint = self.cursor.fetchone()
+        base_id = checkpoint['movement_id'] if checkpoint else 0
+        base_quantity = checkpoint['quantity'] if checkpoint else 0
 
-        self.conn.commit()
-        return self.cursor.rowcount > 0
+        self.cursor.execute('''
+        SELECT COALESCE(SUM(m.quantity), 0) AS delta, MAX(m.id) AS last_id, p.quantity AS cached
+        FROM products p
+        LEFT JOIN stock_movements m ON m.product_id = p.id AND m.id > ?
+        WHERE p.id = ?
+        ''', (base_id, product_id))
+        row = self.cursor.fetchone()
+        if row is None or row['last_id'] is None:
+            return 0
+
+        expected = base_quantity + row['delta']
+        self.cursor.execute('''
+        INSERT OR REPLACE INTO stock_checkpoints (product_id, movement_id, created_ts, quantity)
+        VALUES (?, ?, ?, ?)
+        ''', (product_id, row['last_id'], now_ts, expected))
+
+        if row['cached'] == expected:
+            return 0
+        print(f"Остаток товара #{product_id} расходится с журналом: {row['cached']} вместо {expected}")
+        self.cursor.execute("UPDATE products SET quantity = ? WHERE id = ?", (expected, product_id))
+        return 1
 
     def get_all_products(self, sort_by='name'):
         """Получение всех товаров с сортировкой"""
         valid_sort_fields = ['name', 'price', 'quantity']
         sort_field = sort_by if sort_by in valid_sort_fields else 'name'
 
-        self.cursor.execute(f"SELECT * FROM products ORDER BY {sort_field}")
-        return self.cursor.fetchall()
+        with self._reader() as cursor:
+            cursor.execute(f"SELECT * FROM products ORDER BY {sort_field}")
+            return cursor.fetchall()
 
-    def search_products(self, search_term):
-        """Поиск товаров по названию или штрих-коду"""
-        search_param = f"%{search_term}%"
+    def search_products(self, search_term, limit=100):
+        """Поиск товаров по названию или штрих-коду
 
-        self.cursor.execute('''
-        SELECT * FROM products
-        WHERE name LIKE ? OR barcode LIKE ?
-        ORDER BY name
-        ''', (search_param, search_param))
+        Подстрока ищется через индекс FTS5 (trigram), результаты ранжируются:
+        сначала точное совпадение штрих-кода, затем по релевантности.
+        Запросы короче трех символов trigram не поддерживает - для них LIKE.
+        """
+        search_term = search_term.strip()
+
+        if not self.fts_enabled or len(search_term) < 3:
+            search_param = f"%{search_term}%"
+            with self._reader() as cursor:
+                cursor.execute('''
+                SELECT * FROM products
+                WHERE name LIKE ? OR barcode LIKE ?
+                ORDER BY name
+                LIMIT ?
+                ''', (search_param, search_param, limit))
+
+                return cursor.fetchall()
 
-        return self.cursor.fetchall()
+        # Запрос оборачивается в фразу, чтобы спецсимволы FTS5 не разбирались как синтаксис
+        match_query = '"' + search_term.replace('"', '""') + '"'
+
+        with self._reader() as cursor:
+            cursor.execute('''
+            SELECT p.* FROM products_fts
+            JOIN products p ON p.id = products_fts.rowid
+            WHERE products_fts MATCH ?
+            ORDER BY p.barcode = ? DESC, products_fts.rank, p.name
+            LIMIT ?
+            ''', (match_query, search_term, limit))
+
+            return cursor.fetchall()
+
+    def get_products_page(self, sort_by='name', after=None, limit=50):
+        """Постраничное получение товаров (keyset-пагинация)
+
+        after - токен (значение ключа сортировки, id) последней строки
+        предыдущей страницы. Возвращает (товары, токен следующей страницы);
+        токен равен None, если страница последняя.
+        """
+        valid_sort_fields = ['name', 'price', 'quantity']
+        sort_field = sort_by if sort_by in valid_sort_fields else 'name'
+
+        query = "SELECT * FROM products"
+        params = []
+        if after is not None:
+            query += f" WHERE ({sort_field}, id) > (?, ?)"
+            params.extend(after)
+        query += f" ORDER BY {sort_field}, id LIMIT ?"
+        params.append(limit)
+
+        with self._reader() as cursor:
+            cursor.execute(query, params)
+            products = cursor.fetchall()
+
+        return products, self._next_page_token(products, sort_field, limit)
+
+    def search_products_page(self, search_term, after=None, limit=50):
+        """Постраничный поиск товаров по названию или штрих-коду с сортировкой по названию"""
+        search_term = search_term.strip()
+
+        if self.fts_enabled and len(search_term) >= 3:
+            query = '''
+            SELECT * FROM products
+            WHERE id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)
+            '''
+            params = ['"' + search_term.replace('"', '""') + '"']
+        else:
+            search_param = f"%{search_term}%"
+            query = '''
+            SELECT * FROM products
+            WHERE (name LIKE ? OR barcode LIKE ?)
+            '''
+            params = [search_param, search_param]
+
+        if after is not None:
+            query += " AND (name, id) > (?, ?)"
+            params.extend(after)
+        query += " ORDER BY name, id LIMIT ?"
+        params.append(limit)
+
+        with self._reader() as cursor:
+            cursor.execute(query, params)
+            products = cursor.fetchall()
+
+        return products, self._next_page_token(products, 'name', limit)
+
+    @staticmethod
+    def _next_page_token(rows, sort_field, limit):
+        """Токен следующей страницы по последней строке текущей"""
+        if len(rows) < limit:
+            return None
+        last = rows[-1]
+        return last[sort_field], last['id']
 
     def create_invoice(self, total, payment_status="Оплачено", additional_info=""):
         """Создание новой накладной"""
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        self.cursor.execute('''
-        INSERT INTO invoices (date, total, payment_status, additional_info, created_at)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (now, total, payment_status, additional_info, now))
+        now_ts = self.to_timestamp(now)
 
-        self.conn.commit()
-        return self.cursor.lastrowid
+        with self._write_lock:
+            self.cursor.execute('''
+            INSERT INTO invoices (date, total, payment_status, additional_info, created_at, date_ts, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (now, total, payment_status, additional_info, now, now_ts, now_ts))
+            invoice_id = self.cursor.lastrowid
+            self._rollup_invoice(invoice_id, 1)
+
+            self.conn.commit()
+            return invoice_id
 
     def add_invoice_item(self, invoice_id, product_id, quantity, price, total):
         """Добавление товара в накладную"""
-        self.cursor.execute('''
-        INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (invoice_id, product_id, quantity, price, total))
+        with self._write_lock:
+            self.cursor.execute('''
+            INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+            VALUES (?, ?, ?, ?, ?, (SELECT cost_price FROM products WHERE id = ?))
+            ''', (invoice_id, product_id, quantity, price, total, product_id))
+            item_id = self.cursor.lastrowid
 
-        self.conn.commit()
-        return self.cursor.lastrowid
+            self.cursor.execute('''
+            INSERT INTO daily_product_sales (day, product_id, quantity, total, cost)
+            SELECT substr(i.date, 1, 10), ii.product_id, ii.quantity, ii.total, ii.quantity * ii.cost_price
+            FROM invoice_items ii
+            JOIN invoices i ON ii.invoice_id = i.id
+            WHERE ii.id = ?
+            ON CONFLICT(day, product_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                total = total + excluded.total,
+                cost = cost + excluded.cost
+            ''', (item_id,))
+
+            self.conn.commit()
+            return item_id
+
+    def commit_sale(self, lines, payment_status="Оплачено", additional_info="", total=None):
+        """Сохранение продажи одной транзакцией: накладная, позиции и списание остатков"""
+        if total is None:
+            total = sum(line['total'] for line in lines)
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        now_ts = self.to_timestamp(now)
+
+        with self._write_lock:
+            try:
+                self.cursor.execute('''
+                INSERT INTO invoices (date, total, payment_status, additional_info, created_at, date_ts, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (now, total, payment_status, additional_info, now, now_ts, now_ts))
+                invoice_id = self.cursor.lastrowid
+
+                self.cursor.executemany('''
+                INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+                VALUES (?, ?, ?, ?, ?, (SELECT cost_price FROM products WHERE id = ?))
+                ''', [(invoice_id, line['product_id'], line['quantity'], line['price'], line['total'],
+                       line['product_id'])
+                      for line in lines])
+
+                # Списание - движения журнала; как и раньше, остаток не уходит в минус,
+                # поэтому в журнал пишется фактически списанное количество. Продажа
+                # без остатка пишется нулем: по журналу видно, что списания не было
+                self.cursor.executemany('''
+                INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts)
+                SELECT id, 'sale', -MIN(?, MAX(quantity, 0)), ?, ?
+                FROM products
+                WHERE id = ?
+                ''', [(line['quantity'], invoice_id, now_ts, line['product_id']) for line in lines])
+                self.cursor.executemany(
+                    "UPDATE products SET updated_at = ?, updated_ts = ? WHERE id = ?",
+                    [(now, now_ts, line['product_id']) for line in lines]
+                )
+
+                self._rollup_invoice(invoice_id, 1)
+
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                # Остатки проданных товаров изменились в базе
+                self.product_cache.invalidate_many(line['product_id'] for line in lines)
+
+        return invoice_id
+
+    def apply_invoice_diff(self, invoice_id, new_lines, payment_status=None, total=None):
+        """Сохранение отредактированной накладной изменением только отличающихся позиций
+
+        Позиции сопоставляются по товару: новые вставляются, измененные
+        обновляются на месте (себестоимость продажи сохраняется), пропавшие
+        удаляются. Остаток каждого товара меняется на разницу количеств:
+        рост - списание, уменьшение - возврат не больше списанного по этой
+        накладной. Все изменения, итог и агрегаты - одна транзакция.
+        Возвращает число вставленных, обновленных и удаленных позиций.
+        """
+        if total is None:
+            total = sum(line['total'] for line in new_lines)
+
+        wanted = {}
+        for line in new_lines:
+            if line['product_id'] in wanted:
+                # Повтор товара складывается в одну позицию
+                merged = dict(wanted[line['product_id']])
+                merged['quantity'] += line['quantity']
+                merged['total'] += line['total']
+                wanted[line['product_id']] = merged
+            else:
+                wanted[line['product_id']] = line
+
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
+
+        with self._write_lock:
+            self._check_not_archived(invoice_id)
+            try:
+                cursor = self.conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(
+                    "SELECT id, product_id, quantity, price, total FROM invoice_items WHERE invoice_id = ? ORDER BY id",
+                    (invoice_id,)
+                )
+                existing = cursor.fetchall()
+                cursor.close()
+                # Сколько уже списано по накладной (для ограничения возврата)
+                written_off = self._written_off(invoice_id)
+
+                inserts = []
+                updates = []
+                removed = []
+                old_quantities = {}
+                for item_id, product_id, quantity, price, line_total in existing:
+                    line = wanted.get(product_id)
+                    if line is None or product_id in old_quantities:
+                        # Товара больше нет в накладной или это его повторная строка
+                        removed.append((item_id,))
+                    elif (line['quantity'], line['price'], line['total']) != (quantity, price, line_total):
+                        updates.append((line['quantity'], line['price'], line['total'], item_id))
+                    old_quantities[product_id] = old_quantities.get(product_id, 0) + quantity
+
+                for product_id, line in wanted.items():
+                    if product_id not in old_quantities:
+                        inserts.append((invoice_id, product_id, line['quantity'], line['price'], line['total'],
+                                        product_id))
+
+                # Агрегаты пересчитываются по позициям: вычитаем старые, после изменений прибавляем новые
+                self._rollup_invoice(invoice_id, -1)
+
+                self.cursor.execute(
+                    "UPDATE invoices SET total = ?, payment_status = COALESCE(?, payment_status) WHERE id = ?",
+                    (total, payment_status, invoice_id)
+                )
+                self.cursor.executemany("DELETE FROM invoice_items WHERE id = ?", removed)
+                self.cursor.executemany(
+                    "UPDATE invoice_items SET quantity = ?, price = ?, total = ? WHERE id = ?",
+                    updates
+                )
+                self.cursor.executemany('''
+                INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+                VALUES (?, ?, ?, ?, ?, (SELECT cost_price FROM products WHERE id = ?))
+                ''', inserts)
+
+                self._apply_stock_deltas(invoice_id, wanted, old_quantities, written_off, now_ts)
+                self._rollup_invoice(invoice_id, 1)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.invalidate_many(set(wanted) | set(old_quantities))
+
+        return {'inserted': len(inserts), 'updated': len(updates), 'removed': len(removed)}
+
+    def _apply_stock_deltas(self, invoice_id, wanted, old_quantities, written_off, created_ts):
+        """Движения остатков на разницу количеств отредактированной накладной (без фиксации)"""
+        sales = []
+        returns = []
+        for product_id in set(wanted) | set(old_quantities):
+            new_quantity = wanted[product_id]['quantity'] if product_id in wanted else 0
+            delta = new_quantity - old_quantities.get(product_id, 0)
+            if delta > 0:
+                sales.append((delta, invoice_id, created_ts, product_id))
+            elif delta < 0:
+                returned = min(-delta, written_off.get(product_id, 0))
+                if returned > 0:
+                    returns.append((returned, invoice_id, created_ts, product_id))
+
+        # Дополнительное списание, как и продажа, не уводит остаток в минус
+        # и пишется в журнал даже нулем
+        self.cursor.executemany('''
+        INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts)
+        SELECT id, 'sale', -MIN(?, MAX(quantity, 0)), ?, ?
+        FROM products
+        WHERE id = ?
+        ''', sales)
+        # Удаленный из каталога товар вернуть некуда
+        self.cursor.executemany('''
+        INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts)
+        SELECT id, 'return', ?, ?, ?
+        FROM products
+        WHERE id = ?
+        ''', returns)
+
+    def delete_invoice(self, invoice_id):
+        """Удаление накладной вместе с ее позициями"""
+        with self._write_lock:
+            self._check_not_archived(invoice_id)
+            try:
+                self._rollup_invoice(invoice_id, -1)
+                self._return_invoice_stock(invoice_id)
+                self.cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+                self.cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+                deleted = self.cursor.rowcount > 0
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.product_cache.clear()
+
+        return deleted
+
+    def _return_invoice_stock(self, invoice_id):
+        """Возврат на склад всего, что списано по накладной (без фиксации)"""
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now_ts = self.to_timestamp(now)
+        returns = [(quantity, invoice_id, now_ts, product_id)
+                   for product_id, quantity in self._written_off(invoice_id).items() if quantity > 0]
+        # Удаленный из каталога товар вернуть некуда
+        self.cursor.executemany('''
+        INSERT INTO stock_movements (product_id, kind, quantity, invoice_id, created_ts)
+        SELECT id, 'return', ?, ?, ?
+        FROM products
+        WHERE id = ?
+        ''', returns)
+
+    def _written_off(self, invoice_id):
+        """Сколько списано со склада по накладной: {товар: количество} (под блокировкой записи)
+
+        Продажи после начала журнала остатков пишут движение на каждую позицию,
+        даже нулевое. Для более старых накладных движений продажи нет: как
+        и прежде, считается, что их текущие позиции списаны полностью.
+        """
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute("SELECT created_ts FROM invoices WHERE id = ?", (invoice_id,))
+            row = cursor.fetchone()
+            if row is not None and (row[0] is None or row[0] < self.stock_ledger_since_ts):
+                cursor.execute('''
+                SELECT product_id, SUM(quantity) FROM invoice_items
+                WHERE invoice_id = ?
+                GROUP BY product_id
+                ''', (invoice_id,))
+            else:
+                cursor.execute('''
+                SELECT product_id, -SUM(quantity) FROM stock_movements
+                WHERE invoice_id = ?
+                GROUP BY product_id
+                ''', (invoice_id,))
+            return dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def _may_be_archived(self, invoice_id):
+        """Может ли накладная с таким ID находиться в архиве"""
+        return self.archive_max_id is not None and invoice_id <= self.archive_max_id
+
+    def _check_not_archived(self, invoice_id):
+        """Ошибка, если накладная уже перенесена в архив (архив только для чтения)"""
+        if not self._may_be_archived(invoice_id):
+            return
+
+        self.cursor.execute("SELECT 1 FROM main.invoices WHERE id = ?", (invoice_id,))
+        if self.cursor.fetchone() is not None:
+            return
+        self.cursor.execute("SELECT 1 FROM archive.invoices WHERE id = ?", (invoice_id,))
+        if self.cursor.fetchone() is not None:
+            raise ValueError(f"Накладная #{invoice_id} перенесена в архив и не может быть изменена")
 
     def get_invoice(self, invoice_id):
-        """Получение информации о накладной"""
-        self.cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
-        return self.cursor.fetchone()
+        """Получение информации о накладной (в том числе архивной)"""
+        with self._reader() as cursor:
+            cursor.execute("SELECT * FROM main.invoices WHERE id = ?", (invoice_id,))
+            invoice = cursor.fetchone()
+            if invoice is None and self._may_be_archived(invoice_id):
+                cursor.execute(f"SELECT {INVOICE_COLUMNS} FROM archive.invoices WHERE id = ?", (invoice_id,))
+                invoice = cursor.fetchone()
+            return invoice
 
     def get_invoice_items(self, invoice_id):
-        """Получение товаров из накладной"""
-        self.cursor.execute('''
+        """Получение товаров из накладной (в том числе архивной)"""
+        query = '''
         SELECT ii.*, p.name, p.barcode
-        FROM invoice_items ii
+        FROM {db}.invoice_items ii
         JOIN products p ON ii.product_id = p.id
         WHERE ii.invoice_id = ?
-        ''', (invoice_id,))
+        '''
+        with self._reader() as cursor:
+            cursor.execute(query.format(db='main'), (invoice_id,))
+            items = cursor.fetchall()
+            if not items and self._may_be_archived(invoice_id):
+                cursor.execute(query.format(db='archive'), (invoice_id,))
+                items = cursor.fetchall()
+            return items
+
+    def _export_filter(self, start_date, end_date, after_id):
+        """Условие WHERE, параметры и порядок строк для выгрузки накладных (псевдоним i)"""
+        conditions = []
+        params = []
+        if start_date is not None:
+            conditions.append("i.date_ts >= ?")
+            params.append(self.to_timestamp(start_date))
+        if end_date is not None:
+            conditions.append("i.date_ts <= ?")
+            params.append(self.to_timestamp(end_date))
+        if after_id is not None:
+            conditions.append("i.id > ?")
+            params.append(after_id)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        # Порядок совпадает с индексом, чтобы SQLite не сортировал всю выборку:
+        # по периоду - индекс даты, по отметке выгрузки - первичный ключ
+        order = "i.id" if after_id is not None or not conditions else "i.date_ts, i.id"
+        return where, params, order
+
+    def _iter_query(self, query, params, batch_size):
+        """Построчная выдача результата запроса пачками fetchmany"""
+        with self._reader_connection() as conn:
+            # Отдельный курсор: общий курсор менеджера может понадобиться во время выгрузки
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
 
-        return self.cursor.fetchall()
+    def iter_invoices(self, start_date=None, end_date=None, after_id=None, batch_size=500):
+        """Генератор накладных без загрузки всей выборки в память
+
+        after_id - выдавать только накладные с большим ID (инкрементальная выгрузка).
+        """
+        where, params, order = self._export_filter(start_date, end_date, after_id)
+        select = f'''
+        SELECT i.id, i.date, i.total, i.payment_status, i.additional_info, i.created_at
+        FROM {{db}}.invoices i
+        {where}
+        '''
+        return self._iter_export(select, params, order, 'id', start_date, after_id, batch_size)
+
+    def iter_invoice_items(self, start_date=None, end_date=None, after_id=None, batch_size=500):
+        """Генератор позиций накладных с названием и штрих-кодом товара"""
+        where, params, order = self._export_filter(start_date, end_date, after_id)
+        select = f'''
+        SELECT
+            ii.id, ii.invoice_id, i.date, p.barcode, p.name,
+            ii.quantity, ii.price, ii.total, ii.cost_price
+        FROM {{db}}.invoices i
+        JOIN {{db}}.invoice_items ii ON ii.invoice_id = i.id
+        LEFT JOIN products p ON p.id = ii.product_id
+        {where}
+        '''
+        return self._iter_export(select, params, order, 'invoice_id', start_date, after_id, batch_size)
+
+    def _iter_export(self, select, params, order, id_column, start_date, after_id, batch_size):
+        """Выгрузка по основной базе или, если период задевает архив, по обеим"""
+        start_ts = self.to_timestamp(start_date) if start_date is not None else None
+        if not self._needs_archive(start_ts, after_id):
+            query, params = self._union_archive(select, params, False)
+            return self._iter_query(f"{query} ORDER BY {order}", params, batch_size)
+
+        # Строки двух баз сортируются вместе; текстовая дата упорядочена так же, как date_ts
+        query, params = self._union_archive(select, params, True)
+        outer_order = id_column if order == "i.id" else f"date, {id_column}"
+        return self._iter_query(f"SELECT * FROM ({query}) ORDER BY {outer_order}", params, batch_size)
 
     def get_invoices_by_period(self, start_date, end_date):
-        """Получение накладных за период"""
-        self.cursor.execute('''
-        SELECT * FROM invoices
-        WHERE date BETWEEN ? AND ?
-        ORDER BY date DESC
-        ''', (start_date, end_date))
+        """Получение накладных за период (с архивом, если период его задевает)"""
+        start_ts = self.to_timestamp(start_date)
+        query, params = self._union_archive(
+            f"SELECT {INVOICE_SELECT} FROM {{db}}.invoices i WHERE i.date_ts BETWEEN ? AND ?",
+            (start_ts, self.to_timestamp(end_date)),
+            self._needs_archive(start_ts)
+        )
+
+        with self._reader() as cursor:
+            cursor.execute(f"SELECT * FROM ({query}) ORDER BY date_ts DESC, id DESC", params)
+            return cursor.fetchall()
+
+    def _invoice_list_query(self, start_date, end_date, payment_status=None, id_search=None, after=None):
+        """Запрос списка накладных с числом позиций; при необходимости вместе с архивом"""
+        start_ts = self.to_timestamp(start_date)
+        query = f'''
+        SELECT {INVOICE_SELECT},
+            (SELECT COUNT(*) FROM {{db}}.invoice_items ii WHERE ii.invoice_id = i.id) as items_count
+        FROM {{db}}.invoices i
+        WHERE i.date_ts BETWEEN ? AND ?
+        '''
+        params = [start_ts, self.to_timestamp(end_date)]
+
+        if payment_status is not None:
+            query += " AND i.payment_status = ?"
+            params.append(payment_status)
+        if id_search:
+            query += " AND i.id LIKE ?"
+            params.append(f"%{id_search}%")
+        if after is not None:
+            query += " AND (i.date_ts, i.id) < (?, ?)"
+            params.extend(after)
+
+        query, params = self._union_archive(query, params, self._needs_archive(start_ts))
+        return f"SELECT * FROM ({query}) ORDER BY date_ts DESC, id DESC", params
+
+    def get_invoices_page(self, start_date, end_date, after=None, limit=50, payment_status=None, id_search=None):
+        """Постраничное получение накладных за период, от новых к старым
+
+        after - токен (date_ts, id) последней накладной предыдущей страницы.
+        payment_status и id_search - необязательные фильтры по статусу оплаты
+        и по подстроке номера накладной. Возвращает (накладные, токен).
+        """
+        query, params = self._invoice_list_query(start_date, end_date, payment_status, id_search, after)
+
+        with self._reader() as cursor:
+            cursor.execute(query + " LIMIT ?", params + [limit])
+            invoices = cursor.fetchall()
+
+        return invoices, self._next_page_token(invoices, 'date_ts', limit)
+
+    @staticmethod
+    def _rollup_day_range(start_date, end_date):
+        """Границы периода в днях, если он покрывает целые сутки, иначе None"""
+        if start_date.endswith(" 00:00:00") and end_date.endswith(" 23:59:59"):
+            return start_date[:10], end_date[:10]
+        return None
+
+    @staticmethod
+    def _parse_invoice_search(search_query):
+        """Текст поиска экрана истории -> (статус оплаты, подстрока номера)"""
+        payment_status = None
+        id_search = None
 
-        return self.cursor.fetchall()
+        if search_query:
+            # Для поиска по статусу оплаты преобразуем текст в число
+            if search_query.lower() in ["оплачено", "оплачен", "paid"]:
+                payment_status = 1
+            elif search_query.lower() in ["не оплачено", "не оплачен", "unpaid"]:
+                payment_status = 0
+            else:
+                # Поиск по номеру накладной
+                id_search = search_query
+
+        return payment_status, id_search
+
+    def search_invoices_page(self, start_date, end_date, search_query="", after=None, limit=50):
+        """Постраничный вариант filter_invoices; возвращает (накладные, токен)"""
+        payment_status, id_search = self._parse_invoice_search(search_query)
+        return self.get_invoices_page(start_date, end_date, after, limit, payment_status, id_search)
+
+    def filter_invoices(self, start_date, end_date, search_query=""):
+        """Накладные за период с поиском по номеру или статусу оплаты (экран истории)"""
+        payment_status, id_search = self._parse_invoice_search(search_query)
+        query, params = self._invoice_list_query(start_date, end_date, payment_status, id_search)
+
+        with self._reader() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def _period_rows(self, select, start_date, end_date):
+        """Строки периода по основной базе и, если нужно, по архиву (для агрегатов)
+
+        select - запрос с {db} и условием "i.date_ts BETWEEN ? AND ?".
+        """
+        start_ts = self.to_timestamp(start_date)
+        return self._union_archive(
+            select, (start_ts, self.to_timestamp(end_date)), self._needs_archive(start_ts)
+        )
 
     def get_sales_analytics(self, start_date, end_date):
         """Получение аналитики продаж за период"""
-        self.cursor.execute('''
-        SELECT
-            SUM(i.total) as total_sales,
-            COUNT(i.id) as invoice_count,
-            AVG(i.total) as average_invoice,
-            SUM(CASE WHEN i.payment_status = 'Оплачено' THEN i.total ELSE 0 END) as paid_amount,
-            SUM(CASE WHEN i.payment_status = 'В долг' THEN i.total ELSE 0 END) as debt_amount
-        FROM invoices i
-        WHERE i.date BETWEEN ? AND ?
-        ''', (start_date, end_date))
+        day_range = self._rollup_day_range(start_date, end_date)
+        if day_range:
+            # Период из целых дней считается по дневным агрегатам
+            with self._reader() as cursor:
+                cursor.execute('''
+                SELECT
+                    SUM(total_sales) as total_sales,
+                    COALESCE(SUM(invoice_count), 0) as invoice_count,
+                    SUM(total_sales) / NULLIF(SUM(invoice_count), 0) as average_invoice,
+                    SUM(paid_amount) as paid_amount,
+                    SUM(debt_amount) as debt_amount
+                FROM daily_sales
+                WHERE day BETWEEN ? AND ?
+                ''', day_range)
+
+                return cursor.fetchone()
+
+        rows, params = self._period_rows('''
+        SELECT i.id, i.total, i.payment_status
+        FROM {db}.invoices i
+        WHERE i.date_ts BETWEEN ? AND ?
+        ''', start_date, end_date)
 
-        return self.cursor.fetchone()
+        with self._reader() as cursor:
+            cursor.execute(f'''
+            SELECT
+                SUM(total) as total_sales,
+                COUNT(id) as invoice_count,
+                AVG(total) as average_invoice,
+                SUM(CASE WHEN payment_status = 'Оплачено' THEN total ELSE 0 END) as paid_amount,
+                SUM(CASE WHEN payment_status = 'В долг' THEN total ELSE 0 END) as debt_amount
+            FROM ({rows})
+            ''', params)
+
+            return cursor.fetchone()
 
     def get_profit_analytics(self, start_date, end_date):
         """Получение аналитики прибыли за период"""
-        self.cursor.execute('''
-        SELECT
-            SUM(ii.total) as revenue,
-            SUM(ii.quantity * p.cost_price) as cost,
-            SUM(ii.total) - SUM(ii.quantity * p.cost_price) as profit
-        FROM invoice_items ii
-        JOIN products p ON ii.product_id = p.id
-        JOIN invoices i ON ii.invoice_id = i.id
-        WHERE i.date BETWEEN ? AND ?
-        ''', (start_date, end_date))
+        day_range = self._rollup_day_range(start_date, end_date)
+        if day_range:
+            with self._reader() as cursor:
+                cursor.execute('''
+                SELECT
+                    SUM(total) as revenue,
+                    SUM(cost) as cost,
+                    SUM(total) - SUM(cost) as profit
+                FROM daily_product_sales
+                WHERE day BETWEEN ? AND ?
+                ''', day_range)
+
+                return cursor.fetchone()
 
-        return self.cursor.fetchone()
+        rows, params = self._period_rows('''
+        SELECT ii.total, ii.quantity, ii.cost_price
+        FROM {db}.invoices i
+        JOIN {db}.invoice_items ii ON ii.invoice_id = i.id
+        WHERE i.date_ts BETWEEN ? AND ?
+        ''', start_date, end_date)
+
+        with self._reader() as cursor:
+            cursor.execute(f'''
+            SELECT
+                SUM(total) as revenue,
+                SUM(quantity * cost_price) as cost,
+                SUM(total) - SUM(quantity * cost_price) as profit
+            FROM ({rows})
+            ''', params)
+
+            return cursor.fetchone()
 
     def get_top_products(self, start_date, end_date, limit=10):
         """Получение топ-продаваемых товаров за период"""
-        self.cursor.execute('''
-        SELECT
-            p.id, p.name, p.barcode,
-            SUM(ii.quantity) as total_quantity,
-            SUM(ii.total) as total_sales
-        FROM invoice_items ii
-        JOIN products p ON ii.product_id = p.id
-        JOIN invoices i ON ii.invoice_id = i.id
-        WHERE i.date BETWEEN ? AND ?
-        GROUP BY p.id
-        ORDER BY total_quantity DESC
-        LIMIT ?
-        ''', (start_date, end_date, limit))
+        day_range = self._rollup_day_range(start_date, end_date)
+        if day_range:
+            with self._reader() as cursor:
+                cursor.execute('''
+                SELECT
+                    p.id, p.name, p.barcode,
+                    SUM(d.quantity) as total_quantity,
+                    SUM(d.total) as total_sales
+                FROM daily_product_sales d
+                JOIN products p ON d.product_id = p.id
+                WHERE d.day BETWEEN ? AND ?
+                GROUP BY p.id
+                ORDER BY total_quantity DESC
+                LIMIT ?
+                ''', (*day_range, limit))
+
+                return cursor.fetchall()
+
+        rows, params = self._period_rows('''
+        SELECT ii.product_id, ii.quantity, ii.total
+        FROM {db}.invoices i
+        JOIN {db}.invoice_items ii ON ii.invoice_id = i.id
+        WHERE i.date_ts BETWEEN ? AND ?
+        ''', start_date, end_date)
+
+        with self._reader() as cursor:
+            cursor.execute(f'''
+            SELECT
+                p.id, p.name, p.barcode,
+                top.total_quantity, top.total_sales
+            FROM (
+                SELECT
+                    product_id,
+                    SUM(quantity) as total_quantity,
+                    SUM(total) as total_sales
+                FROM ({rows})
+                GROUP BY product_id
+                ORDER BY total_quantity DESC
+                LIMIT ?
+            ) top
+            JOIN products p ON top.product_id = p.id
+            ORDER BY top.total_quantity DESC
+            ''', params + [limit])
 
-        return self.cursor.fetchall()
+            return cursor.fetchall()
 
     def close(self):
         """Закрытие соединения с базой данных"""
-        if self.conn:
-            self.conn.close()
\ No newline at end of file
+        if self.pool is not None:
+            self.pool.close()
+        elif self.conn:
+            self.conn.close()
@@ -0,0 +1,113 @@
+# db_executor.py
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+class DbExecutor:
+    """Выполнение запросов к базе в рабочих потоках с возвратом результата в поток интерфейса
+
+    Каждый запрос получает тег (обычно имя экрана и списка). Новый запрос
+    с тем же тегом делает предыдущий устаревшим: если тот еще не начался,
+    он отменяется, а если уже выполняется - его результат не доставляется.
+    """
+
+    def __init__(self, get_db, max_workers=2, dispatch=None):
+        """Инициализация исполнителя
+
+        get_db - функция, возвращающая DatabaseManager (вызывается в рабочем
+        потоке, поэтому ожидание открытия базы не блокирует интерфейс).
+        dispatch - функция передачи вызова в поток интерфейса; по умолчанию
+        Clock.schedule_once из Kivy.
+        """
+        self.get_db = get_db
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._dispatch = dispatch
+        self._lock = threading.Lock()
+        # Последний запрос по каждому тегу: тег -> (номер, Future или None до отправки)
+        self._latest = {}
+        self._counter = 0
+
+    def _deliver(self, callback, *args):
+        """Вызов обработчика в потоке интерфейса"""
+        if self._dispatch is not None:
+            self._dispatch(lambda: callback(*args))
+            return
+
+        from kivy.clock import Clock
+        Clock.schedule_once(lambda dt: callback(*args))
+
+    def is_current(self, tag, number):
+        """Является ли запрос с этим номером последним по своему тегу"""
+        with self._lock:
+            latest = self._latest.get(tag)
+            return latest is not None and latest[0] == number
+
+    def submit(self, tag, fn, on_result=None, on_error=None):
+        """Выполнение fn(db) в рабочем потоке; возвращает Future
+
+        on_result(result) и on_error(exception) вызываются в потоке
+        интерфейса и только если запрос не устарел к моменту завершения.
+        """
+        with self._lock:
+            self._counter += 1
+            number = self._counter
+            previous = self._latest.get(tag)
+            # Регистрируем запрос до отправки, чтобы рабочий поток видел его актуальным
+            self._latest[tag] = (number, None)
+
+        if previous is not None and previous[1] is not None:
+            previous[1].cancel()
+
+        def run():
+            # Запрос мог устареть, пока ждал в очереди
+            if not self.is_current(tag, number):
+                raise CancelledError()
+            return fn(self.get_db())
+
+        future = self._pool.submit(run)
+        with self._lock:
+            if self._latest.get(tag, (None,))[0] == number:
+                self._latest[tag] = (number, future)
+
+        def done(completed):
+            if completed.cancelled() or isinstance(completed.exception(), CancelledError):
+                return
+            if completed.exception() is not None:
+                print(f"Ошибка запроса к базе данных ({tag}): {completed.exception()}")
+            self._deliver(self._finish, tag, number, completed, on_result, on_error)
+
+        future.add_done_callback(done)
+        return future
+
+    def _finish(self, tag, number, future, on_result, on_error):
+        """Доставка результата в потоке интерфейса, если запрос еще актуален"""
+        with self._lock:
+            latest = self._latest.get(tag)
+            if latest is None or latest[0] != number:
+                return
+            del self._latest[tag]
+
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+        elif on_result is not None:
+            on_result(future.result())
+
+    def is_idle(self):
+        """Нет ли запросов, результат которых еще не доставлен"""
+        with self._lock:
+            return not self._latest
+
+    def cancel(self, tag):
+        """Отмена запроса с тегом (например, при уходе с экрана)"""
+        with self._lock:
+            latest = self._latest.pop(tag, None)
+        if latest is not None and latest[1] is not None:
+            latest[1].cancel()
+
+    def shutdown(self, wait=False):
+        """Остановка рабочих потоков; невыполненные запросы отменяются"""
+        with self._lock:
+            self._latest.clear()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
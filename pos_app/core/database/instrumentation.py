@@ -0,0 +1,256 @@
+# instrumentation.py
+"""Замер запросов DatabaseManager на устройстве.
+
+Соединения базы создаются с классом из instrumented_connection_class:
+его курсоры замеряют execute/executemany и последующие fetch*, считают
+возвращенные строки и передают итог в QueryStats. Пока запись выключена
+(QueryStats.enabled), курсор только проверяет флаг и сразу вызывает
+исходный метод, поэтому слой можно держать установленным всегда.
+
+Для каждого оператора (SQL без лишних пробелов, списки "?, ?, ?" свернуты)
+хранятся число вызовов, суммарное и максимальное время, строки
+и гистограмма задержек. Запросы дольше slow_ms попадают в кольцевой
+буфер вместе с параметрами и планом EXPLAIN QUERY PLAN.
+Перебор курсора циклом for строки не считает - в коде менеджера
+используются только fetch*.
+"""
+import collections
+import re
+import sqlite3
+import threading
+import time
+
+# Верхние границы корзин гистограммы задержек, мс
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Ключ оператора: SQL в одну строку со свернутыми списками параметров"""
+    return _PLACEHOLDER_LIST.sub('?, ...', ' '.join(sql.split()))
+
+
+class StatementStats:
+    """Накопленные замеры одного оператора"""
+
+    __slots__ = ('count', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def add(self, elapsed_ms, rows):
+        """Учет одного выполнения"""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+
+    def percentile(self, fraction):
+        """Оценка перцентиля задержки по гистограмме (верхняя граница корзины), мс"""
+        target = self.count * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+class QueryStats:
+    """Статистика запросов и журнал медленных запросов (потокобезопасно)"""
+
+    def __init__(self, enabled=False, slow_ms=50, slow_log_size=50):
+        """Инициализация статистики; enabled - вести ли запись сразу"""
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.started = time.time()
+        self._statements = {}
+        self._slow = collections.deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, connection, sql, params, elapsed_ms, rows):
+        """Учет выполненного оператора; медленный попадает в журнал с планом"""
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = StatementStats()
+            stats.add(elapsed_ms, rows)
+
+        if elapsed_ms < self.slow_ms:
+            return
+
+        entry = {
+            'sql': key,
+            'params': repr(params)[:200] if params is not None else '',
+            'ms': round(elapsed_ms, 2),
+            'rows': rows,
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'thread': threading.current_thread().name,
+            'plan': self.explain(connection, sql, params),
+        }
+        with self._lock:
+            self._slow.append(entry)
+
+    @staticmethod
+    def explain(connection, sql, params):
+        """План запроса с теми же параметрами или пустой список"""
+        if params is None or not _EXPLAINABLE.match(sql):
+            return []
+        try:
+            # Базовый курсор: план не должен сам попадать в статистику
+            cursor = sqlite3.Cursor(connection)
+            cursor.row_factory = None
+            try:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                return [row[3] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except sqlite3.Error:
+            return []
+
+    def snapshot(self, limit=None):
+        """Копия статистики: операторы по убыванию суммарного времени и медленные запросы"""
+        with self._lock:
+            statements = [
+                {
+                    'sql': key,
+                    'count': stats.count,
+                    'total_ms': round(stats.total_ms, 2),
+                    'avg_ms': round(stats.total_ms / stats.count, 3),
+                    'p50_ms': round(stats.percentile(0.5), 2),
+                    'p95_ms': round(stats.percentile(0.95), 2),
+                    'max_ms': round(stats.max_ms, 2),
+                    'rows': stats.rows,
+                    'histogram': dict(zip(LATENCY_BUCKETS_MS, stats.buckets)),
+                }
+                for key, stats in self._statements.items()
+            ]
+            slow = list(self._slow)
+
+        statements.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'since': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            'slow_ms': self.slow_ms,
+            'statements': statements[:limit] if limit else statements,
+            'slow': slow[::-1],
+        }
+
+    def reset(self):
+        """Сброс накопленной статистики"""
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+            self.started = time.time()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий выполнение и выборку строк своего последнего оператора"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self._stats = connection.query_stats
+        # Незавершенный замер: [sql, params, мс, строки]
+        self._pending = None
+
+    def _finish(self):
+        """Передача замера последнего оператора в статистику"""
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            self._stats.record(self.connection, *pending)
+
+    def execute(self, sql, parameters=()):
+        if not self._stats.enabled:
+            self._pending = None
+            return super().execute(sql, parameters)
+
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.description is None:
+            # Без результата (INSERT, UPDATE, DDL) замер завершен сразу
+            self._stats.record(self.connection, sql, parameters, elapsed, max(self.rowcount, 0))
+        else:
+            self._pending = [sql, parameters, elapsed, 0]
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not self._stats.enabled:
+            self._pending = None
+            return super().executemany(sql, seq_of_parameters)
+
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        elapsed = (time.perf_counter() - started) * 1000
+        self._stats.record(self.connection, sql, None, elapsed, max(self.rowcount, 0))
+        return self
+
+    def _fetched(self, started, count, done):
+        """Учет времени и строк выборки; done - результат исчерпан"""
+        pending = self._pending
+        if pending is not None:
+            pending[2] += (time.perf_counter() - started) * 1000
+            pending[3] += count
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        if self._pending is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+def instrumented_connection_class(stats):
+    """Класс соединения, курсоры которого пишут замеры в stats (для factory в sqlite3.connect)"""
+
+    class InstrumentedConnection(sqlite3.Connection):
+        query_stats = stats
+
+        def cursor(self, factory=InstrumentedCursor):
+            return super().cursor(factory)
+
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+    return InstrumentedConnection
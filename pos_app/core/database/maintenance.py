@@ -0,0 +1,198 @@
+# maintenance.py
+"""Обслуживание базы данных в периоды простоя.
+
+DatabaseMaintenance выполняет работу короткими порциями под блокировкой
+записи: между порциями блокировка отпускается, поэтому продажа ждет
+не дольше одной порции. Каждый запуск ограничен бюджетом времени.
+
+Накладные старше горизонта архивации переносятся в архивную базу, а остатки
+товаров сверяются с журналом движений (контрольная точка).
+
+MaintenanceScheduler раз в interval секунд проверяет, были ли записи
+в базу (по conn.total_changes), и запускает обслуживание только после
+idle_seconds без изменений. Работа выполняется через DbExecutor.
+"""
+import time
+
+# Связи, которые должны были удаляться каскадно: (таблица, условие "сирота")
+ORPHAN_CHECKS = [
+    ('invoice_items', "invoice_id NOT IN (SELECT id FROM invoices)"),
+    ('product_categories', "product_id NOT IN (SELECT id FROM products)"),
+    ('product_categories', "category_id NOT IN (SELECT id FROM categories)"),
+]
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class DatabaseMaintenance:
+    """Очистка сирот, статистика планировщика и возврат свободного места"""
+
+    def __init__(self, db, batch_size=500, vacuum_pages=128, full_vacuum_max_bytes=1024 * 1024):
+        """Инициализация обслуживания для указанного DatabaseManager"""
+        self.db = db
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        # Разовый полный VACUUM (перевод в auto_vacuum=INCREMENTAL) держит блокировку
+        # записи все время работы, а бюджет проверяется только до его начала. Поэтому
+        # в проходе обслуживания он разрешен лишь для файла до 1 МБ: его перезапись
+        # занимает десятки миллисекунд; большую базу переводят явным вызовом
+        # enable_incremental_vacuum
+        self.full_vacuum_max_bytes = full_vacuum_max_bytes
+
+    def _pragma(self, name):
+        """Значение PRAGMA на соединении-писателе"""
+        # Курсор писателя общий с продажами в потоке интерфейса
+        with self.db._write_lock:
+            self.db.cursor.execute(f"PRAGMA {name}")
+            return self.db.cursor.fetchone()[0]
+
+    def purge_orphans(self, deadline):
+        """Удаление строк, ссылающихся на удаленные записи, пачками до deadline"""
+        purged = 0
+        for table, condition in ORPHAN_CHECKS:
+            while time.monotonic() < deadline:
+                with self.db._write_lock:
+                    try:
+                        self.db.cursor.execute(f'''
+                        DELETE FROM {table}
+                        WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)
+                        ''', (self.batch_size,))
+                        deleted = self.db.cursor.rowcount
+                        self.db.conn.commit()
+                    except Exception:
+                        self.db.conn.rollback()
+                        raise
+                purged += deleted
+                if deleted < self.batch_size:
+                    break
+        return purged
+
+    def optimize(self):
+        """Обновление статистики планировщика запросов"""
+        with self.db._write_lock:
+            self.db.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if self.db.cursor.fetchone() is None:
+                # Статистики еще нет - собираем ее с ограничением на число строк
+                self.db.cursor.execute("PRAGMA analysis_limit = 1000")
+                self.db.cursor.execute("ANALYZE")
+            else:
+                # optimize пересобирает статистику только там, где она устарела
+                self.db.cursor.execute("PRAGMA analysis_limit = 400")
+                self.db.cursor.execute("PRAGMA optimize")
+            self.db.conn.commit()
+
+    def incremental_vacuum(self, deadline):
+        """Возврат свободных страниц файлу порциями до deadline"""
+        released = 0
+        while time.monotonic() < deadline:
+            with self.db._write_lock:
+                free_pages = self._pragma("freelist_count")
+                if not free_pages:
+                    break
+                # execute() делает один шаг и освобождает одну страницу,
+                # executescript() выполняет прагму до конца
+                self.db.conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                released += free_pages - self._pragma("freelist_count")
+        return released
+
+    def enable_incremental_vacuum(self):
+        """Разовый перевод базы в auto_vacuum=INCREMENTAL (полный VACUUM, блокирует запись до конца)"""
+        with self.db._write_lock:
+            self.db.conn.commit()
+            self.db.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.db.cursor.execute("VACUUM")
+
+    def database_size(self):
+        """Размер файла базы в байтах по числу страниц"""
+        with self.db._write_lock:
+            return self._pragma("page_count") * self._pragma("page_size")
+
+    def run(self, budget=0.5):
+        """Один проход обслуживания в пределах budget секунд; возвращает отчет"""
+        started = time.monotonic()
+        deadline = started + budget
+        report = {'orphans': 0, 'archived': 0, 'stock_checked': 0, 'stock_mismatches': 0,
+                  'optimized': False, 'vacuum_pages': 0, 'full_vacuum': False}
+
+        report['orphans'] = self.purge_orphans(deadline)
+
+        if time.monotonic() < deadline:
+            # Старые накладные уходят в архив; освободившиеся страницы вернет вакуум ниже
+            report['archived'] = self.db.archive_old_invoices(batch_size=self.batch_size, deadline=deadline)
+
+        if time.monotonic() < deadline:
+            # Контрольная точка журнала остатков со сверкой products.quantity
+            report['stock_checked'], report['stock_mismatches'] = self.db.checkpoint_stock(
+                batch_size=self.batch_size, deadline=deadline
+            )
+
+        if time.monotonic() < deadline:
+            self.optimize()
+            report['optimized'] = True
+
+        if self._pragma("auto_vacuum") != AUTO_VACUUM_INCREMENTAL:
+            # Полный VACUUM - только пока бюджет не исчерпан и только для небольшого файла
+            if time.monotonic() < deadline and self.database_size() <= self.full_vacuum_max_bytes:
+                self.enable_incremental_vacuum()
+                report['full_vacuum'] = True
+        elif time.monotonic() < deadline:
+            report['vacuum_pages'] = self.incremental_vacuum(deadline)
+
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+
+class MaintenanceScheduler:
+    """Запуск обслуживания базы, когда в нее давно не было записей"""
+
+    def __init__(self, executor, interval=300, idle_seconds=120, budget=0.5):
+        """Инициализация планировщика поверх DbExecutor"""
+        self.executor = executor
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.budget = budget
+
+        self.last_report = None
+        self._event = None
+        self._last_changes = None
+        self._last_change_time = time.monotonic()
+
+    def start(self):
+        """Запуск периодической проверки через Clock"""
+        from kivy.clock import Clock
+        if self._event is None:
+            self._event = Clock.schedule_interval(self.tick, self.interval)
+
+    def stop(self):
+        """Остановка периодической проверки"""
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        self.executor.cancel('maintenance')
+
+    def tick(self, *args):
+        """Проверка простоя и запуск обслуживания в рабочем потоке"""
+        self.executor.submit('maintenance', self.run_if_idle, on_result=self.on_finished)
+
+    def run_if_idle(self, db):
+        """Обслуживание, если база не менялась idle_seconds (в рабочем потоке)"""
+        now = time.monotonic()
+        changes = db.conn.total_changes
+        if changes != self._last_changes:
+            self._last_changes = changes
+            self._last_change_time = now
+            return None
+
+        if now - self._last_change_time < self.idle_seconds:
+            return None
+
+        report = DatabaseMaintenance(db).run(self.budget)
+        # Собственные записи обслуживания не считаются активностью
+        self._last_changes = db.conn.total_changes
+        return report
+
+    def on_finished(self, report):
+        """Итог прохода обслуживания (в потоке интерфейса)"""
+        if report is not None:
+            self.last_report = report
+            print(f"Обслуживание базы данных: {report}")
@@ -0,0 +1,466 @@
+# migrations.py
+"""Версионированные миграции схемы базы данных.
+
+Номер последней примененной миграции хранится в таблице schema_version
+и дублируется в заголовке файла (PRAGMA user_version). При запуске
+сначала читается user_version: если схема актуальна, проверка на этом
+заканчивается без единого запроса к таблицам и без DDL.
+
+Базы, созданные до появления миграций, находятся на версии 0: все шаги
+написаны так, чтобы их можно было применить к уже частично созданной схеме.
+"""
+import sqlite3
+
+
+def _ensure_column(cursor, table, column, definition):
+    """Добавление столбца в существующую таблицу; True, если столбец был добавлен"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if any(row['name'] == column for row in cursor.fetchall()):
+        return False
+
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def _table_exists(cursor, name):
+    """Проверка наличия таблицы"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def initial_schema(db, cursor):
+    """Исходные таблицы приложения"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS app_settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT UNIQUE NOT NULL,
+        value TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        barcode TEXT UNIQUE,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        cost_price REAL DEFAULT 0,
+        quantity INTEGER DEFAULT 0,
+        unit TEXT DEFAULT "шт",
+        group_name TEXT,
+        subgroup TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS invoices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        total REAL NOT NULL,
+        payment_status INTEGER DEFAULT 1,
+        additional_info TEXT,
+        created_at TEXT,
+        user_id INTEGER
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS invoice_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        total REAL NOT NULL,
+        FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE RESTRICT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        description TEXT,
+        created_at TEXT
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_categories (
+        product_id INTEGER,
+        category_id INTEGER,
+        PRIMARY KEY (product_id, category_id),
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+        FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
+    )
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items(invoice_id)')
+
+
+def product_search_index(db, cursor):
+    """Полнотекстовый индекс FTS5 (trigram) по названию и штрих-коду товара"""
+    if _table_exists(cursor, 'products_fts'):
+        return
+
+    try:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE products_fts USING fts5(
+            name, barcode,
+            content='products', content_rowid='id',
+            tokenize='trigram'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        # Сборка SQLite без FTS5 или trigram (< 3.34) - поиск остается на LIKE
+        print(f"Полнотекстовый поиск недоступен: {e}")
+        return
+
+    # Триггеры поддерживают индекс в актуальном состоянии
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, barcode)
+        VALUES ('delete', old.id, old.name, old.barcode);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, barcode ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, barcode)
+        VALUES ('delete', old.id, old.name, old.barcode);
+        INSERT INTO products_fts(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END
+    ''')
+
+    # Индексируем уже существующие товары
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+def pagination_indexes(db, cursor):
+    """Индексы под постраничную выборку (ключ сортировки + id)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_name_id ON products(name, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price_id ON products(price, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_quantity_id ON products(quantity, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_date_id ON invoices(date DESC, id DESC)')
+
+
+def invoice_item_cost(db, cursor):
+    """Себестоимость на момент продажи в позиции накладной"""
+    if _ensure_column(cursor, 'invoice_items', 'cost_price', 'REAL'):
+        cursor.execute('''
+        UPDATE invoice_items
+        SET cost_price = (SELECT p.cost_price FROM products p WHERE p.id = invoice_items.product_id)
+        ''')
+
+
+def daily_rollups(db, cursor):
+    """Агрегаты продаж по дням для аналитики"""
+    if _table_exists(cursor, 'daily_sales'):
+        # Агрегаты из версии без себестоимости пересчитываем
+        if _ensure_column(cursor, 'daily_product_sales', 'cost', 'REAL NOT NULL DEFAULT 0'):
+            cursor.execute("DELETE FROM daily_sales")
+            cursor.execute("DELETE FROM daily_product_sales")
+            db._fill_rollups()
+        return
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_sales (
+        day TEXT PRIMARY KEY,
+        total_sales REAL NOT NULL DEFAULT 0,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        paid_amount REAL NOT NULL DEFAULT 0,
+        debt_amount REAL NOT NULL DEFAULT 0
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_product_sales (
+        day TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        cost REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, product_id)
+    )
+    ''')
+
+    # Заполняем агрегаты по уже существующим накладным
+    db._fill_rollups()
+
+
+def index_cleanup(db, cursor):
+    """Покрывающий индекс позиций и удаление дублирующих индексов"""
+    # barcode UNIQUE уже создает автоиндекс, отдельный индекс только удваивал запись
+    cursor.execute('DROP INDEX IF EXISTS idx_products_barcode')
+    # Покрывающий индекс: отчеты читают позиции накладной без обращения к таблице.
+    # Он начинается с invoice_id, поэтому заменяет прежний индекс по invoice_id
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_cover
+    ON invoice_items(invoice_id, product_id, quantity, total, cost_price)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_invoice_items_invoice_id')
+    # Индекс по (date, id) полностью заменяет индекс по одной дате
+    cursor.execute('DROP INDEX IF EXISTS idx_invoices_date')
+
+
+def epoch_timestamps(db, cursor):
+    """Целочисленные метки времени (секунды эпохи) рядом с текстовыми датами"""
+    _ensure_column(cursor, 'invoices', 'date_ts', 'INTEGER')
+    _ensure_column(cursor, 'invoices', 'created_ts', 'INTEGER')
+    _ensure_column(cursor, 'products', 'updated_ts', 'INTEGER')
+
+    # strftime('%s') читает время как UTC - так же считает DatabaseManager.to_timestamp
+    cursor.execute('''
+    UPDATE invoices
+    SET date_ts = CAST(strftime('%s', date) AS INTEGER),
+        created_ts = CAST(strftime('%s', created_at) AS INTEGER)
+    ''')
+    cursor.execute("UPDATE products SET updated_ts = CAST(strftime('%s', updated_at) AS INTEGER)")
+
+    # Накладные, вставленные без метки времени, получают ее из текстовой даты
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS invoices_date_ts_ai AFTER INSERT ON invoices
+    WHEN NEW.date_ts IS NULL BEGIN
+        UPDATE invoices
+        SET date_ts = CAST(strftime('%s', NEW.date) AS INTEGER),
+            created_ts = CAST(strftime('%s', NEW.created_at) AS INTEGER)
+        WHERE id = NEW.id;
+    END
+    ''')
+
+    # Диапазоны дат теперь сравнивают целые числа
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_date_ts_id ON invoices(date_ts DESC, id DESC)')
+    cursor.execute('DROP INDEX IF EXISTS idx_invoices_date_id')
+
+
+def foreign_key_indexes(db, cursor):
+    """Индекс по ссылке позиций на товар для проверок внешних ключей"""
+    # С включенными foreign_keys вставка товара проверяет дочерние строки,
+    # без индекса это полный просмотр invoice_items
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoice_items_product_id ON invoice_items(product_id)')
+
+
+def stock_ledger(db, cursor):
+    """Журнал движения остатков и контрольные точки остатков"""
+    # quantity - изменение остатка со знаком: продажа и списание отрицательные
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('sale', 'return', 'receipt', 'adjustment')),
+        quantity INTEGER NOT NULL,
+        invoice_id INTEGER,
+        created_ts INTEGER NOT NULL,
+        note TEXT,
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    )
+    ''')
+    # Остаток на дату: движения товара в диапазоне времени без обращения к таблице
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_stock_movements_product_ts
+    ON stock_movements(product_id, created_ts, quantity)
+    ''')
+    # Сверка с контрольной точкой: движения товара после заданного ID
+    # (он же нужен каскадному удалению товара)
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_stock_movements_product_id
+    ON stock_movements(product_id, id, quantity)
+    ''')
+    # Возврат по накладной ищет ее продажи
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_stock_movements_invoice
+    ON stock_movements(invoice_id) WHERE invoice_id IS NOT NULL
+    ''')
+
+    # Проверенный остаток товара после движения movement_id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_checkpoints (
+        product_id INTEGER NOT NULL,
+        movement_id INTEGER NOT NULL,
+        created_ts INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (product_id, movement_id),
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+    # Текущие остатки становятся начальными движениями журнала
+    # (до создания триггера, иначе остаток удвоится)
+    cursor.execute('''
+    INSERT INTO stock_movements (product_id, kind, quantity, created_ts, note)
+    SELECT id, 'adjustment', quantity, CAST(strftime('%s', 'now', 'localtime') AS INTEGER), 'Начальный остаток'
+    FROM products
+    WHERE quantity != 0
+    ''')
+
+    # products.quantity - сумма журнала, поддерживаемая триггером
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stock_movements_ai AFTER INSERT ON stock_movements
+    BEGIN
+        UPDATE products SET quantity = quantity + NEW.quantity WHERE id = NEW.product_id;
+    END
+    ''')
+
+
+def stock_ledger_start(db, cursor):
+    """Начало журнала остатков: накладные, созданные раньше, продавались без движений"""
+    # В базе, где журнал уже ведется, началом считается его первое движение
+    cursor.execute('''
+    INSERT OR IGNORE INTO app_settings (key, value, created_at, updated_at)
+    SELECT 'stock_ledger_since_ts',
+           COALESCE(MIN(created_ts), CAST(strftime('%s', 'now', 'localtime') AS INTEGER)),
+           datetime('now', 'localtime'), datetime('now', 'localtime')
+    FROM stock_movements
+    ''')
+
+
+# Упорядоченный список миграций: (версия, описание, функция)
+MIGRATIONS = [
+    (1, "Исходная схема", initial_schema),
+    (2, "Полнотекстовый поиск товаров", product_search_index),
+    (3, "Индексы постраничной выборки", pagination_indexes),
+    (4, "Себестоимость в позициях накладных", invoice_item_cost),
+    (5, "Агрегаты продаж по дням", daily_rollups),
+    (6, "Покрывающий индекс позиций и чистка индексов", index_cleanup),
+    (7, "Целочисленные метки времени", epoch_timestamps),
+    (8, "Индексы внешних ключей", foreign_key_indexes),
+    (9, "Журнал движения остатков", stock_ledger),
+    (10, "Начало журнала остатков", stock_ledger_start),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_user_version(cursor):
+    """Версия схемы из заголовка файла базы"""
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()['user_version']
+
+
+def get_schema_version(cursor):
+    """Текущая версия схемы (0 для базы без таблицы версий)"""
+    try:
+        cursor.execute("SELECT MAX(version) AS version FROM schema_version")
+    except sqlite3.OperationalError:
+        return 0
+    row = cursor.fetchone()
+    return row['version'] or 0
+
+
+def migrate(db):
+    """Применение недостающих миграций, каждой в своей транзакции"""
+    cursor = db.cursor
+    # Быстрый путь: чтение заголовка файла, без обращения к таблицам
+    current = get_user_version(cursor)
+    if current >= SCHEMA_VERSION:
+        return current
+
+    current = get_schema_version(cursor)
+    if current >= SCHEMA_VERSION:
+        # База обновлена до появления user_version - переносим номер в заголовок
+        cursor.execute(f"PRAGMA user_version = {current}")
+        return current
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            step(db, cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            # user_version пишется в той же транзакции, что и сама миграция
+            cursor.execute(f"PRAGMA user_version = {version}")
+            db.conn.commit()
+        except Exception:
+            db.conn.rollback()
+            raise
+        print(f"Применена миграция {version}: {description}")
+        current = version
+
+    return current
+
+
+def archive_schema(db, cursor):
+    """Таблицы архива старых накладных (без внешних ключей: товары в основной базе)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive.invoices (
+        id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        total REAL NOT NULL,
+        payment_status INTEGER DEFAULT 1,
+        additional_info TEXT,
+        created_at TEXT,
+        user_id INTEGER,
+        date_ts INTEGER,
+        created_ts INTEGER
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive.invoice_items (
+        id INTEGER PRIMARY KEY,
+        invoice_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        total REAL NOT NULL,
+        cost_price REAL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_invoices_date_ts_id
+    ON invoices(date_ts DESC, id DESC)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_invoice_items_invoice_cover
+    ON invoice_items(invoice_id, product_id, quantity, total, cost_price)
+    ''')
+
+
+# Миграции базы-архива, подключенной как схема archive
+ARCHIVE_MIGRATIONS = [
+    (1, "Таблицы архива накладных", archive_schema),
+]
+
+
+def migrate_archive(db):
+    """Применение недостающих миграций архива (версия - в user_version архива)"""
+    cursor = db.cursor
+    cursor.execute("PRAGMA archive.user_version")
+    current = cursor.fetchone()['user_version']
+
+    for version, description, step in ARCHIVE_MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            step(db, cursor)
+            cursor.execute(f"PRAGMA archive.user_version = {version}")
+            db.conn.commit()
+        except Exception:
+            db.conn.rollback()
+            raise
+        print(f"Применена миграция архива {version}: {description}")
+        current = version
+
+    return current
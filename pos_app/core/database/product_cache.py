@@ -0,0 +1,109 @@
+# product_cache.py
+import threading
+from collections import OrderedDict
+
+
+class ProductCache:
+    """Ограниченный LRU-кэш товаров с доступом по ID и по штрих-коду"""
+
+    def __init__(self, maxsize=500):
+        """Инициализация кэша"""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Поколение растет при каждой инвалидации: чтение, начатое до записи,
+        # не должно вернуть в кэш устаревшую строку
+        self.generation = 0
+
+        self._products = OrderedDict()
+        self._ids_by_barcode = {}
+        self._lock = threading.Lock()
+
+    def get_by_id(self, product_id):
+        """Товар из кэша по ID или None"""
+        with self._lock:
+            product = self._products.get(product_id)
+            if product is None:
+                self.misses += 1
+                return None
+            self._products.move_to_end(product_id)
+            self.hits += 1
+            return dict(product)
+
+    def get_by_barcode(self, barcode):
+        """Товар из кэша по штрих-коду или None"""
+        with self._lock:
+            product_id = self._ids_by_barcode.get(barcode)
+            if product_id is None:
+                self.misses += 1
+                return None
+            self._products.move_to_end(product_id)
+            self.hits += 1
+            return dict(self._products[product_id])
+
+    def put(self, product, generation=None):
+        """Сохранение товара в кэше
+
+        generation - значение self.generation на момент начала чтения из базы;
+        если с тех пор была инвалидация, строка могла устареть и не кэшируется.
+        """
+        if not product:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            product_id = product['id']
+            old = self._products.pop(product_id, None)
+            if old is not None:
+                self._ids_by_barcode.pop(old.get('barcode'), None)
+
+            self._products[product_id] = dict(product)
+            if product.get('barcode'):
+                self._ids_by_barcode[product['barcode']] = product_id
+
+            while len(self._products) > self.maxsize:
+                _, evicted = self._products.popitem(last=False)
+                self._ids_by_barcode.pop(evicted.get('barcode'), None)
+
+    def invalidate(self, product_id=None, barcode=None):
+        """Удаление товара из кэша по ID и/или штрих-коду"""
+        with self._lock:
+            self.generation += 1
+            if product_id is None and barcode is not None:
+                product_id = self._ids_by_barcode.get(barcode)
+            if product_id is None:
+                return
+
+            product = self._products.pop(product_id, None)
+            if product is not None:
+                self._ids_by_barcode.pop(product.get('barcode'), None)
+
+    def invalidate_many(self, product_ids):
+        """Удаление из кэша нескольких товаров"""
+        with self._lock:
+            self.generation += 1
+            for product_id in product_ids:
+                product = self._products.pop(product_id, None)
+                if product is not None:
+                    self._ids_by_barcode.pop(product.get('barcode'), None)
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self.generation += 1
+            self._products.clear()
+            self._ids_by_barcode.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._products),
+                'maxsize': self.maxsize,
+            }
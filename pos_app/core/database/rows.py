@@ -0,0 +1,88 @@
+# rows.py
+from collections.abc import Mapping
+
+
+class Row(Mapping):
+    """Компактная строка результата запроса
+
+    Значения хранятся в кортеже, который вернул sqlite3, а словарь
+    "имя колонки -> позиция" один на весь запрос. Доступ как у словаря:
+    row['price'], row.get('unit'), dict(row), 'barcode' in row.
+    """
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        """Строка из раскладки колонок и кортежа значений"""
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        """Значение по имени колонки или по позиции"""
+        if key.__class__ is str:
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def get(self, key, default=None):
+        """Значение колонки или default, если такой колонки нет"""
+        position = self._index.get(key)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __contains__(self, key):
+        """Проверка наличия колонки"""
+        return key in self._index
+
+    def __iter__(self):
+        """Имена колонок в порядке запроса"""
+        return iter(self._index)
+
+    def __len__(self):
+        """Количество колонок"""
+        return len(self._values)
+
+    def __repr__(self):
+        """Представление в виде словаря для отладки"""
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+    def __getstate__(self):
+        """Состояние для pickle/copy (у класса нет __dict__)"""
+        return self._index, self._values
+
+    def __setstate__(self, state):
+        """Восстановление из pickle/copy"""
+        self._index, self._values = state
+
+
+# Раскладка колонок последнего запроса: (cursor.description, {имя: позиция}).
+# description - один объект на весь запрос, поэтому для всех строк,
+# кроме первой, раскладка находится сравнением по ссылке
+_last_layout = (None, None)
+# Раскладки по набору имен колонок для чередующихся запросов
+_layouts = {}
+_MAX_LAYOUTS = 256
+
+
+def _layout(description):
+    """Словарь "имя колонки -> позиция" для описания результата"""
+    global _last_layout
+    last_description, index = _last_layout
+    if last_description is description:
+        return index
+
+    names = tuple(column[0] for column in description)
+    index = _layouts.get(names)
+    if index is None:
+        if len(_layouts) >= _MAX_LAYOUTS:
+            _layouts.clear()
+        index = _layouts[names] = {name: position for position, name in enumerate(names)}
+
+    # Присваивание кортежа атомарно, поэтому фабрика безопасна для пула потоков
+    _last_layout = (description, index)
+    return index
+
+
+def row_factory(cursor, values):
+    """Фабрика строк для sqlite3: Row с общей раскладкой колонок"""
+    return Row(_layout(cursor.description), values)
@@ -0,0 +1,231 @@
+# product_importer.py
+import csv
+import io
+import itertools
+import json
+import os
+
+from core.utils import validate_barcode
+
+# Допустимые названия колонок файла для каждого поля товара
+COLUMN_ALIASES = {
+    'barcode': ('barcode', 'штрихкод', 'штрих-код', 'штрих код', 'ean', 'код'),
+    'name': ('name', 'наименование', 'название', 'товар'),
+    'price': ('price', 'цена', 'цена продажи'),
+    'cost_price': ('cost_price', 'cost', 'себестоимость', 'закупочная цена', 'цена закупки'),
+    'quantity': ('quantity', 'qty', 'количество', 'остаток', 'кол-во'),
+    'unit': ('unit', 'ед', 'ед.', 'единица', 'ед. изм.'),
+    'group': ('group', 'group_name', 'группа'),
+    'subgroup': ('subgroup', 'подгруппа'),
+}
+
+
+class ImportRowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def _normalize_header(header):
+    """Поле товара по заголовку колонки или None"""
+    header = (header or '').strip().lower()
+    for field, aliases in COLUMN_ALIASES.items():
+        if header in aliases:
+            return field
+    return None
+
+
+def _parse_number(value, field, integer=False):
+    """Число из строки файла (допускается запятая в дробной части)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        text = str(value).strip().replace('\u00a0', '').replace(' ', '').replace(',', '.')
+        if not text:
+            return None
+        try:
+            number = float(text)
+        except ValueError:
+            raise ImportRowError(f"{field}: не число '{value}'") from None
+
+    if number < 0:
+        raise ImportRowError(f"{field}: отрицательное значение")
+    if integer:
+        if number != int(number):
+            raise ImportRowError(f"{field}: ожидается целое число")
+        return int(number)
+    return float(number)
+
+
+def validate_record(record):
+    """Проверка и приведение типов одной записи файла; словарь для upsert_products"""
+    product = {}
+    for key, value in record.items():
+        field = _normalize_header(key)
+        if field is not None and field not in product:
+            product[field] = value.strip() if isinstance(value, str) else value
+
+    barcode = str(product.get('barcode') or '').strip()
+    if not barcode:
+        raise ImportRowError("нет штрих-кода")
+    if not validate_barcode(barcode):
+        raise ImportRowError(f"некорректный штрих-код '{barcode}'")
+
+    name = str(product.get('name') or '').strip()
+    if not name:
+        raise ImportRowError("нет наименования")
+
+    price = _parse_number(product.get('price'), 'price')
+    if price is None:
+        raise ImportRowError("нет цены")
+
+    return {
+        'barcode': barcode,
+        'name': name,
+        'price': price,
+        'cost_price': _parse_number(product.get('cost_price'), 'cost_price'),
+        'quantity': _parse_number(product.get('quantity'), 'quantity', integer=True),
+        'unit': product.get('unit') or None,
+        'group': product.get('group') or None,
+        'subgroup': product.get('subgroup') or None,
+    }
+
+
+class _ByteCounter(io.RawIOBase):
+    """Обертка файла, считающая прочитанные байты для индикатора прогресса"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class ProductImporter:
+    """Потоковый импорт каталога товаров из CSV (в т.ч. выгрузки Excel с ';') и JSONL
+
+    Файл читается построчно, записи проверяются и пишутся в базу пачками:
+    одна транзакция executemany на chunk_size товаров. Строки с ошибками
+    складываются в файл отказов рядом с исходным файлом.
+    """
+
+    def __init__(self, db, chunk_size=1000, progress_callback=None):
+        """Инициализация импорта для указанного DatabaseManager"""
+        self.db = db
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.cancelled = False
+
+    def cancel(self):
+        """Остановка импорта после текущей пачки"""
+        self.cancelled = True
+
+    def read_records(self, stream, file_format):
+        """Генератор пар (номер строки, запись) из открытого текстового файла"""
+        if file_format == 'jsonl':
+            for line_number, line in enumerate(stream, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {'_error': f"некорректный JSON: {e.msg}", '_raw': line}
+                    continue
+                if not isinstance(record, dict):
+                    yield line_number, {'_error': "ожидается JSON-объект", '_raw': line}
+                    continue
+                yield line_number, record
+            return
+
+        # Разделитель определяем по первым строкам: Excel сохраняет CSV с ';'
+        head = list(itertools.islice(stream, 20))
+        try:
+            dialect = csv.Sniffer().sniff(''.join(head), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+
+        reader = csv.DictReader(itertools.chain(head, stream), dialect=dialect)
+        for record in reader:
+            yield reader.line_num, record
+
+    @staticmethod
+    def detect_format(path):
+        """Формат файла по расширению: 'jsonl' или 'csv'"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        return 'csv'
+
+    def import_file(self, path, reject_path=None):
+        """Импорт файла; возвращает итоги (обработано, загружено, отклонено, файл отказов)"""
+        file_format = self.detect_format(path)
+        if reject_path is None:
+            reject_path = os.path.splitext(path)[0] + '.rejected.csv'
+
+        total_size = os.path.getsize(path) or 1
+        summary = {'processed': 0, 'imported': 0, 'rejected': 0, 'reject_path': None, 'cancelled': False}
+        chunk = []
+        reject_file = None
+        reject_writer = None
+
+        counter = _ByteCounter(open(path, 'rb'))
+        # utf-8-sig убирает BOM, который добавляет Excel
+        stream = io.TextIOWrapper(io.BufferedReader(counter), encoding='utf-8-sig', errors='replace', newline='')
+
+        try:
+            for line_number, record in self.read_records(stream, file_format):
+                summary['processed'] += 1
+                try:
+                    if '_error' in record:
+                        raise ImportRowError(record['_error'])
+                    chunk.append(validate_record(record))
+                except ImportRowError as e:
+                    if reject_writer is None:
+                        reject_file = open(reject_path, 'w', encoding='utf-8', newline='')
+                        reject_writer = csv.writer(reject_file, delimiter=';')
+                        reject_writer.writerow(['line', 'error', 'data'])
+                        summary['reject_path'] = reject_path
+                    reject_writer.writerow([
+                        line_number, str(e),
+                        record.get('_raw') or json.dumps(record, ensure_ascii=False)
+                    ])
+                    summary['rejected'] += 1
+
+                if len(chunk) >= self.chunk_size:
+                    summary['imported'] += self._flush(chunk)
+                    chunk = []
+                    self._report(summary, counter.bytes_read / total_size)
+                    if self.cancelled:
+                        summary['cancelled'] = True
+                        break
+
+            if chunk and not summary['cancelled']:
+                summary['imported'] += self._flush(chunk)
+        finally:
+            stream.close()
+            if reject_file is not None:
+                reject_file.close()
+
+        self._report(summary, 1.0)
+        return summary
+
+    def _flush(self, chunk):
+        """Запись пачки товаров; при повторе штрих-кода побеждает последняя строка"""
+        unique = {product['barcode']: product for product in chunk}
+        return self.db.upsert_products(list(unique.values()))
+
+    def _report(self, summary, fraction):
+        """Передача прогресса вызывающему коду"""
+        if self.progress_callback is not None:
+            self.progress_callback(min(fraction, 1.0), dict(summary))
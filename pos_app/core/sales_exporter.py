@@ -0,0 +1,101 @@
+# sales_exporter.py
+import csv
+import json
+import os
+
+# Наборы данных для выгрузки: имя -> метод DatabaseManager
+DATASETS = {
+    'invoices': 'iter_invoices',
+    'invoice_items': 'iter_invoice_items',
+}
+
+
+class SalesExporter:
+    """Потоковая выгрузка накладных и их позиций в CSV или JSONL для бухгалтерии
+
+    Строки читаются из базы пачками и сразу пишутся в файл, поэтому память
+    не растет с объемом выгрузки. В инкрементальном режиме выгружаются только
+    накладные, появившиеся после прошлой выгрузки: ID последней выгруженной
+    накладной хранится в app_settings.
+    """
+
+    def __init__(self, db, batch_size=500):
+        """Инициализация выгрузки для указанного DatabaseManager"""
+        self.db = db
+        self.batch_size = batch_size
+
+    @staticmethod
+    def watermark_key(dataset):
+        """Ключ настройки с отметкой последней выгрузки"""
+        return f"export_watermark_{dataset}"
+
+    def get_watermark(self, dataset):
+        """ID последней выгруженной накладной или None"""
+        value = self.db.get_setting(self.watermark_key(dataset))
+        return int(value) if value else None
+
+    def reset_watermark(self, dataset):
+        """Сброс отметки: следующая инкрементальная выгрузка начнется с начала"""
+        self.db.set_setting(self.watermark_key(dataset), "")
+
+    def iter_rows(self, dataset, start_date=None, end_date=None, after_id=None):
+        """Генератор строк набора данных за период"""
+        if dataset not in DATASETS:
+            raise ValueError(f"Неизвестный набор данных: {dataset}")
+        method = getattr(self.db, DATASETS[dataset])
+        return method(start_date, end_date, after_id=after_id, batch_size=self.batch_size)
+
+    @staticmethod
+    def detect_format(path):
+        """Формат файла по расширению: 'jsonl' или 'csv'"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        return 'csv'
+
+    def export(self, dataset, path, start_date=None, end_date=None, incremental=False):
+        """Выгрузка набора данных в файл; возвращает (число строк, ID последней накладной)
+
+        Файл сначала пишется во временный и переименовывается только после
+        успешного завершения; отметка инкрементальной выгрузки сдвигается
+        только после этого.
+        """
+        after_id = self.get_watermark(dataset) if incremental else None
+        file_format = self.detect_format(path)
+        temp_path = path + '.part'
+
+        count = 0
+        last_invoice_id = after_id
+        invoice_column = 'id' if dataset == 'invoices' else 'invoice_id'
+
+        try:
+            # utf-8-sig - чтобы Excel правильно открыл кириллицу в CSV
+            encoding = 'utf-8-sig' if file_format == 'csv' else 'utf-8'
+            with open(temp_path, 'w', encoding=encoding, newline='') as f:
+                writer = None
+                for row in self.iter_rows(dataset, start_date, end_date, after_id):
+                    if file_format == 'jsonl':
+                        f.write(json.dumps(dict(row), ensure_ascii=False))
+                        f.write('\n')
+                    else:
+                        if writer is None:
+                            writer = csv.writer(f, delimiter=';')
+                            writer.writerow(list(row.keys()))
+                        writer.writerow(list(row.values()))
+
+                    count += 1
+                    # При выгрузке за период строки идут по дате, а не по ID
+                    invoice_id = row[invoice_column]
+                    if last_invoice_id is None or invoice_id > last_invoice_id:
+                        last_invoice_id = invoice_id
+
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if incremental and last_invoice_id is not None:
+            self.db.set_setting(self.watermark_key(dataset), str(last_invoice_id))
+
+        return count, last_invoice_id
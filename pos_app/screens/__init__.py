@@ -9,6 +9,7 @@ from .inventory_screen import InventoryScreen
 from .analytics_screen import AnalyticsScreen
 from .product_create_screen import ProductCreateScreen
 from .product_edit_screen import ProductEditScreen
+from .diagnostics_screen import DiagnosticsScreen
 
 
 __all__ = [
@@ -22,5 +23,6 @@ __all__ = [
 "InvoiceHistoryScreen",
 "InvoiceEditScreen",
 "ProductSearchScreen",
+"DiagnosticsScreen",
 
 ]
\ No newline at end of file
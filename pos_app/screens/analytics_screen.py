@@ -77,7 +77,37 @@ class AnalyticsScreen(Screen):
     def load_sales_analytics(self):
         """Загрузка данных о продажах за период"""
         app = MDApp.get_running_app()
-        sales_data = app.db.get_sales_analytics(self.start_date, self.end_date)
+        start_date, end_date = self.start_date, self.end_date
+
+        def query(db):
+            # Все три запроса отчета выполняются в рабочем потоке
+            return (
+                db.get_sales_analytics(start_date, end_date),
+                db.get_profit_analytics(start_date, end_date),
+                db.get_top_products(start_date, end_date, 5),
+            )
+
+        self.show_loading()
+        app.db_executor.submit(
+            'analytics', query,
+            on_result=lambda result: self.show_sales_analytics(*result),
+            on_error=self.show_load_error
+        )
+
+    def show_loading(self):
+        """Состояние загрузки отчета"""
+        self.ids.analytics_results.clear_widgets()
+        self.ids.analytics_results.add_widget(OneLineIconListItem(text="Загрузка..."))
+
+    def show_load_error(self, error):
+        """Ошибка загрузки аналитики"""
+        self.ids.analytics_results.clear_widgets()
+        self.ids.analytics_results.add_widget(
+            OneLineIconListItem(text=f"Ошибка загрузки аналитики: {error}")
+        )
+
+    def show_sales_analytics(self, sales_data, profit_data, top_products):
+        """Отображение аналитики продаж"""
         self.ids.analytics_results.clear_widgets()
 
         if not sales_data or not sales_data['total_sales']:
@@ -102,8 +132,6 @@ class AnalyticsScreen(Screen):
             OneLineIconListItem(text=f"В долг: {sales_data['debt_amount']:.2f}")
         )
 
-        profit_data = app.db.get_profit_analytics(self.start_date, self.end_date)
-
         if profit_data and profit_data['revenue']:
             self.ids.analytics_results.add_widget(
                 OneLineIconListItem(text=f"Выручка: {profit_data['revenue']:.2f}")
@@ -115,8 +143,6 @@ class AnalyticsScreen(Screen):
                 OneLineIconListItem(text=f"Прибыль: {profit_data['profit']:.2f}")
             )
 
-        top_products = app.db.get_top_products(self.start_date, self.end_date, 5)
-
         if top_products:
             self.ids.analytics_results.add_widget(
                 OneLineIconListItem(text="Топ-5 продаваемых товаров:")
@@ -133,7 +159,19 @@ class AnalyticsScreen(Screen):
     def load_profit_analytics(self):
         """Загрузка данных о прибыли за период"""
         app = MDApp.get_running_app()
-        profit_data = app.db.get_profit_analytics(self.start_date, self.end_date)
+        start_date, end_date = self.start_date, self.end_date
+
+        self.show_loading()
+        # Тот же тег, что у отчета о продажах: незавершенный отчет о продажах
+        # не перезапишет отчет о прибыли
+        app.db_executor.submit(
+            'analytics', lambda db: db.get_profit_analytics(start_date, end_date),
+            on_result=self.show_profit_analytics,
+            on_error=self.show_load_error
+        )
+
+    def show_profit_analytics(self, profit_data):
+        """Отображение аналитики прибыли"""
         self.ids.analytics_results.clear_widgets()
 
         if not profit_data or not profit_data['revenue']:
@@ -0,0 +1,92 @@
+# screens/diagnostics_screen.py
+import json
+import os
+from datetime import datetime
+
+from kivy.uix.screenmanager import Screen
+from kivy.properties import BooleanProperty, StringProperty
+from kivymd.app import MDApp
+from kivymd.uix.button import MDFlatButton
+from kivymd.uix.dialog import MDDialog
+from kivymd.uix.list import OneLineListItem, ThreeLineListItem
+
+
+class DiagnosticsScreen(Screen):
+    """Скрытый экран диагностики базы: статистика и медленные запросы"""
+    instrumentation_enabled = BooleanProperty(False)
+    summary = StringProperty("")
+
+    def on_enter(self):
+        """Вызывается при переходе на экран"""
+        self.refresh()
+
+    def refresh(self):
+        """Обновление статистики на экране"""
+        app = MDApp.get_running_app()
+        snapshot = app.db.get_query_stats(limit=30)
+        self.instrumentation_enabled = snapshot['enabled']
+
+        cache = snapshot['product_cache']
+        self.summary = (
+            f"Замер {'включен' if snapshot['enabled'] else 'выключен'} с {snapshot['since']}, "
+            f"медленные > {snapshot['slow_ms']} мс. "
+            f"Кэш товаров: {cache['hit_rate'] * 100:.0f}% попаданий"
+        )
+
+        results = self.ids.diagnostics_results
+        results.clear_widgets()
+
+        results.add_widget(OneLineListItem(text=f"Медленные запросы: {len(snapshot['slow'])}"))
+        for entry in snapshot['slow']:
+            results.add_widget(ThreeLineListItem(
+                text=f"{entry['ms']:.1f} мс, строк: {entry['rows']} ({entry['time']})",
+                secondary_text=entry['sql'],
+                tertiary_text=" / ".join(entry['plan']) or "план недоступен",
+                on_release=lambda x, entry=entry: self.show_details(entry)
+            ))
+
+        results.add_widget(OneLineListItem(text="Операторы по суммарному времени:"))
+        for statement in snapshot['statements']:
+            results.add_widget(ThreeLineListItem(
+                text=f"{statement['total_ms']:.0f} мс всего, вызовов: {statement['count']}",
+                secondary_text=(
+                    f"ср. {statement['avg_ms']:.2f} / p95 {statement['p95_ms']:.1f} / "
+                    f"макс. {statement['max_ms']:.1f} мс, строк: {statement['rows']}"
+                ),
+                tertiary_text=statement['sql']
+            ))
+
+    def toggle_instrumentation(self):
+        """Включение или выключение замера запросов"""
+        app = MDApp.get_running_app()
+        app.db.set_instrumentation(not self.instrumentation_enabled)
+        self.refresh()
+
+    def reset_stats(self):
+        """Сброс накопленной статистики"""
+        app = MDApp.get_running_app()
+        app.db.query_stats.reset()
+        self.refresh()
+
+    def save_snapshot(self):
+        """Сохранение полной статистики в JSON рядом с базой для разбора обращений"""
+        app = MDApp.get_running_app()
+        path = os.path.join(
+            os.path.dirname(os.path.abspath(app.db.db_path)),
+            f"diagnostics-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(app.db.get_query_stats(), f, ensure_ascii=False, indent=2, default=str)
+            app.show_snackbar(f"Сохранено: {path}", 3)
+        except OSError as e:
+            app.show_snackbar(f"Ошибка сохранения: {e}", 3)
+
+    def show_details(self, entry):
+        """Полный текст медленного запроса с параметрами и планом"""
+        dialog = MDDialog(
+            title=f"{entry['ms']:.1f} мс ({entry['thread']})",
+            text=f"{entry['sql']}\n\nПараметры: {entry['params']}\n\nПлан:\n" + "\n".join(entry['plan']),
+            buttons=[MDFlatButton(text="ЗАКРЫТЬ", on_release=lambda x: dialog.dismiss())],
+        )
+        dialog.open()
@@ -1,39 +1,56 @@
 # screens/inventory_screen.py
+import os
+import threading
+
+from kivy.clock import Clock
 from kivy.uix.screenmanager import Screen
 from kivymd.app import MDApp
+from kivymd.uix.filemanager import MDFileManager
 from kivymd.uix.snackbar import MDSnackbar
-from kivymd.uix.list import OneLineIconListItem, TwoLineIconListItem, IconLeftWidget
 
 from components.customsnackbar import CustomSnackbar
+from components.paged_list import PagedListItem, PagedListLoader  # PagedListItem - класс строк списка в kv
+from core.product_importer import ProductImporter
 
 
 
 class InventoryScreen(Screen):
+    file_manager = None
+    importer = None
+    list_loader = None
+    # Товаров на странице списка
+    page_size = 50
+
     def on_enter(self):
         """Вызывается при переходе на экран"""
         self.update_inventory_list()
 
-    def update_inventory_list(self):
-        """Обновление списка товаров на складе"""
+    def on_kv_post(self, base_widget):
+        """Подключение постраничной загрузки к списку товаров"""
         app = MDApp.get_running_app()
-        self.ids.inventory_list.clear_widgets()
-        products = app.db.get_all_products()
-
-        if not products:
-            empty_item = OneLineIconListItem(
-                text="Нет товаров на складе. Добавьте товары."
-            )
-            self.ids.inventory_list.add_widget(empty_item)
-            return
-
+        # Новый запрос списка (другой поиск) отменяет предыдущий
+        self.list_loader = PagedListLoader(
+            app.db_executor, 'inventory_list', self.ids.inventory_list,
+            on_error=self.show_load_error
+        )
+
+    def on_leave(self):
+        """Вызывается при уходе с экрана"""
+        self.list_loader.cancel()
+
+    def show_load_error(self, error):
+        """Ошибка загрузки списка товаров"""
+        self.show_snackbar(f"Ошибка загрузки товаров: {error}", 2)
+
+    def product_rows(self, products, token):
+        """Строки RecycleView для страницы товаров (в рабочем потоке)"""
+        rows = []
         for product in products:
             # Выбираем иконку в зависимости от заполненности данных товара
             icon_name = "package-variant"
             if product['price'] == 0:
                 icon_name = "package-variant-closed-alert"  # Используем другую иконку для товаров без цены
 
-            icon = IconLeftWidget(icon=icon_name)
-
             # Формируем вторую строку с учетом нулевых значений
             secondary_text = f"Количество: {product['quantity']}"
             if product['price'] > 0:
@@ -41,13 +58,23 @@ class InventoryScreen(Screen):
             else:
                 secondary_text += ", Цена: не указана"
 
-            list_item = TwoLineIconListItem(
-                text=f"{product['name']}",
-                secondary_text=secondary_text,
-                on_release=lambda x, p=product: self.edit_product(p)
-            )
-            list_item.add_widget(icon)
-            self.ids.inventory_list.add_widget(list_item)
+            rows.append({
+                'text': f"{product['name']}",
+                'secondary_text': secondary_text,
+                'icon': icon_name,
+                'item': product,
+                'callback': self.edit_product,
+            })
+        return rows, token
+
+    def update_inventory_list(self):
+        """Обновление списка товаров на складе"""
+        # Товары грузятся страницами по мере прокрутки
+        self.list_loader.start(
+            lambda db, after: self.product_rows(*db.get_products_page('name', after, self.page_size)),
+            empty_text="Нет товаров на складе. Добавьте товары."
+        )
+
     def edit_product(self, product):
         """Открыть экран редактирования товара"""
         app = MDApp.get_running_app()
@@ -68,27 +95,66 @@ class InventoryScreen(Screen):
             self.update_inventory_list()
             return
 
-        app = MDApp.get_running_app()
-        products = app.db.search_products(search_text)
+        self.list_loader.start(
+            lambda db, after: self.product_rows(*db.search_products_page(search_text, after, self.page_size)),
+            empty_text=f"Поиск по '{search_text}' не дал результатов."
+        )
 
-        self.ids.inventory_list.clear_widgets()
+    def import_products(self):
+        """Выбор файла каталога для импорта"""
+        if self.importer is not None:
+            self.show_snackbar("Импорт уже выполняется")
+            return
 
-        if not products:
-            empty_item = OneLineIconListItem(
-                text=f"Поиск по '{search_text}' не дал результатов."
+        if self.file_manager is None:
+            self.file_manager = MDFileManager(
+                select_path=self.select_import_file,
+                exit_manager=lambda *args: self.file_manager.close(),
+                ext=['.csv', '.txt', '.jsonl', '.ndjson']
             )
-            self.ids.inventory_list.add_widget(empty_item)
+        self.file_manager.show(os.path.expanduser('~'))
+
+    def select_import_file(self, path):
+        """Запуск импорта выбранного файла в фоновом потоке"""
+        self.file_manager.close()
+        if not os.path.isfile(path):
+            self.show_snackbar("Выберите файл каталога")
             return
 
-        for product in products:
-            icon = IconLeftWidget(icon="package-variant")
-            list_item = TwoLineIconListItem(
-                text=f"{product['name']}",
-                secondary_text=f"Количество: {product['quantity']}, Цена: {product['price']:.2f}",
-                on_release=lambda x, p=product: self.edit_product(p)
-            )
-            list_item.add_widget(icon)
-            self.ids.inventory_list.add_widget(list_item)
+        app = MDApp.get_running_app()
+        self.importer = ProductImporter(app.db, progress_callback=self.on_import_progress)
+        self.ids.import_progress.value = 0
+        self.ids.import_progress.opacity = 1
+        threading.Thread(target=self.run_import, args=(self.importer, path), daemon=True).start()
+
+    def run_import(self, importer, path):
+        """Импорт в фоновом потоке; итог передается в главный поток"""
+        try:
+            summary = importer.import_file(path)
+            error = None
+        except Exception as e:
+            print(f"Ошибка при импорте товаров: {e}")
+            summary, error = None, e
+        Clock.schedule_once(lambda dt: self.on_import_finished(summary, error))
+
+    def on_import_progress(self, fraction, summary):
+        """Прогресс импорта (вызывается из фонового потока)"""
+        Clock.schedule_once(lambda dt: setattr(self.ids.import_progress, 'value', fraction * 100))
+
+    def on_import_finished(self, summary, error):
+        """Итог импорта в главном потоке"""
+        self.importer = None
+        self.ids.import_progress.opacity = 0
+
+        if error is not None:
+            self.show_snackbar(f"Ошибка импорта: {error}", 3)
+            return
+
+        text = f"Загружено товаров: {summary['imported']}"
+        if summary['rejected']:
+            text += f", отклонено: {summary['rejected']} (см. {os.path.basename(summary['reject_path'])})"
+        self.show_snackbar(text, 3)
+        self.update_inventory_list()
 
     def show_snackbar(self, text, duration=1.5):
         """Показать уведомление пользователю"""
@@ -167,31 +167,15 @@ class InvoiceEditScreen(Screen):
         payment_status_int = 1 if self.payment_status else 0
 
         try:
-            # Обновляем информацию о накладной
-            self.app.db.cursor.execute(
-                "UPDATE invoices SET total = ?, payment_status = ? WHERE id = ?",
-                (total, payment_status_int, self.invoice_id)
+            # Одной транзакцией меняются только отличающиеся позиции,
+            # остатки корректируются на разницу количеств
+            self.app.db.apply_invoice_diff(
+                self.invoice_id,
+                self.app.current_invoice,
+                payment_status_int,
+                total=total
             )
 
-            # Удаляем старые позиции
-            self.app.db.cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (self.invoice_id,))
-
-            # Добавляем новые позиции
-            for item in self.app.current_invoice:
-                self.app.db.add_invoice_item(
-                    self.invoice_id,
-                    item['product_id'],
-                    item['quantity'],
-                    item['price'],
-                    item['total']
-                )
-
-                # Обновляем остаток товара
-                product = self.app.db.find_product_by_id(item['product_id'])
-                # В данном случае мы не меняем остаток, так как это редактирование
-                # А не новая продажа
-
-            self.app.db.conn.commit()
             status_text = "Оплачено" if self.payment_status else "Не оплачено"
             self.show_snackbar(f"Накладная #{self.invoice_id} обновлена. Статус: {status_text}", 2)
 
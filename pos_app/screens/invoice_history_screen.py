@@ -1,22 +1,23 @@
 # screens/invoice_history_screen.py
 from kivy.uix.screenmanager import Screen
-from kivy.properties import StringProperty, NumericProperty, ListProperty
+from kivy.properties import StringProperty, NumericProperty
 from kivymd.app import MDApp
-from kivymd.uix.list import TwoLineIconListItem, IconLeftWidget
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton, MDRaisedButton
 from kivymd.uix.pickers import MDDatePicker
 from kivymd.uix.snackbar import MDSnackbar
 from datetime import datetime, timedelta
-import sqlite3
+import time
 from components.customsnackbar import CustomSnackbar
+from components.paged_list import PagedListItem, PagedListLoader  # PagedListItem - класс строк списка в kv
 
 
 class InvoiceHistoryScreen(Screen):
     start_date = StringProperty('')
     end_date = StringProperty('')
     search_query = StringProperty('')
-    invoices = ListProperty([])
+    # Накладных на странице списка
+    page_size = 50
 
     def __init__(self, **kwargs):
         super(InvoiceHistoryScreen, self).__init__(**kwargs)
@@ -47,88 +48,54 @@ class InvoiceHistoryScreen(Screen):
             self.ids.start_date_label.text = start
             self.ids.end_date_label.text = end
 
+    def on_kv_post(self, base_widget):
+        """Подключение постраничной загрузки к списку накладных"""
+        self.list_loader = PagedListLoader(
+            MDApp.get_running_app().db_executor, 'invoice_history', self.ids.invoice_list,
+            on_error=lambda e: self.show_snackbar(f"Ошибка загрузки накладных: {str(e)}")
+        )
+
+    def on_leave(self):
+        """Вызывается при уходе с экрана"""
+        self.list_loader.cancel()
+
     def load_invoices(self):
         """Загрузка списка накладных из базы данных"""
         if not hasattr(self, 'ids') or 'invoice_list' not in self.ids:
             return
 
-        # Очищаем список
-        self.ids.invoice_list.clear_widgets()
-
-        try:
-            # Получаем накладные из базы данных с учетом фильтра
-            self.invoices = self.filter_invoices()
-
-            if not self.invoices:
-                # Если накладных нет, показываем сообщение
-                item = TwoLineIconListItem(
-                    text="Накладные не найдены",
-                    secondary_text="Измените параметры поиска или создайте новую накладную"
-                )
-                self.ids.invoice_list.add_widget(item)
-                return
-
-            # Отображаем накладные в списке
-            for invoice in self.invoices:
-                icon = IconLeftWidget(icon="file-document-outline")
-
-                # Форматируем дату и сумму для отображения
-                invoice_date = datetime.strptime(invoice['date'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-
-                # Преобразуем статус оплаты из целого числа в булево значение
-                is_paid = bool(invoice['payment_status'])
-                status_text = "Оплачено" if is_paid else "Не оплачено"
-
-                # Создаем элемент списка
-                item = TwoLineIconListItem(
-                    text=f"Накладная #{invoice['id']}",
-                    secondary_text=f"{invoice_date} - {invoice['total']:.2f} ₸ - {status_text}",
-                    on_release=lambda x, inv=invoice: self.show_invoice_options(inv)
-                )
-
-                # Добавляем цветовое оформление в зависимости от статуса оплаты
-                if is_paid:
-                    # Зеленый для оплаченных накладных
-                    item.bg_color = (0.7, 0.9, 0.7, 0.2)  # Светло-зеленый фон
-                else:
-                    # Красный для неоплаченных накладных
-                    item.bg_color = (0.9, 0.7, 0.7, 0.2)  # Светло-красный фон
-
-                item.add_widget(icon)
-                self.ids.invoice_list.add_widget(item)
+        # Накладные грузятся страницами по мере прокрутки; новый поиск
+        # или смена дат отменяют загрузку предыдущего списка
+        start_date, end_date, search_query = self.start_date, self.end_date, self.search_query
+        self.list_loader.start(
+            lambda db, after: self.invoice_rows(
+                *db.search_invoices_page(start_date, end_date, search_query, after, self.page_size)
+            ),
+            empty_text="Накладные не найдены"
+        )
 
-        except Exception as e:
-            self.show_snackbar(f"Ошибка загрузки накладных: {str(e)}")
-
-    def filter_invoices(self):
-        """Фильтрация накладных по дате и поисковому запросу"""
-        query = """
-        SELECT i.*, COUNT(ii.id) as items_count 
-        FROM invoices i
-        LEFT JOIN invoice_items ii ON i.id = ii.invoice_id
-        WHERE i.date BETWEEN ? AND ?
-        """
-
-        params = [self.start_date, self.end_date]
-
-        # Добавляем поиск по номеру
-        if self.search_query:
-            # Для поиска по статусу оплаты преобразуем текст в число
-            if self.search_query.lower() in ["оплачено", "оплачен", "paid"]:
-                query += " AND i.payment_status = 1"
-            elif self.search_query.lower() in ["не оплачено", "не оплачен", "unpaid"]:
-                query += " AND i.payment_status = 0"
-            else:
-                # Поиск по номеру накладной
-                search_term = f"%{self.search_query}%"
-                query += " AND i.id LIKE ?"
-                params.append(search_term)
-
-        query += " GROUP BY i.id ORDER BY i.date DESC"
-
-        # Выполняем запрос к БД
-        self.app.db.cursor.execute(query, params)
-        return self.app.db.cursor.fetchall()
+    def invoice_rows(self, invoices, token):
+        """Строки RecycleView для страницы накладных (в рабочем потоке)"""
+        rows = []
+        for invoice in invoices:
+            # Форматируем дату и сумму для отображения
+            # Метка date_ts хранит время как UTC, поэтому разбор строки не нужен
+            invoice_date = time.strftime("%d.%m.%Y %H:%M", time.gmtime(invoice['date_ts']))
+
+            # Преобразуем статус оплаты из целого числа в булево значение
+            is_paid = bool(invoice['payment_status'])
+            status_text = "Оплачено" if is_paid else "Не оплачено"
+
+            rows.append({
+                'text': f"Накладная #{invoice['id']}",
+                'secondary_text': f"{invoice_date} - {invoice['total']:.2f} ₸ - {status_text}",
+                'icon': "file-document-outline",
+                # Зеленый фон для оплаченных накладных, красный - для неоплаченных
+                'bg_color': (0.7, 0.9, 0.7, 0.2) if is_paid else (0.9, 0.7, 0.7, 0.2),
+                'item': invoice,
+                'callback': self.show_invoice_options,
+            })
+        return rows, token
 
     def search_invoices(self):
         """Поиск накладных по введенному тексту"""
@@ -191,9 +158,8 @@ class InvoiceHistoryScreen(Screen):
     def delete_invoice(self, invoice):
         """Удаление накладной из базы данных"""
         try:
-            # Удаляем накладную из БД
-            self.app.db.cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice['id'],))
-            self.app.db.conn.commit()
+            # Удаляем накладную и ее позиции из БД
+            self.app.db.delete_invoice(invoice['id'])
 
             if self.dialog:
                 self.dialog.dismiss()
@@ -270,8 +236,6 @@ class InvoiceHistoryScreen(Screen):
         self.update_date_labels()
         self.load_invoices()
 
-
-
     def show_snackbar(self, text, duration=1.5):
         """Показать уведомление пользователю"""
         snackbar = CustomSnackbar()
@@ -1,4 +1,6 @@
 # screens/main_screen.py
+import time
+
 from kivy.uix.screenmanager import Screen
 from kivy.properties import StringProperty
 from kivymd.app import MDApp
@@ -8,6 +10,18 @@ from kivymd.uix.button import MDFlatButton, MDRaisedButton
 
 class MainScreen(Screen):
     user_name = StringProperty("")
+    # Экран диагностики открывается пятью касаниями приветствия за три секунды
+    DIAGNOSTICS_TAPS = 5
+    DIAGNOSTICS_WINDOW = 3.0
+    _taps = []
+
+    def on_greeting_tap(self):
+        """Скрытый переход на экран диагностики базы"""
+        now = time.monotonic()
+        self._taps = [tap for tap in self._taps if now - tap < self.DIAGNOSTICS_WINDOW] + [now]
+        if len(self._taps) >= self.DIAGNOSTICS_TAPS:
+            self._taps = []
+            self.manager.current = 'diagnostics'
 
     def on_enter(self):
         """Вызывается при переходе на экран"""
@@ -20,6 +20,8 @@ class ProductEditScreen(Screen):
         self.ids.price_input.text = str(product['price'])
         self.ids.cost_price_input.text = str(product['cost_price'])
         self.ids.quantity_input.text = str(product['quantity'])
+        # Остаток на момент открытия: сохраняется только изменение пользователя
+        self.loaded_quantity = product['quantity']
 
         if hasattr(self.ids, 'unit_input'):
             self.ids.unit_input.text = product.get('unit', 'шт')
@@ -53,7 +55,8 @@ class ProductEditScreen(Screen):
             app.show_snackbar(text="Введите корректные числовые значения", duration=1.5)
             return
 
-        success = app.db.update_product(app.temp_product_id, name, price, cost_price, quantity, unit)
+        success = app.db.update_product(app.temp_product_id, name, price, cost_price, quantity, unit,
+                                        previous_quantity=getattr(self, 'loaded_quantity', None))
 
         if success:
             app.show_snackbar(text=f"Товар '{name}' успешно обновлен", duration=1.5)
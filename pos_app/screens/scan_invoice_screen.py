@@ -2,12 +2,12 @@
 from kivy.uix.screenmanager import Screen
 from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ObjectProperty
 from kivymd.app import MDApp
-from kivymd.uix.list import OneLineIconListItem, TwoLineIconListItem, IconLeftWidget
 from kivymd.uix.card import MDCard
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton, MDRaisedButton
 from kivymd.uix.label import MDLabel
 from components.customsnackbar import CustomSnackbar
+from components.paged_list import PagedListItem  # Класс строк корзины в kv
 from kivy.clock import Clock
 
 
@@ -200,20 +200,20 @@ class ScanInvoiceScreen(Screen):
 
         for i, existing_item in enumerate(self.app.current_invoice):
             if existing_item['product_id'] == item['product_id']:
-                self.app.current_invoice[i]['quantity'] += 1  # Используем self.app.current_invoice
-                self.app.current_invoice[i]['total'] = self.app.current_invoice[i]['quantity'] * \
-                                                       self.app.current_invoice[i]['price']
-                message = f"Добавлено: {product['name']} (x{self.app.current_invoice[i]['quantity']})"
+                previous_total = existing_item['total']
+                existing_item['quantity'] += 1
+                existing_item['total'] = existing_item['quantity'] * existing_item['price']
+                message = f"Добавлено: {product['name']} (x{existing_item['quantity']})"
                 self.show_snackbar(message, 1.5)
-                # Обновляем товары на текущем экране вместо перехода
-                self.update_invoice_items()
+                # Меняется только строка этого товара
+                self.update_cart_row(i, previous_total)
                 return
 
         self.app.current_invoice.append(item)
         message = f"Добавлено: {product['name']}"
         self.show_snackbar(message, 1.5)
-        # Обновляем товары на текущем экране вместо перехода
-        self.update_invoice_items()
+        # Новая строка добавляется в конец списка без перестройки остальных
+        self.append_cart_row(item)
 
     def show_create_product_dialog(self, barcode):
         """Диалог для создания нового товара"""
@@ -248,29 +248,56 @@ class ScanInvoiceScreen(Screen):
         self.app.temp_product_id = product['id']
         self.manager.current = 'product_edit'
 
+    def cart_row(self, item):
+        """Строка RecycleView для позиции накладной"""
+        return {
+            'text': f"{item['name']}",
+            'secondary_text': f"{item['quantity']} x {item['price']:.2f} = {item['total']:.2f}",
+            'icon': "package-variant",
+            'item': item,
+            'callback': self.edit_item,
+        }
+
     def update_invoice_items(self):
-        """Обновление списка товаров в накладной и кнопки итого"""
+        """Полное обновление списка товаров в накладной и кнопки итого
+
+        Нужно при входе на экран и после сохранения: накладную могли изменить
+        другие экраны. Сканирование и правка позиции обновляют одну строку.
+        """
         if not hasattr(self, 'ids'):
             return
 
-        # Обновляем список товаров
         if 'invoice_items' in self.ids:
-            self.ids.invoice_items.clear_widgets()
-
-            # Просто отображаем товары если они есть
-            for item in self.app.current_invoice:
-                icon = IconLeftWidget(icon="package-variant")
-                list_item = TwoLineIconListItem(
-                    text=f"{item['name']}",
-                    secondary_text=f"{item['quantity']} x {item['price']:.2f} = {item['total']:.2f}",
-                    on_release=lambda x, i=item: self.edit_item(i)
-                )
-                list_item.add_widget(icon)
-                self.ids.invoice_items.add_widget(list_item)
+            self.ids.invoice_items.data = [self.cart_row(item) for item in self.app.current_invoice]
 
-        # Обновляем кнопку итого
         self.total_amount = sum(item['total'] for item in self.app.current_invoice)
+        self.update_total_button()
+
+    def append_cart_row(self, item):
+        """Добавление строки новой позиции в конец списка"""
+        if 'invoice_items' in self.ids:
+            self.ids.invoice_items.data.append(self.cart_row(item))
+        self.total_amount += item['total']
+        self.update_total_button()
+
+    def update_cart_row(self, index, previous_total):
+        """Обновление строки позиции после изменения количества или цены"""
+        item = self.app.current_invoice[index]
+        if 'invoice_items' in self.ids:
+            # Замена одного элемента data перерисовывает только эту строку
+            self.ids.invoice_items.data[index] = self.cart_row(item)
+        self.total_amount += item['total'] - previous_total
+        self.update_total_button()
 
+    def remove_cart_row(self, index, item):
+        """Удаление строки позиции из списка"""
+        if 'invoice_items' in self.ids:
+            del self.ids.invoice_items.data[index]
+        self.total_amount -= item['total']
+        self.update_total_button()
+
+    def update_total_button(self):
+        """Обновление суммы и цвета кнопки итого"""
         if 'total_button' in self.ids:
             self.ids.total_button.text = f"ИТОГО: {self.total_amount:.2f}"
 
@@ -316,9 +343,9 @@ class ScanInvoiceScreen(Screen):
         """Удалить товар из накладной"""
         if hasattr(self, 'item_index'):
             if 0 <= self.item_index < len(self.app.current_invoice):
-                del self.app.current_invoice[self.item_index]
+                item = self.app.current_invoice.pop(self.item_index)
                 self.edit_dialog.dismiss()
-                self.update_invoice_items()
+                self.remove_cart_row(self.item_index, item)
                 self.show_snackbar("Товар удален из накладной")
 
     def save_item_changes(self):
@@ -335,12 +362,14 @@ class ScanInvoiceScreen(Screen):
                 self.show_snackbar("Цена не может быть отрицательной")
                 return
 
-            self.app.current_invoice[self.item_index]['quantity'] = new_quantity
-            self.app.current_invoice[self.item_index]['price'] = new_price
-            self.app.current_invoice[self.item_index]['total'] = new_quantity * new_price
+            item = self.app.current_invoice[self.item_index]
+            previous_total = item['total']
+            item['quantity'] = new_quantity
+            item['price'] = new_price
+            item['total'] = new_quantity * new_price
 
             self.edit_dialog.dismiss()
-            self.update_invoice_items()
+            self.update_cart_row(self.item_index, previous_total)
             self.show_snackbar("Товар обновлен")
 
     def save_invoice(self):
@@ -349,28 +378,18 @@ class ScanInvoiceScreen(Screen):
             self.show_snackbar("Накладная пуста! Добавьте товары.", 2.0)
             return
 
-        # Сохраняем накладную с указанием статуса оплаты (булево значение)
-        invoice_id = self.app.db.create_invoice(
-            total=self.total_amount,
-            payment_status=self.payment_status,  # Используем булево значение
-            additional_info=""
-        )
-
-        # Сохраняем товары накладной
-        for item in self.app.current_invoice:
-            self.app.db.add_invoice_item(
-                invoice_id=invoice_id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-                price=item['price'],
-                total=item['total']
+        # Сохраняем накладную, позиции и списание остатков одной транзакцией
+        try:
+            invoice_id = self.app.db.commit_sale(
+                self.app.current_invoice,
+                payment_status=self.payment_status,  # Используем булево значение
+                additional_info="",
+                # Накопленная сумма для экрана могла набрать ошибку округления - для записи считаем заново
+                total=sum(item['total'] for item in self.app.current_invoice)
             )
-
-            # Обновляем количество товара на складе
-            product = self.app.db.find_product_by_id(item['product_id'])
-            if product:
-                new_quantity = max(0, product['quantity'] - item['quantity'])
-                self.app.db.update_product_quantity(item['product_id'], new_quantity)
+        except Exception as e:
+            self.show_snackbar(f"Ошибка сохранения накладной: {str(e)}", 3)
+            return
 
         # Очищаем текущую накладную
         self.app.current_invoice = []
@@ -0,0 +1,6 @@
+# tests/__init__.py
+"""Проверки слоя данных без интерфейса.
+
+Запуск из каталога pos_app:
+    python -m unittest discover -s tests -t .
+"""
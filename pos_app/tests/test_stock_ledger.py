@@ -0,0 +1,81 @@
+# test_stock_ledger.py
+"""Остатки при продаже, правке и удалении накладной"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.database.database_manager import DatabaseManager
+
+
+class StockLedgerTest(unittest.TestCase):
+    """Возврат на склад не больше списанного по накладной"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="pos_test_")
+        self.db = DatabaseManager(os.path.join(self.work_dir, 'pos.db'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def add_product(self, quantity):
+        return self.db.add_product("4600000000017", "Молоко", 10, 6, quantity)
+
+    def stock(self, product_id):
+        return self.db.find_product_by_id(product_id)['quantity']
+
+    @staticmethod
+    def line(product_id, quantity):
+        return {'product_id': product_id, 'quantity': quantity, 'price': 10, 'total': quantity * 10}
+
+    def test_zero_stock_sale_edit_and_delete(self):
+        product_id = self.add_product(0)
+        invoice_id = self.db.commit_sale([self.line(product_id, 5)])
+        self.assertEqual(self.stock(product_id), 0)
+        # Продажа без остатка видна в журнале нулевым движением
+        self.assertEqual([(m['kind'], m['quantity']) for m in self.db.get_stock_movements(product_id)],
+                         [('sale', 0)])
+
+        self.db.apply_invoice_diff(invoice_id, [self.line(product_id, 1)])
+        self.assertEqual(self.stock(product_id), 0)
+
+        self.db.delete_invoice(invoice_id)
+        self.assertEqual(self.stock(product_id), 0)
+
+    def test_partial_stock_sale_returns_only_written_off(self):
+        product_id = self.add_product(3)
+        invoice_id = self.db.commit_sale([self.line(product_id, 5)])
+        self.assertEqual(self.stock(product_id), 0)
+
+        self.db.apply_invoice_diff(invoice_id, [self.line(product_id, 4)])
+        self.assertEqual(self.stock(product_id), 1)
+
+        self.db.delete_invoice(invoice_id)
+        self.assertEqual(self.stock(product_id), 3)
+
+    def test_pre_ledger_invoice_edit_and_delete(self):
+        product_id = self.add_product(10)
+        # Накладная из версии без журнала: позиции есть, движений продажи нет
+        created = "2020-01-01 12:00:00"
+        self.db.conn.execute('''
+        INSERT INTO invoices (date, total, payment_status, additional_info, created_at)
+        VALUES (?, 50, 'Оплачено', '', ?)
+        ''', (created, created))
+        invoice_id = self.db.conn.execute("SELECT MAX(id) FROM invoices").fetchone()[0]
+        self.db.conn.execute('''
+        INSERT INTO invoice_items (invoice_id, product_id, quantity, price, total, cost_price)
+        VALUES (?, ?, 5, 10, 50, 6)
+        ''', (invoice_id, product_id))
+        self.db.conn.commit()
+
+        # Правка и удаление одинаково считают позиции списанными
+        self.db.apply_invoice_diff(invoice_id, [self.line(product_id, 2)])
+        self.assertEqual(self.stock(product_id), 13)
+
+        self.db.delete_invoice(invoice_id)
+        self.assertEqual(self.stock(product_id), 15)
+
+
+if __name__ == '__main__':
+    unittest.main()